@@ -17,10 +17,7 @@ def run_analysis(file_name):
         for f in file_name:
             fig_name = f.split('/')[-1].split('.')[0]
             p,l,data_rec = get_data(f)
-            if p.has_key('cue_reliability'):
-                cue_reliability = p['cue_reliability']
-            else:
-                cue_reliability = p[' cue_reliability']
+            cue_reliability = p['cue_reliability']
 
             if isinstance(cue_reliability, float):
                 for cue in cue_conds:
@@ -35,10 +32,7 @@ def run_analysis(file_name):
     else:
         fig_name = file_name[0].split('/')[-1].split('.')[0]
         p,l,data_rec = get_data(file_name[0])
-        if p.has_key('cue_reliability'):
-            cue_reliability = p['cue_reliability']
-        else:
-            cue_reliability = p[' cue_reliability']
+        cue_reliability = p['cue_reliability']
 
         if isinstance(cue_reliability, float):
             for cue in cue_conds:
@@ -46,7 +40,7 @@ def run_analysis(file_name):
                                 cue_cond=cue,
                                 fit_func=fit_func)
         else:
-            print fig_name
+            print(fig_name)
             analyze_constant(file_name[0], fig_name= fig_name + '_neutral',
                             cue_cond='other',
                             fit_func=fit_func)
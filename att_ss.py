@@ -141,7 +141,7 @@ if __name__ == "__main__":
     # Wait for an iti before starting the first trial:
     core.wait(p.iti)
 
-    for trial in xrange(p.n_trials):
+    for trial in range(p.n_trials):
         # Randomly choose a side for the cue:
         side_idx = np.random.randint(2)
         cue_side = sides[side_idx]
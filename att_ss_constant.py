@@ -198,7 +198,7 @@ if __name__ == "__main__":
     center_contrast2 = conds[cond_randomizer][:, 0]
     center_comparison2 = conds[cond_randomizer][:,1]
     
-    for trial in xrange(n_trials):
+    for trial in range(n_trials):
         # Randomly choose a side for the cue:
         side_idx = np.random.randint(2)
         cue_side = sides[side_idx]
@@ -0,0 +1,339 @@
+"""
+
+Timing benchmarks for the analysis tools. Run as a script:
+
+    python benchmarks.py [path_to_files]
+
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+import tools
+
+
+def _time(func, repeat=3):
+    """
+    The best of `repeat` runs of func(), in seconds
+    """
+    best = np.inf
+    for i in range(repeat):
+        t0 = time.time()
+        func()
+        best = min(best, time.time() - t0)
+    return best
+
+
+def _legacy_get_data(file_name):
+    """
+    The loader that get_data used to be: the header is read line by line and
+    the file is then parsed again for the body (with csv2rec where matplotlib
+    still has it, otherwise with np.genfromtxt)
+    """
+    file_read = open(file_name,'r')
+    l = file_read.readline()
+    p = {}
+    l = file_read.readline()
+    n_header = 2
+    if l=='':
+        return p,l,[]
+    while l[0]=='#':
+        try:
+            p[l[1:l.find(':')-1]]=float(l[l.find(':')+1:l.find('\n')])
+        except:
+            p[l[2:l.find(':')-1]]=l[l.find(':')+1:l.find('\n')]
+        l = file_read.readline()
+        n_header += 1
+    file_read.close()
+    try:
+        from matplotlib.mlab import csv2rec
+        data_rec = csv2rec(file_name)
+    except ImportError:
+        data_rec = np.genfromtxt(file_name, delimiter=',', names=True,
+                                 dtype=None, skip_header=n_header - 1,
+                                 autostrip=True).view(np.recarray)
+    return p,l,data_rec
+
+
+def bench_get_data(path_to_files='./data/'):
+    """
+    Compare reading all the data files with the single-pass reader in
+    `get_data` to the legacy two-pass reader
+    """
+    files = [os.path.join(path_to_files, f) for f in
+             sorted(os.listdir(path_to_files)) if f.endswith('.csv')]
+    t_new = _time(lambda: [tools.get_data(f, cache=False) for f in files])
+    t_old = _time(lambda: [_legacy_get_data(f) for f in files])
+    print("get_data, %d files:"%len(files))
+    print("  legacy reader:      %.3f s"%t_old)
+    print("  single-pass reader: %.3f s (%.1fx)"%(t_new, t_old / t_new))
+
+
+def _legacy_proportions(data_rec, contrast=0.3):
+    """
+    How analyze_constant used to select the cued trials at one base contrast
+    and compute the proportion of '1' answers for each trial, looping over
+    trials
+    """
+    cue_cond_idx = np.where(data_rec['cue_side']==data_rec['ask_side'])[0]
+    base_contrast = []
+    for i, ask_side in enumerate(data_rec['ask_side'][cue_cond_idx]):
+        base_contrast.append(data_rec[ask_side + '_contrast2'][cue_cond_idx][i])
+    c_idx = np.where(np.abs(np.array(base_contrast)-contrast)<0.01)[0]
+    this_ask = data_rec['ask_contrast'][cue_cond_idx][c_idx]
+    this_ans = 1 - (data_rec['answer'][cue_cond_idx][c_idx] - 1)
+    y = []
+    for i in range(len(this_ans)):
+        y.append(np.mean(this_ans[this_ask==this_ask[i]]))
+    return np.array(y)
+
+
+def _proportions(data_rec, contrast=0.3):
+    """
+    The same as `_legacy_proportions`, as analyze_constant now does it
+    """
+    cond_rec = data_rec[data_rec['cue_side']==data_rec['ask_side']]
+    base_contrast = tools._side_contrast(cond_rec, 'contrast2')
+    c_rec = cond_rec[np.abs(base_contrast - contrast) < 0.01]
+    return tools._group_mean(1 - (c_rec['answer'] - 1), c_rec['ask_contrast'])
+
+
+def bench_analyze_constant(path_to_files='./data/', boot=100):
+    """
+    Time the per-session trial selection and proportions, before and after
+    vectorization, and the whole of analyze_constant
+    """
+    files = [os.path.join(path_to_files, f) for f in
+             sorted(os.listdir(path_to_files)) if f.endswith('.csv')]
+    recs = [d for p,l,d in [tools.get_data(f) for f in files] if len(d)]
+    t_old = _time(lambda: [_legacy_proportions(d) for d in recs])
+    t_new = _time(lambda: [_proportions(d) for d in recs])
+    print("Trial selection and proportions, per session:")
+    print("  trial loops: %.2f ms"%(1000 * t_old / len(recs)))
+    print("  vectorized:  %.2f ms (%.1fx)"%(1000 * t_new / len(recs),
+                                          t_old / t_new))
+
+    for boot_method in ['loop', 'batch']:
+        t = _time(lambda: tools.analyze_constant(files[0], boot=boot,
+                                                 verbose=False,
+                                                 boot_method=boot_method),
+                  repeat=1)
+        print("analyze_constant, %d %s bootstraps: %.2f s"%(boot, boot_method,
+                                                           t))
+
+
+def bench_quantiles(b_list=(1000, 10000, 100000), seed=0):
+    """
+    Check the accuracy of the streaming `P2Quantile` estimates of the 16th
+    and 84th percentiles against the exact order statistics, and compare the
+    time of a full sort, np.partition and streaming
+    """
+    rng = np.random.RandomState(seed)
+    print("Bootstrap percentiles (16, 84), streaming vs. exact:")
+    for b in b_list:
+        for name, values in [('normal', rng.randn(b)),
+                             ('lognormal', rng.lognormal(0, 0.5, b))]:
+            t_sort = _time(lambda: np.sort(values)[[int(0.16 * b),
+                                                    int(0.84 * b)]])
+            t_part = _time(lambda: tools.order_statistic(values,
+                                                         [0.16, 0.84]))
+            exact = tools.order_statistic(values, [0.16, 0.84])
+            t0 = time.time()
+            est = []
+            for q in [0.16, 0.84]:
+                p2 = tools.P2Quantile(q)
+                p2.update(values)
+                est.append(p2.value)
+            t_p2 = time.time() - t0
+            err = np.abs(np.array(est) - exact) / np.std(values)
+            print("  b=%6d %-9s  max error %.4f SD  sort %.4f s, "
+                  "partition %.4f s, streaming %.2f s"%(b, name, np.max(err),
+                                                       t_sort, t_part, t_p2))
+
+
+def bench_fit_batch(n_fits=500, seed=0):
+    """
+    Time fitting many simulated Weibull curves (threshold and slope) one at a
+    time with `tools.fit_counts` and all at once with `tools.fit_th_batch`
+    """
+    rng = np.random.RandomState(seed)
+    x = np.linspace(0.05, 0.6, 8)
+    n_trials = np.ones((n_fits, len(x)), dtype=int) * 30
+    p = tools.weibull(x, rng.uniform(0.2, 0.4, (n_fits, 1)),
+                      rng.uniform(2, 5, (n_fits, 1)), 0.5, 0.99)
+    y = rng.binomial(n_trials, p) / 30.0
+    initial = (0.3, 3.5, 0.5, 0.99)
+    free = [True, True, False, False]
+    bounds = [(-np.inf, np.inf)] * 4
+    t_loop = _time(lambda: [tools.fit_th_batch(x, y[i:i+1], n_trials[i:i+1],
+                                               initial, 'weib', free, bounds)
+                            for i in range(n_fits)], repeat=1)
+    t_batch = _time(lambda: tools.fit_th_batch(x, y, n_trials, initial,
+                                               'weib', free, bounds))
+    print("%d Weibull fits:"%n_fits)
+    print("  one at a time: %.3f s"%t_loop)
+    print("  all at once:   %.3f s (%.1fx)"%(t_batch, t_loop / t_batch))
+
+
+def _legacy_psychometric_jac(x, params, fit_func='cumgauss'):
+    """
+    How psychometric_jac used to compute the function and its derivatives,
+    allocating all the temporaries
+    """
+    from scipy.special import erf
+    jac = np.zeros((len(params),) + x.shape)
+    if fit_func == 'cumgauss':
+        mu, sigma = params[:2]
+        z = (x - mu) / sigma
+        p = 0.5 * (1 + erf(z / np.sqrt(2)))
+        jac[0] = -np.exp(-z ** 2 / 2) / (np.sqrt(2 * np.pi) * sigma)
+        jac[1] = jac[0] * z
+    else:
+        thresh, slope, guess, flake = params
+        threshy = 1 - (1 - guess) * np.exp(-1)
+        k = (-np.log((1 - threshy) / (1 - guess))) ** (1 / slope)
+        u = (k * x / thresh) ** slope
+        e = np.exp(-u)
+        p = flake - (flake - guess) * e
+        jac[0] = -(flake - guess) * e * u * slope / thresh
+        jac[1] = (flake - guess) * e * u * np.log(k * x / thresh)
+        jac[2] = e
+        jac[3] = 1 - e
+    return p, jac
+
+
+def bench_kernels(n_fits=10000, n_levels=11, seed=0):
+    """
+    Time the psychometric functions and their derivatives for many curves:
+    the functions alone, the legacy function and derivatives, and the fused
+    kernels writing into preallocated buffers (numpy and, if it is installed,
+    numba)
+    """
+    rng = np.random.RandomState(seed)
+    x = rng.uniform(0.05, 0.7, (n_fits, n_levels))
+    params = dict(cumgauss=[rng.uniform(0.2, 0.5, (n_fits, 1)),
+                            rng.uniform(0.02, 0.2, (n_fits, 1))],
+                  weib=[rng.uniform(0.2, 0.5, (n_fits, 1)),
+                        rng.uniform(2, 5, (n_fits, 1)), 0.5, 0.99])
+    func = dict(cumgauss=tools.cumgauss, weib=tools.weibull)
+    use_numba = tools.use_numba
+    print("Psychometric kernels, %d x %d:"%(n_fits, n_levels))
+    for fit_func in ['cumgauss', 'weib']:
+        these = params[fit_func]
+        out = (np.empty(x.shape), np.empty((len(these),) + x.shape))
+        t_func = _time(lambda: func[fit_func](x, *these))
+        t_old = _time(lambda: _legacy_psychometric_jac(x, these, fit_func))
+        print("  %s: function only %.2f ms, with derivatives %.2f ms"%(
+              fit_func, 1000 * t_func, 1000 * t_old))
+        for name, numba in [('numpy', False), ('numba', True)]:
+            tools.use_numba = numba
+            try:
+                # Compile before timing:
+                tools.psychometric_jac(x, these, fit_func, out=out)
+            except ImportError:
+                continue
+            t_new = _time(lambda: tools.psychometric_jac(x, these, fit_func,
+                                                         out=out))
+            print("    fused %s kernel, out=: %.2f ms (%.1fx)"%(
+                  name, 1000 * t_new, t_old / t_new))
+    tools.use_numba = use_numba
+
+
+def bench_cdf_table(sizes=(11, 1000, 200000), seed=0):
+    """
+    Compare cumgauss computed with erf to cumgauss interpolated in the table
+    of the normal CDF (`tools.use_cdf_table`): the largest error, and the
+    time for arrays of a few sizes (a single curve, up to a batch of
+    bootstrap curves)
+    """
+    z = np.linspace(-12, 12, 2000001)
+    err = np.max(np.abs(tools.tabulated_ndtr(z) - tools.ndtr(z)))
+    print("Tabulated normal CDF, largest error: %.1e"%err)
+    rng = np.random.RandomState(seed)
+    use_cdf_table = tools.use_cdf_table
+    for n in sizes:
+        x = rng.rand(n)
+        repeat = max(1, 1000000 // n)
+        t = []
+        for table in [False, True]:
+            tools.use_cdf_table = table
+            t.append(_time(lambda: [tools.cumgauss(x, 0.3, 0.1)
+                                    for i in range(repeat)]) / repeat)
+        print("  cumgauss, %6d values: erf %.1f us, table %.1f us (%.1fx)"%(
+              n, 1e6 * t[0], 1e6 * t[1], t[0] / t[1]))
+    tools.use_cdf_table = use_cdf_table
+
+
+def _synthetic_df(n_subjects=16, seed=0):
+    """
+    A df like the first output of `tools.get_df`, with the proportions of
+    each subject and condition simulated around a known fit
+    """
+    import pandas as pd
+    rng = np.random.RandomState(seed)
+    x = np.linspace(0.1, 0.7, 8)
+    df = {}
+    for sub in range(n_subjects):
+        df[sub] = {}
+        for center_ori in [0, 90]:
+            for surr_ori in [0, 90]:
+                df[sub][center_ori, surr_ori] = {}
+                for cue in ['cued', 'other', 'neutral']:
+                    params = np.array([0.3 + 0.1 * rng.rand(),
+                                       0.05 + 0.1 * rng.rand()])
+                    y = tools.cumgauss(x, *params) + 0.05 * rng.randn(len(x))
+                    df[sub][center_ori, surr_ori][cue] = dict(x=x, y=y,
+                                                              fit=(params, 1))
+    return pd.DataFrame(df)
+
+
+def bench_split_half(n_subjects=16, n_splits=10000):
+    """
+    Time repeated split-half model evaluation, one split per call against
+    all the splits in one call
+    """
+    df = _synthetic_df(n_subjects)
+    n_calls = 20
+    t_loop = _time(lambda: [tools.model_evaluation_split_half(df)
+                            for i in range(n_calls)], repeat=1)
+    t_vec = _time(lambda: tools.model_evaluation_split_half(df, n_splits,
+                                                            seed=0), repeat=1)
+    print("Split-half model evaluation, %d subjects, %d splits:"%(n_subjects,
+                                                                 n_splits))
+    print("  one split per call: %.1f s (extrapolated from %d calls)"%(
+          t_loop * n_splits / n_calls, n_calls))
+    print("  all splits at once: %.2f s"%t_vec)
+
+
+def bench_staircase(n_trials=300, bootstrap_n=1000, seed=0):
+    """
+    Time `tools.Staircase.analyze` on a simulated staircase, fitting the boot
+    samples one at a time and all at once
+    """
+    rng = np.random.RandomState(seed)
+    st = tools.Staircase(0.5, 0.05)
+    for i in range(n_trials):
+        st.update(rng.rand() < tools.weibull(st.value, 0.3, 3.5, 0.5, 0.99))
+    print("Staircase analysis, %d trials, %d boot samples:"%(n_trials,
+                                                            bootstrap_n))
+    for method in ['leastsq', 'lm']:
+        t = _time(lambda: st.analyze(bootstrap_n=bootstrap_n, method=method),
+                  repeat=1)
+        print("  %-7s  %.3f s"%(method, t))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        path_to_files = sys.argv[1]
+    else:
+        path_to_files = './data/'
+    bench_get_data(path_to_files)
+    bench_analyze_constant(path_to_files)
+    bench_quantiles()
+    bench_kernels()
+    bench_cdf_table()
+    bench_fit_batch()
+    bench_split_half()
+    bench_staircase()
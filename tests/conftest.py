@@ -0,0 +1,6 @@
+import os
+import sys
+
+os.environ.setdefault('MPLBACKEND', 'Agg')
+# The analysis tools are a module at the top of the repository:
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
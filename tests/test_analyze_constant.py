@@ -0,0 +1,102 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+import tools
+
+test_dir = os.path.dirname(__file__)
+data_dir = os.path.join(test_dir, os.pardir, 'data') + '/'
+data_file = data_dir + 'S01HS_0_0_02092012_1_att_ss.csv'
+with open(os.path.join(test_dir, 'data', 'baseline.json')) as f:
+    baseline = json.load(f)['analyze_constant']
+
+
+def _case_id(case):
+    return '%s-%s-%s-%s'%(case['file'][:-11], case['cue_cond'],
+                          case['even_or_odd'], case['fit_func'])
+
+
+@pytest.fixture(autouse=True)
+def no_disk_cache(monkeypatch):
+    monkeypatch.setattr(tools, 'data_cache_dir', None)
+
+
+@pytest.mark.parametrize('case', baseline, ids=_case_id)
+def test_baseline_leastsq(case):
+    # With leastsq and the bootstrap drawn from the global random state, the
+    # results are those of the original implementation:
+    np.random.seed(7)
+    result = tools.analyze_constant(data_dir + case['file'],
+                                    cue_cond=case['cue_cond'],
+                                    fit_func=case['fit_func'],
+                                    even_or_odd=case['even_or_odd'],
+                                    boot=20, verbose=False,
+                                    fit_method='leastsq')
+    for k, v in case['result'].items():
+        np.testing.assert_allclose(np.asarray(result[k], dtype=float), v,
+                                   rtol=1e-6, atol=1e-8, err_msg=k)
+
+
+@pytest.mark.parametrize('case', [c for c in baseline
+                                  if c['fit_func'] == 'cumgauss'],
+                         ids=_case_id)
+def test_baseline_lm(case):
+    result = tools.analyze_constant(data_dir + case['file'],
+                                    cue_cond=case['cue_cond'],
+                                    even_or_odd=case['even_or_odd'],
+                                    boot=2, verbose=False)
+    for k in ['x', 'y', 'trials']:
+        np.testing.assert_allclose(result[k], case['result'][k], rtol=1e-12)
+    if not case['even_or_odd']:
+        # 'lm' (the default for cumgauss) fits at least as well as leastsq:
+        x, y, n = [np.array(case['result'][k]) for k in ['x', 'y', 'trials']]
+        ss = lambda fit: np.sum(n * (y - tools.cumgauss(x, *fit)) ** 2)
+        assert (ss(result['fit'][0]) <=
+                ss(case['result']['fit'][0]) * (1 + 1e-8))
+
+
+
+@pytest.mark.parametrize('case', [c for c in baseline
+                                  if c['fit_func'] == 'weib' and
+                                  not c['even_or_odd']],
+                         ids=_case_id)
+def test_baseline_lm_weib(case):
+    # With the asymptotes free, LM used to drift to a curve with a negative
+    # slope and flipped asymptotes (e.g. [0.539, -4.03, 1.115, 0.023] for
+    # S01HS cued). The weibull is now bounded as in fit_mle:
+    result = tools.analyze_constant(data_dir + case['file'],
+                                    cue_cond=case['cue_cond'],
+                                    fit_func='weib', fit_method='lm',
+                                    boot=2, verbose=False)
+    fit = result['fit'][0]
+    lb, ub = np.array(tools._lm_bounds['weib']).T
+    assert np.all((fit >= lb) & (fit <= ub))
+    # Where leastsq stays within these bounds, LM fits as well as it:
+    expected = np.array(case['result']['fit'][0])
+    if np.all((expected >= lb) & (expected <= ub)):
+        x, y, n = [np.array(case['result'][k]) for k in ['x', 'y', 'trials']]
+        ss = lambda fit: np.sum(n * (y - tools.weibull(x, *fit)) ** 2)
+        np.testing.assert_allclose(ss(fit), ss(expected), rtol=1e-6)
+        np.testing.assert_allclose(fit[0], expected[0], rtol=1e-4)
+
+@pytest.mark.parametrize('boot_method', ['loop', 'batch', 'counts'])
+def test_seed(boot_method):
+    a, b = [tools.analyze_constant(data_file, boot=50, verbose=False, seed=3,
+                                   boot_method=boot_method)
+            for i in range(2)]
+    for k in ['fit', 'boot_th_lb', 'boot_th_ub', 'boot_sl_lb', 'boot_sl_ub']:
+        np.testing.assert_array_equal(a[k], b[k])
+    assert a['boot_th_lb'][0] <= a['fit'][0][0] <= a['boot_th_ub'][0]
+
+
+@pytest.mark.parametrize('boot_method', ['loop', 'batch', 'counts'])
+def test_n_jobs(boot_method):
+    # For a given seed and number of workers, the results are the same:
+    a, b = [tools.analyze_constant(data_file, boot=40, verbose=False, seed=5,
+                                   boot_method=boot_method, n_jobs=2)
+            for i in range(2)]
+    for k in ['fit', 'boot_th_lb', 'boot_th_ub', 'boot_sl_lb', 'boot_sl_ub']:
+        np.testing.assert_array_equal(a[k], b[k])
+    assert a['boot_th_lb'][0] <= a['fit'][0][0] <= a['boot_th_ub'][0]
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+import tools
+
+
+@pytest.mark.parametrize('dist', ['normal', 'lognormal'])
+def test_p2_quantile(dist):
+    rng = np.random.RandomState(0)
+    values = getattr(rng, dist)(size=20000)
+    for q in [0.025, 0.16, 0.84, 0.975]:
+        p2 = tools.P2Quantile(q)
+        p2.update(values)
+        exact = tools.order_statistic(values, q)
+        # The far tail of the lognormal is the hardest case:
+        assert abs(p2.value - exact) < 0.05 * np.std(values)
+
+
+def test_bootstrap_mean_streaming():
+    rng = np.random.RandomState(1)
+    x = rng.normal(size=50)
+    np.random.seed(2)
+    lb, ub = tools.bootstrap_mean(x, b=20000, streaming=True, chunk=1000)
+    np.random.seed(2)
+    idx = np.random.randint(0, len(x), (20000, len(x)))
+    means = np.mean(x[idx], -1)
+    exact_lb, exact_ub = tools.order_statistic(means, [0.025, 0.975])
+    # The boot means are the same, only the bounds are approximated:
+    tol = 0.02 * np.std(means)
+    assert abs(lb - exact_lb) < tol
+    assert abs(ub - exact_ub) < tol
+    # And they agree with the exact bounds of other boot samples:
+    np.random.seed(3)
+    lb2, ub2 = tools.bootstrap_mean(x, b=20000)
+    assert abs(lb - lb2) < 0.1 * np.std(means)
+    assert abs(ub - ub2) < 0.1 * np.std(means)
+
+
+def test_bootstrap_means():
+    rng = np.random.RandomState(4)
+    samples = [rng.normal(size=n) for n in [20, 35, 50]]
+    lb, ub = tools.bootstrap_means(samples, b=20000, seed=0)
+    assert lb.shape == ub.shape == (3,)
+    np.testing.assert_array_equal(
+        (lb, ub), tools.bootstrap_means(samples, b=20000, seed=0))
+    for x, this_lb, this_ub in zip(samples, lb, ub):
+        se = np.std(x) / np.sqrt(len(x))
+        # Close to the normal-theory interval:
+        assert abs(this_lb - (np.mean(x) - 1.96 * se)) < 0.1 * se
+        assert abs(this_ub - (np.mean(x) + 1.96 * se)) < 0.1 * se
+
+
+def test_bca():
+    stats = pytest.importorskip('scipy.stats')
+    rng = np.random.RandomState(5)
+    # Skewed samples, for which BCa moves the interval from the percentile
+    # one:
+    samples = [rng.exponential(size=30), rng.lognormal(size=40)]
+    lb, ub = tools.bootstrap_means(samples, b=20000, method='bca', seed=0)
+    p_lb, p_ub = tools.bootstrap_means(samples, b=20000, seed=0)
+    assert np.all(lb > p_lb) and np.all(ub > p_ub)
+    for x, this_lb, this_ub in zip(samples, lb, ub):
+        ref = stats.bootstrap((x,), np.mean, n_resamples=20000, method='BCa',
+                              random_state=0).confidence_interval
+        se = np.std(x) / np.sqrt(len(x))
+        assert abs(this_lb - ref.low) < 0.1 * se
+        assert abs(this_ub - ref.high) < 0.1 * se
+    # Without variance, the corrections can't be estimated, and the interval
+    # is the percentile one:
+    lb, ub = tools.bootstrap_means([np.ones(10)], method='bca', seed=0)
+    np.testing.assert_array_equal((lb, ub), ([1], [1]))
@@ -0,0 +1,59 @@
+import os
+
+import numpy as np
+
+import tools
+
+data_dir = os.path.join(os.path.dirname(__file__), os.pardir, 'data')
+data_file = os.path.join(data_dir, 'S01HS_0_0_02092012_1_att_ss.csv')
+
+
+def test_data_cache(tmpdir, monkeypatch):
+    # The disk cache is off unless asked for:
+    assert tools.data_cache_dir == (os.environ.get('ATT_SS_CACHE_DIR') or
+                                    None)
+    p, l, d = tools.get_data(data_file, cache=False)
+    monkeypatch.setattr(tools, 'data_cache_dir', None)
+    tools.clear_data_cache()
+    p1, l1, d1 = tools.get_data(data_file)
+    assert p1 == p
+    np.testing.assert_array_equal(d1, d)
+    # With a cache directory, the parsed file is saved there and read back:
+    monkeypatch.setattr(tools, 'data_cache_dir', str(tmpdir))
+    tools.clear_data_cache()
+    tools.get_data(data_file)
+    assert len(tmpdir.listdir()) == 1
+    tools.clear_data_cache()
+    p2, l2, d2 = tools.get_data(data_file)
+    assert p2 == p
+    np.testing.assert_array_equal(d2, d)
+    tools.clear_data_cache(disk=True)
+    assert len(tmpdir.listdir()) == 0
+
+
+def test_dataset(tmpdir, monkeypatch):
+    monkeypatch.setattr(tools, 'data_cache_dir', None)
+    dataset = tools.load_dataset(tools.compile_dataset(data_dir,
+                                                       str(tmpdir)))
+    for f in dataset.sessions.file_name:
+        for even_or_odd in [False, 'odd']:
+            p, l, d = tools.get_data(os.path.join(data_dir, f),
+                                     even_or_odd=even_or_odd)
+            p2, l2, d2 = dataset.get_data(f, even_or_odd=even_or_odd)
+            assert p2 == p
+            assert d2.dtype.names == d.dtype.names
+            for name in d.dtype.names:
+                np.testing.assert_array_equal(d2[name], d[name])
+
+    idx = dataset.select(subject='S05', center_ori=90, surr_ori=90,
+                         neutral=False)
+    files = sorted(f for f in os.listdir(data_dir)
+                   if f.startswith('S05JV_90_90_'))
+    assert list(dataset.sessions.file_name[idx]) == files
+    trials = dataset.trials(subject='S05', center_ori=90, surr_ori=90,
+                            neutral=False)
+    recs = [tools.get_data(os.path.join(data_dir, f))[2] for f in files]
+    np.testing.assert_array_equal(trials.ask_contrast,
+                                  np.hstack([d.ask_contrast for d in recs]))
+    np.testing.assert_array_equal(trials.session,
+                                  np.repeat(idx, [len(d) for d in recs]))
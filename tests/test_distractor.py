@@ -0,0 +1,38 @@
+import os
+
+import numpy as np
+import pytest
+
+import tools
+
+data_dir = os.path.join(os.path.dirname(__file__), os.pardir, 'data') + '/'
+bins = [(0, 0.19), (0.19, 0.31), (0.31, 0.54), (0.54, 0.64), (0.64, 1.0)]
+
+
+@pytest.mark.parametrize('pool_sessions', [True, False])
+def test_fit_distractor_bins(pool_sessions):
+    # S05 and S07 have more than one session in some conditions:
+    subjects = ['S05', 'S06', 'S07']
+    fits, stats = tools.fit_distractor_bins(bins, data_dir,
+                                            subjects=subjects,
+                                            pool_sessions=pool_sessions)
+    n_differ = 0
+    for k, (low, high) in enumerate(bins):
+        df, df2 = tools.get_df(7, path_to_files=data_dir, file4R=None,
+                               exclude=[1, 2, 3, 4], verbose=False,
+                               distractor_low=low, distractor_high=high)
+        for sub in df:
+            s = stats.subjects.index(sub)
+            for (center_ori, surr_ori), cell in df[sub].items():
+                for cue, this in cell.items():
+                    fit = fits[k, s,
+                               list(stats.center_oris).index(center_ori),
+                               list(stats.surr_oris).index(surr_ori),
+                               stats.cues.index(cue)]
+                    n_differ += not np.allclose(fit, this['fit'][0],
+                                                rtol=1e-8, atol=1e-10)
+    if pool_sessions:
+        # The sessions that get_df fits separately are pooled:
+        assert n_differ > 0
+    else:
+        assert n_differ == 0
@@ -0,0 +1,130 @@
+import numpy as np
+
+import tools
+
+
+def _curves(n_fits=20, seed=0):
+    """Binomial proportions from cumulative Gaussians at 8 levels"""
+    rng = np.random.RandomState(seed)
+    x = np.linspace(0.1, 0.9, 8)
+    n_trials = np.ones((n_fits, len(x)), dtype=int) * 40
+    p = tools.cumgauss(x, rng.uniform(0.4, 0.6, (n_fits, 1)),
+                       rng.uniform(0.05, 0.2, (n_fits, 1)))
+    return x, rng.binomial(n_trials, p) / 40.0, n_trials
+
+
+def test_fit_th_batch_w_asym():
+    x, y, w = _curves()
+    fits = tools.fit_th_batch(x, y, w, (0.5, 0.1))
+    # cumgauss doesn't use the asymptotes, so they stay where they start:
+    fits_asym, info = tools.fit_th_batch(x, y, w, (0.5, 0.1, 0, 1),
+                                         'cumgauss_w_asym', full_output=True)
+    assert np.all(info['converged'])
+    assert np.all(info['nfev'] > 1)
+    np.testing.assert_allclose(fits_asym[:, :2], fits, rtol=1e-5, atol=1e-7)
+    np.testing.assert_array_equal(fits_asym[:, 2:], [[0, 1]] * len(fits))
+
+
+def test_fit_th_leastsq_bounds():
+    # Curves whose mu is near the upper bound, so leastsq tries steps out of
+    # bounds:
+    rng = np.random.RandomState(1)
+    x = np.repeat(np.linspace(0.1, 0.9, 8), 40)
+    for mu in [0.75, 0.85, 0.95]:
+        y = (rng.rand(len(x)) < tools.cumgauss(x, mu, 0.1)).astype(float)
+        leastsq_fit = tools.fit_th(x, y, (0.5, 0.1), method='leastsq')
+        lm_fit = tools.fit_th(x, y, (0.5, 0.1), method='lm')
+        np.testing.assert_allclose(leastsq_fit, lm_fit, atol=1e-4)
+    # Where the best fit is out of bounds, leastsq stops within them:
+    y = (rng.rand(len(x)) < tools.cumgauss(x, 1.2, 0.1)).astype(float)
+    for fit_func, initial in [('cumgauss', (0.5, 0.1)),
+                              ('weib', (0.5, 3.5, 0.5, 0.99))]:
+        fit = tools.fit_th(x, y, initial, fit_func, method='leastsq')
+        assert 0 <= fit[0] <= 1
+
+
+def _neg_log_lik(x, n_correct, n_trials, params, fit_func):
+    p = tools.psychometric_jac(x, params, fit_func)[0]
+    return -np.sum(n_correct * np.log(p) +
+                   (n_trials - n_correct) * np.log(1 - p))
+
+
+def test_fit_mle():
+    rng = np.random.RandomState(3)
+    x = np.linspace(0.1, 0.9, 8)
+    n_trials = np.ones(8, dtype=int) * 200
+    for fit_func, params in [('cumgauss', (0.5, 0.12)),
+                             ('weib', (0.45, 3.5, 0.5, 0.99))]:
+        func = dict(cumgauss=tools.cumgauss, weib=tools.weibull)[fit_func]
+        n_correct = rng.binomial(n_trials, func(x, *params))
+        mle_fit, info = tools.fit_counts(x, n_correct, n_trials, params,
+                                         fit_func, 'mle', full_output=True)
+        assert info['converged']
+        leastsq_fit = tools.fit_counts(x, n_correct, n_trials, params,
+                                       fit_func, 'leastsq')
+        # With many trials, the two fits are close (the Weibull slope is
+        # loosely pinned down with free asymptotes, so only its threshold is
+        # compared):
+        n = 2 if fit_func == 'cumgauss' else 1
+        np.testing.assert_allclose(mle_fit[:n], leastsq_fit[:n], rtol=0.05)
+        nll = lambda p: _neg_log_lik(x, n_correct, n_trials, p, fit_func)
+        assert nll(mle_fit) <= nll(leastsq_fit)
+        if fit_func == 'cumgauss':
+            # At the maximum, away from the bounds, the likelihood is flat:
+            d = 1e-6
+            grad = [(nll(mle_fit + d * e) - nll(mle_fit - d * e)) / (2 * d)
+                    for e in np.eye(2)]
+            np.testing.assert_allclose(grad, 0, atol=1e-2)
+
+
+def test_mle_gradient():
+    # The gradient that fit_mle hands to the optimizer, from the analytic
+    # derivatives, against finite differences of the likelihood:
+    x = np.linspace(0.1, 0.9, 8)
+    n_trials = np.array([20, 25, 30, 20, 25, 30, 20, 25])
+    n_correct = np.array([10, 12, 16, 14, 19, 25, 18, 24])
+    for fit_func, params in [('cumgauss', (0.45, 0.2)),
+                             ('weib', (0.4, 3., 0.45, 0.97))]:
+        params = np.array(params)
+        p, jac = tools.psychometric_jac(x, params, fit_func)
+        grad = -np.dot(jac, (n_correct - n_trials * p) / (p * (1 - p)))
+        d = 1e-6
+        nll = lambda q: _neg_log_lik(x, n_correct, n_trials, q, fit_func)
+        fd = [(nll(params + d * e) - nll(params - d * e)) / (2 * d)
+              for e in np.eye(len(params))]
+        np.testing.assert_allclose(grad, fd, rtol=1e-5, atol=1e-6)
+
+
+def test_fit_counts_methods():
+    rng = np.random.RandomState(2)
+    x = np.linspace(0.1, 0.9, 8)
+    n_trials = np.array([30, 30, 0, 30, 30, 30, 30, 30])
+    for fit_func, params, initial in [
+            ('cumgauss', (0.5, 0.12), (0.5, 1)),
+            ('weib', (0.45, 3.5, 0.5, 0.99), (0.5, 3.5, 0.5, 0.99))]:
+        func = dict(cumgauss=tools.cumgauss, weib=tools.weibull)[fit_func]
+        p = func(x, *params)
+        for i in range(5):
+            n_correct = rng.binomial(n_trials, p)
+            lm_fit, info = tools.fit_counts(x, n_correct, n_trials, initial,
+                                            fit_func, 'lm', full_output=True)
+            assert info['converged']
+            leastsq_fit = tools.fit_counts(x, n_correct, n_trials, initial,
+                                           fit_func, 'leastsq')
+            # Both find the same least-squares fit. Where the data look like
+            # a step, the Weibull slope isn't pinned down, so only the sums of
+            # squares are compared:
+            ss = lambda fit: np.sum(n_trials * (n_correct / n_trials.clip(1) -
+                                                func(x, *fit)) ** 2)
+            np.testing.assert_allclose(ss(lm_fit), ss(leastsq_fit), rtol=1e-4)
+            if fit_func == 'cumgauss':
+                np.testing.assert_allclose(lm_fit, leastsq_fit, rtol=1e-4,
+                                           atol=1e-5)
+            # Which is the same as fitting the trials themselves:
+            keep = n_trials > 0
+            y = np.hstack([np.repeat([1., 0.], [k, n - k]) for k, n in
+                           zip(n_correct[keep], n_trials[keep])])
+            trial_fit = tools.fit_th(np.repeat(x[keep], n_trials[keep]), y,
+                                     initial, fit_func, 'leastsq')
+            np.testing.assert_allclose(ss(trial_fit), ss(leastsq_fit),
+                                       rtol=1e-4)
@@ -0,0 +1,107 @@
+import os
+
+import numpy as np
+import pytest
+
+import tools
+
+data_dir = os.path.join(os.path.dirname(__file__), os.pardir, 'data') + '/'
+kwargs = dict(path_to_files=data_dir, file4R=None, verbose=False, boots=20, seed=1)
+
+
+@pytest.fixture(autouse=True)
+def no_disk_cache(monkeypatch):
+    monkeypatch.setattr(tools, 'data_cache_dir', None)
+
+
+def _assert_same(df_a, df2_a, df_b, df2_b):
+    assert list(df_a.columns) == list(df_b.columns)
+    for sub in df_a.columns:
+        for cond, cell in df_a[sub].items():
+            for cue, this in cell.items():
+                for k in ['x', 'y', 'trials', 'fit', 'boot_th_lb',
+                          'boot_th_ub', 'boot_sl_lb', 'boot_sl_ub']:
+                    np.testing.assert_array_equal(
+                        np.asarray(this[k], dtype=float),
+                        np.asarray(df_b[sub][cond][cue][k], dtype=float),
+                        err_msg='%s %s %s %s'%(sub, cond, cue, k))
+    assert df2_a.equals(df2_b)
+
+
+def test_n_jobs():
+    serial = tools.get_df(2, n_jobs=1, **kwargs)
+    parallel = tools.get_df(2, n_jobs=2, **kwargs)
+    _assert_same(*(serial + parallel))
+
+
+def test_dataset(tmpdir):
+    dataset = tools.compile_dataset(data_dir, str(tmpdir))
+    from_files = tools.get_df(2, **kwargs)
+    from_dataset = tools.get_df(2, dataset=dataset, **kwargs)
+    _assert_same(*(from_files + from_dataset))
+
+
+def test_group_results():
+    df, df2 = tools.get_df(2, **kwargs)
+    res, res_df2 = tools.get_df(2, as_results=True, **kwargs)
+    assert res_df2.equals(df2)
+    assert res.params.shape[:4] == (2, 2, 2, 3)
+    n_levels = 0
+    for s, sub in enumerate(res.subjects):
+        for c, center_ori in enumerate(res.oris):
+            for u, surr_ori in enumerate(res.oris):
+                for q, cue in enumerate(res.cue_conds):
+                    this = df[sub][center_ori, surr_ori][cue]
+                    np.testing.assert_array_equal(res.params[s, c, u, q],
+                                                  this['fit'][0])
+                    n_levels += len(this['x'])
+
+    cued = res.sel('params', cue='cued')
+    assert cued.shape == res.params.shape[:3] + res.params.shape[-1:]
+    q = res.cue_conds.index('cued')
+    np.testing.assert_array_equal(cued, res.params[:, :, :, q])
+    sub = res.subjects[1]
+    np.testing.assert_array_equal(
+        res.sel('th_lb', subject=sub, center_ori=90, surr_ori=0, cue='cued'),
+        df[sub][90, 0]['cued']['boot_th_lb'][0])
+    with pytest.raises(ValueError):
+        res.sel('params', contrast=0)
+
+    long_df = res.to_long()
+    assert len(long_df) == np.prod(res.params.shape[:4])
+    levels_df = res.to_long(levels=True)
+    assert len(levels_df) == n_levels
+    assert not levels_df[['x', 'y', 'trials']].isnull().values.any()
+
+
+def test_store(tmpdir):
+    plain = tools.get_df(2, **kwargs)
+    store = tools.AnalysisStore(str(tmpdir))
+    first = tools.get_df(2, store=store, **kwargs)
+    n_files = len(tmpdir.listdir())
+    assert n_files > 0
+    again = tools.get_df(2, store=store, **kwargs)
+    assert len(tmpdir.listdir()) == n_files
+    _assert_same(*(first + again))
+    # The store seeds each analysis by its data file, so only the fits (and
+    # not the boot samples) are the same as without it:
+    for sub in plain[0].columns:
+        for cond, cell in plain[0][sub].items():
+            for cue, this in cell.items():
+                np.testing.assert_array_equal(
+                    this['fit'], first[0][sub][cond][cue]['fit'])
+
+
+def test_store_no_seed(tmpdir):
+    # Without a seed, the analyses must still be found in the store, with
+    # any number of workers:
+    unseeded = dict(kwargs, seed=None, boots=5)
+    store = str(tmpdir)
+    first = tools.get_df(2, store=store, n_jobs=2, **unseeded)
+    n_files = len(tmpdir.listdir())
+    again = tools.get_df(2, store=store, n_jobs=2, **unseeded)
+    assert len(tmpdir.listdir()) == n_files
+    _assert_same(*(first + again))
+    serial = tools.get_df(2, store=store, n_jobs=1, **unseeded)
+    assert len(tmpdir.listdir()) == n_files
+    _assert_same(*(first + serial))
@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+
+import tools
+
+x = np.linspace(0.05, 1, 11)
+# Two sets of parameters, broadcast against the levels:
+cumgauss_params = [np.array([[0.4], [0.6]]), np.array([[0.1], [0.25]])]
+weib_params = [np.array([[0.4], [0.6]]), np.array([[3.5], [2.]]),
+               np.array([[0.5], [0.1]]), np.array([[0.99], [0.95]])]
+
+
+def _finite_differences(func, params, h=1e-6):
+    """
+    Central differences of func(x, *params) with respect to each parameter
+    """
+    jac = []
+    for i in range(len(params)):
+        up = list(params)
+        down = list(params)
+        up[i] = params[i] + h
+        down[i] = params[i] - h
+        jac.append((func(x, *up) - func(x, *down)) / (2 * h))
+    return jac
+
+
+@pytest.mark.parametrize('fit_func', ['cumgauss', 'weib'])
+def test_jac(fit_func):
+    if fit_func == 'cumgauss':
+        func, jac_func, params = (tools.cumgauss, tools.cumgauss_jac,
+                                  cumgauss_params)
+    else:
+        func, jac_func, params = tools.weibull, tools.weibull_jac, weib_params
+    out = jac_func(x, *params)
+    assert len(out) == len(params) + 1
+    np.testing.assert_allclose(out[0], func(x, *params), rtol=1e-12)
+    for d, expected in zip(out[1:], _finite_differences(func, params)):
+        assert d.shape == (2, len(x))
+        np.testing.assert_allclose(d, expected, rtol=1e-6, atol=1e-8)
+
+
+@pytest.mark.parametrize('fit_func', ['cumgauss', 'cumgauss_w_asym', 'weib'])
+def test_psychometric_jac_out(fit_func):
+    if fit_func == 'cumgauss':
+        params = cumgauss_params
+    elif fit_func == 'cumgauss_w_asym':
+        params = cumgauss_params + [np.zeros((2, 1)), np.ones((2, 1))]
+    else:
+        params = weib_params
+    p, jac = tools.psychometric_jac(x, params, fit_func)
+    assert p.shape == (2, len(x))
+    assert jac.shape == (len(params), 2, len(x))
+    if fit_func == 'cumgauss_w_asym':
+        assert np.all(jac[2:] == 0)
+    # Buffers with garbage in them are filled with the same results:
+    out = (np.ones(p.shape) * np.nan, np.ones(jac.shape) * np.nan)
+    result = tools.psychometric_jac(x, params, fit_func, out=out)
+    assert result[0] is out[0] and result[1] is out[1]
+    np.testing.assert_array_equal(out[0], p)
+    np.testing.assert_array_equal(out[1], jac)
+    with pytest.raises(ValueError):
+        tools.psychometric_jac(x, params, 'logistic')
+
+
+@pytest.mark.parametrize('fit_func', ['cumgauss', 'weib'])
+def test_numba(fit_func, monkeypatch):
+    pytest.importorskip('numba')
+    params = dict(cumgauss=cumgauss_params, weib=weib_params)[fit_func]
+    # Including the edges of the weibull (x = 0):
+    this_x = np.concatenate([[0], x])
+    p, jac = tools.psychometric_jac(this_x, params, fit_func)
+    monkeypatch.setattr(tools, 'use_numba', True)
+    out = (np.empty(p.shape), np.empty(jac.shape))
+    p_numba, jac_numba = tools.psychometric_jac(this_x, params, fit_func,
+                                                out=out)
+    assert p_numba is out[0]
+    np.testing.assert_allclose(p_numba, p, rtol=1e-12, atol=1e-15)
+    np.testing.assert_allclose(jac_numba, jac, rtol=1e-12, atol=1e-15)
+    np.testing.assert_allclose(tools.psychometric_jac(this_x, params,
+                                                      fit_func)[1],
+                               jac, rtol=1e-12, atol=1e-15)
+
+
+def test_tabulated_ndtr():
+    z = np.linspace(-10, 10, 200001)
+    assert np.max(np.abs(tools.tabulated_ndtr(z) - tools.ndtr(z))) < 1e-7
+    # At the knots and beyond the table:
+    knots = np.arange(-8.5, 8.5, 1.0 / 32)
+    np.testing.assert_allclose(tools.tabulated_ndtr(knots),
+                               tools.ndtr(knots), atol=1e-15)
+    np.testing.assert_allclose(tools.tabulated_ndtr([-np.inf, -50, 50,
+                                                     np.inf]),
+                               [0, 0, 1, 1], rtol=0, atol=1e-16)
+    assert np.isnan(tools.tabulated_ndtr(np.nan))
+    assert np.ndim(tools.tabulated_ndtr(0.3)) == 0
+
+
+def test_use_cdf_table(monkeypatch):
+    this_x = np.linspace(-1, 2, 1001)
+    expected = tools.cumgauss(this_x, 0.4, 0.2)
+    monkeypatch.setattr(tools, 'use_cdf_table', True)
+    np.testing.assert_allclose(tools.cumgauss(this_x, 0.4, 0.2), expected,
+                               rtol=0, atol=1e-7)
@@ -0,0 +1,123 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import tools
+
+with open(os.path.join(os.path.dirname(__file__), 'data',
+                       'baseline.json')) as f:
+    baseline = json.load(f)
+
+oris = [0, 90]
+cue_conds = ['cued', 'other', 'neutral']
+
+
+def _synthetic_df(seed=0, n_subjects=13):
+    """Fits and proportions of cumulative Gaussians, in the layout of the
+    first output of get_df. One subject has no '1' answers in 'other'"""
+    rng = np.random.RandomState(seed)
+    x = np.linspace(0.1, 0.7, 8)
+    df = {}
+    for s in range(n_subjects):
+        sub = 'S%02d'%(s + 1)
+        df[sub] = {}
+        for c in oris:
+            for su in oris:
+                df[sub][c, su] = {}
+                for cue in cue_conds:
+                    p = [0.3 + 0.1 * rng.rand() + 0.05 * (cue == 'cued') +
+                         0.03 * (c == su), 0.05 + 0.1 * rng.rand()]
+                    y = tools.cumgauss(x, *p) + 0.05 * rng.randn(8)
+                    if s == 3 and cue == 'other':
+                        y = np.zeros(8)
+                    df[sub][c, su][cue] = dict(x=x, y=y, fit=(np.array(p), 1))
+    return pd.DataFrame(df)
+
+
+def _loo_array(RR):
+    return np.array([[RR[c, s][cue] for cue in cue_conds]
+                     for c in oris for s in oris])
+
+
+def test_loo():
+    df = _synthetic_df()
+    expected = np.array(baseline['model_evaluation_loo'])
+    RR = np.array([_loo_array(this) for this in
+                   tools.model_evaluation_loo(df)])
+    np.testing.assert_allclose(RR, expected, rtol=1e-12, atol=1e-12)
+
+
+def test_evaluate_models():
+    df = _synthetic_df()
+    expected = np.array(baseline['model_evaluation_loo'])
+    # The models of model_evaluation_loo, given to evaluate_models:
+    all_factors = ['abs_ori', 'rel_ori', 'cue']
+    models = [tools.ModelSpec(),
+              tools.ModelSpec(mu=all_factors, sigma=all_factors),
+              tools.ModelSpec(mu=['abs_ori', 'rel_ori'], sigma=all_factors)]
+    RR = tools.evaluate_models(df, models, scheme='loo', per_condition=True)
+    RR = np.rollaxis(RR, 1, 5).reshape(expected.shape)
+    np.testing.assert_allclose(RR, expected, rtol=1e-12, atol=1e-12)
+    for scheme in ['split_half', 'kfold']:
+        RR = tools.evaluate_models(df, models, scheme=scheme, k=4, seed=1,
+                                   n_splits=3)
+        assert RR.shape == (3, 3 if scheme == 'split_half' else 4)
+        assert np.all(np.isfinite(RR))
+
+
+def test_split_half():
+    df = _synthetic_df()
+    for seed, expected in enumerate(baseline['model_evaluation_split_half']):
+        np.random.seed(seed)
+        np.testing.assert_allclose(tools.model_evaluation_split_half(df),
+                                   expected, rtol=1e-12)
+
+
+def test_cv_folds():
+    for scheme in ['loo', 'split_half', 'kfold']:
+        test = tools.cv_folds(13, scheme, k=4, seed=1, n_splits=5)
+        assert test.shape[1] == 13
+        assert np.all(test.sum(1) > 0)
+        if scheme != 'split_half':
+            # Every subject is tested once:
+            np.testing.assert_array_equal(test.sum(0), 1)
+
+
+def test_repeated_split_half():
+    df = _synthetic_df()
+    RR = tools.model_evaluation_split_half(df, n_splits=200, seed=0)
+    assert RR.shape == (3, 200)
+    np.testing.assert_array_equal(
+        RR, tools.model_evaluation_split_half(df, n_splits=200, seed=0))
+    # The mean over many splits is close to that of single splits:
+    singles = np.array(baseline['model_evaluation_split_half']).T
+    assert np.all(np.abs(RR.mean(-1) - singles.mean(-1)) < 0.02)
+    halves = tools.random_halves(200, 13, rng=np.random.RandomState(0))
+    assert halves.shape == (200, 13)
+    np.testing.assert_array_equal(halves.sum(-1), 6)
+
+
+def test_coeff_of_determination():
+    rng = np.random.RandomState(2)
+    # Levels on the first axis, 4 slices on the second:
+    data = rng.rand(6, 4)
+    data[:, 2] = 0.5  # Constant, so R^2 can't be calculated
+    model = data + 0.1 * rng.randn(6, 4)
+    rr = tools.coeff_of_determination(data, model, axis=0)
+    assert rr.shape == (4,)
+    assert np.isnan(rr[2])
+    for i in [0, 1, 3]:
+        d, m = data[:, i], model[:, i]
+        expected = 1 - np.sum((d - m) ** 2) / np.sum((d - d.mean()) ** 2)
+        np.testing.assert_allclose(rr[i], expected, rtol=1e-12)
+        # A 1-d input gives a scalar:
+        assert np.ndim(tools.coeff_of_determination(d, m)) == 0
+    # The model is broadcast against the data:
+    rr = tools.coeff_of_determination(data.T, model[:, 0])
+    np.testing.assert_allclose(rr[0], tools.coeff_of_determination(
+        data[:, 0], model[:, 0]), rtol=1e-12)
+    assert np.isnan(rr[2])
+    # All zeros:
+    assert np.isnan(tools.coeff_of_determination(np.zeros(5), np.zeros(5)))
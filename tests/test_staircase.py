@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+import tools
+
+
+def _staircase(n_trials=200, seed=0, none_every=0):
+    """A staircase run by a simulated observer with threshold 0.3"""
+    rng = np.random.RandomState(seed)
+    st = tools.Staircase(0.5, 0.05)
+    for i in range(n_trials):
+        if none_every and i % none_every == 0:
+            st.update(None)
+        else:
+            st.update(rng.rand() < tools.weibull(st.value, 0.3, 3.5, 0.5,
+                                                 0.99))
+    return st
+
+
+def _legacy_threshold(st, guess=0.5, flake=0.01, slope=3.5):
+    """The fit to all the trials, each one a data point, as analyze used to
+    do it"""
+    flake = 1 - flake
+    amp = np.array(st.record[:-1])
+    c = np.array(st.correct, dtype=object)
+    hit_amps = tools.defloaterrorize(amp[c == 1].astype(float))
+    miss_amps = tools.defloaterrorize(amp[c == 0].astype(float))
+    all_amps = np.hstack([hit_amps, miss_amps])
+    x = []
+    y = []
+    for i in np.unique(all_amps):
+        n = np.sum(all_amps == i)
+        if n >= st.n_up:
+            x = np.hstack([x, n * [i]])
+            y = np.hstack([y, n * [np.sum(hit_amps == i) / float(n)]])
+    err = lambda p: y - tools.weibull(x, p[0], p[1], guess, flake)
+    return tools.leastsq(err, (np.mean(x), slope))[0][0]
+
+
+@pytest.mark.parametrize('none_every', [0, 7])
+def test_counts(none_every):
+    st = _staircase(none_every=none_every)
+    levels, n_trials, n_hits = [a.copy() for a in st.counts()]
+    assert np.all(np.diff(levels) > 0)
+    assert n_trials.sum() + st.n_none == len(st.correct)
+    # Set directly, the record and the answers are counted again:
+    st2 = tools.Staircase(0.5, 0.05)
+    st2.record = list(st.record)
+    st2.correct = list(st.correct)
+    for a, b in zip(st2.counts(), (levels, n_trials, n_hits)):
+        np.testing.assert_array_equal(a, b)
+    assert st2.n_none == st.n_none
+
+
+@pytest.mark.parametrize('method', [None, 'leastsq', 'lm'])
+@pytest.mark.parametrize('warm_start', [False, True])
+@pytest.mark.parametrize('none_every', [0, 7])
+def test_analyze(method, warm_start, none_every, tmpdir):
+    st = _staircase(none_every=none_every)
+    np.random.seed(1)
+    th, lower, upper, info = st.analyze(bootstrap_n=50, method=method,
+                                        warm_start=warm_start,
+                                        full_output=True,
+                                        fig_name=str(tmpdir.join('st.png')))
+    np.testing.assert_allclose(th, _legacy_threshold(st), rtol=1e-5)
+    assert lower <= th <= upper
+    assert info['fit_info']['converged']
+    assert info['boot_info']['converged'].shape == (50,)
+    assert tmpdir.join('st.png').check()
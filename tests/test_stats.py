@@ -0,0 +1,59 @@
+import os
+
+import numpy as np
+import pytest
+
+import tools
+
+data_dir = os.path.join(os.path.dirname(__file__), os.pardir, 'data') + '/'
+
+
+@pytest.fixture(scope='module')
+def stats():
+    return tools.SufficientStats(data_dir, subjects=['S01', 'S02'])
+
+
+@pytest.mark.parametrize('f, cue, cue_cond', [
+    ('S01HS_0_90_02092012_1_att_ss.csv', 'cued', 'cued'),
+    ('S01HS_0_90_02092012_1_att_ss.csv', 'other', 'other'),
+    ('S02DT_90_0_02092012_1_att_ss.csv', 'cued', 'cued'),
+    ('S01HSn_0_90_02162012_1_att_ss.csv', 'neutral', 'other')])
+def test_get(stats, f, cue, cue_cond):
+    # Conditions with a single session:
+    p = tools.get_data(data_dir + f)[0]
+    center_ori = tools._header_value(p, 'center_ori')
+    surr_ori = tools._header_value(p, 'surr_ori')
+    result = tools.analyze_constant(data_dir + f, cue_cond=cue_cond, boot=1,
+                                    verbose=False)
+    x, n_ones, n_trials = stats.get(f[:3], center_ori, surr_ori, cue)
+    np.testing.assert_allclose(x, result['x'], rtol=1e-12)
+    np.testing.assert_array_equal(n_trials, result['trials'])
+    np.testing.assert_allclose(n_ones / n_trials.astype(float), result['y'],
+                               rtol=1e-12)
+    # And the fits to the counts are those of analyze_constant:
+    fits = stats.fit()
+    idx = (stats.subjects.index(f[:3]),
+           list(stats.center_oris).index(center_ori),
+           list(stats.surr_oris).index(surr_ori), stats.cues.index(cue), 0, 0)
+    np.testing.assert_allclose(fits[idx], result['fit'][0], rtol=1e-8)
+
+
+@pytest.mark.parametrize('stratified', [False, True])
+def test_bootstrap(stats, stratified):
+    boot = stats.bootstrap(boot=1000, seed=1, stratified=stratified)
+    assert boot.shape == stats.fit().shape[:-1] + (1000, 2)
+    np.testing.assert_array_equal(
+        boot, stats.bootstrap(boot=1000, seed=1, stratified=stratified))
+    # Cells without trials:
+    empty = stats.n_trials.sum(5)[..., 0] == 0
+    assert np.all(np.isnan(boot[empty]))
+    # Resampling the counts gives the same intervals as resampling the
+    # trials, up to the bootstrap noise:
+    f = data_dir + 'S01HS_0_90_02092012_1_att_ss.csv'
+    result = tools.analyze_constant(f, boot=1000, verbose=False, seed=2,
+                                    boot_method='loop')
+    lb, ub = tools.order_statistic(boot[0, 0, 1, 0, 0, 0, :, 0],
+                                   [0.16, 0.84])
+    width = result['boot_th_ub'][0] - result['boot_th_lb'][0]
+    assert abs(lb - result['boot_th_lb'][0]) < 0.2 * width
+    assert abs(ub - result['boot_th_ub'][0]) < 0.2 * width
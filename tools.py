@@ -1,6 +1,14 @@
 import os
+import math
 import time
+import hashlib
+import multiprocessing
+import collections
 import pandas as pd
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 
 import numpy as np
 try:
@@ -17,10 +25,10 @@ except:
     has_psychopy = False
     
 import matplotlib
-from matplotlib.mlab import window_hanning,csv2rec
+from matplotlib.mlab import window_hanning
 import matplotlib.pyplot as plt
-from scipy.optimize import leastsq
-from scipy.special import erf
+from scipy.optimize import leastsq, minimize
+from scipy.special import erf, ndtr, ndtri
 
 #User input GUI:
 if has_wx:
@@ -361,36 +369,6 @@ class Text(object):
                 if key:
                     return
 
-def get_data(file_name):
-    file_read = open(file_name,'r')
-    l = file_read.readline()
-    p = {} #This will hold the params
-    l = file_read.readline()
-    data_rec = []
-    
-    if l=='':
-        return p,l,data_rec
-
-    while l[0]=='#':
-        try:
-            p[l[1:l.find(':')-1]]=float(l[l.find(':')+1:l.find('\n')]) 
-
-        #Not all the parameters can be cast as float (the task and the
-        #subject): 
-        except:
-            p[l[2:l.find(':')-1]]=l[l.find(':')+1:l.find('\n')]
-
-        l = file_read.readline()
-
-    try:
-        data_rec = csv2rec(file_name)
-    except ValueError:
-        p = []
-    
-    return p,l,data_rec
-
-
-
 class Staircase(object):
     """
     This is an object for holding, updating and potentially analyzing
@@ -425,6 +403,13 @@ class Staircase(object):
         self.correct = []
         self.ub = ub
         self.lb = lb
+        # The number of trials and of hits at each of the (sorted)
+        # intensities, kept up to date in `update`, so that `analyze` doesn't
+        # need to go back to the record:
+        self.intensities = np.zeros(0)
+        self.n_trials = np.zeros(0, dtype=int)
+        self.n_hits = np.zeros(0, dtype=int)
+        self.n_none = 0 #Trials on which correct=None
         
     def update(self,correct):
         """
@@ -438,6 +423,7 @@ class Staircase(object):
         correct: {True|False|None => don't update, but record the value} 
 
         """
+        self._count(self.record[-1], correct)
         self.correct.append(correct)
 
         #If none is the input, don't change anything (not even n!) and record
@@ -466,9 +452,51 @@ class Staircase(object):
         #Add to the records the updated value (even on trials where
         #correct=None):
         self.record.append(self.value)
+
+    def _count(self, amp, correct):
+        """
+        Add one trial to the counts at intensity `amp`
+        """
+        if correct is None:
+            self.n_none += 1
+            return
+        # Get rid of floating point error:
+        amp = defloaterrorize(np.array([amp], dtype=float))[0]
+        idx = np.searchsorted(self.intensities, amp)
+        if idx == self.intensities.shape[0] or self.intensities[idx] != amp:
+            self.intensities = np.insert(self.intensities, idx, amp)
+            self.n_trials = np.insert(self.n_trials, idx, 0)
+            self.n_hits = np.insert(self.n_hits, idx, 0)
+        self.n_trials[idx] += 1
+        self.n_hits[idx] += correct == 1
+
+    def counts(self):
+        """
+        The intensities in the staircase, and the number of trials and of hits
+        at each one of them. Trials on which correct=None are not counted (see
+        `n_none`).
+
+        If `record` and `correct` were not filled by `update` (for example,
+        when they are set directly), the counts are recomputed from them.
+        """
+        if self.n_trials.sum() + self.n_none != len(self.correct):
+            c = np.array(self.correct, dtype=object)
+            answered = np.array([this is not None for this in self.correct],
+                                dtype=bool)
+            amp = np.array(self.record[:len(self.correct)], dtype=float)
+            amp = defloaterrorize(amp[answered])
+            self.intensities, inv = np.unique(amp, return_inverse=True)
+            inv = inv.ravel()
+            n_levels = self.intensities.shape[0]
+            self.n_trials = np.bincount(inv, minlength=n_levels)
+            self.n_hits = np.bincount(inv, weights=c[answered] == 1,
+                                      minlength=n_levels).astype(int)
+            self.n_none = len(self.correct) - answered.sum()
+        return self.intensities, self.n_trials, self.n_hits
         
     def analyze(self, guess=0.5, flake=0.01, slope=3.5, fig_name=None,
-                bootstrap_n=1000):
+                bootstrap_n=1000, warm_start=False, full_output=False,
+                method=None):
         """
         Perform a psychometric curve analysis of the data in the staircase and
         save a figure, if needed.
@@ -491,89 +519,121 @@ class Staircase(object):
 
         bootstrap_n: int
            The number of boot samples to take for the bootstrapping analysis
+
+        warm_start: bool
+           Whether to start the fits of the boot samples from the fit to all
+           the data, instead of from the mean of the contrasts and `slope`
+
+        full_output: bool
+           Whether to also return a dict with the diagnostics of the fit to
+           all the data ('fit_info') and of the boot fits ('boot_info', arrays
+           with one value per boot sample). See `fit_th`.
+
+        method: str
+           'leastsq' (default) fits the data and each of the boot samples with
+           scipy.optimize.leastsq. 'lm' fits them all together, with
+           `fit_th_batch`. The boot samples are the same.
            
         Note
         ----
 
         The fitting procedure is applied to the slope, as well as to the
         threshold.
-        
-        """
-        def weibull(x,threshx,slope,guess,flake,threshy=None):
-                if threshy is None:
-                    threshy = 1-(1-guess)*np.exp(-1)
 
-                k = (-np.log( (1-threshy)/(1-guess) ))**(1/slope)
-                weib = flake - (flake-guess)*np.exp(-(k*x/threshx)**slope)
-                return weib 
-
-        def get_thresh(amp,c):
-            """Calculate a threshold given amp, c(orrect) values  """ 
-            #Helper functions for fitting the psychometric curve, need to be
-            #defined within the local scope, so that they can grok the data:
-            
-            def weib_fit(pars):
-                thresh,slope = pars
-                return weibull(x,thresh,slope,guess,flake)
-
-            def err_func(pars):
-                return y-weib_fit(pars)
-
-            #Throw away the None's:
-            hit_amps = amp[c==1]
-            miss_amps = amp[c==0]
-
-            # Get rid of floating point error:
-            hit_amps = defloaterrorize(hit_amps)
-            miss_amps = defloaterrorize(miss_amps)
-
-            all_amps = np.hstack([hit_amps,miss_amps])
-            stim_intensities = np.unique(all_amps)
-
-            n_correct = [len(np.where(hit_amps==i)[0]) for i in stim_intensities]
-            n_trials = [len(np.where(all_amps==i)[0]) for i in stim_intensities]
-            Data = zip(stim_intensities,n_correct,n_trials)
-            x = []
-            y = []
-            n = []
-            for idx,this in enumerate(Data):
-                #Take only cases where there were at least n_up observations:
-                if n_trials[idx]>=self.n_up:
-                    #Contrast values: 
-                    x = np.hstack([x,this[2] * [this[0]]])
-                    #% correct:
-                    y = np.hstack([y,this[2] * [this[1]/float(this[2])]])
-
-            initial = np.mean(x),slope
-            this_fit , msg = leastsq(err_func,initial)
-            return this_fit,x,y
+        The analysis works from the number of trials and hits at each
+        intensity (see `counts`), each intensity weighted by its number of
+        trials. A boot sample draws the numbers of hits and misses at each
+        intensity from the multinomial distribution of resampling all the
+        trials with replacement.
         
+        """
         #Convert the flake into the expected format for the weibull function:
         flake = 1-flake
-        amp = np.array(self.record[:-1]) #The last one will be the next trials
-                                        #amp 
-        c = np.array(self.correct) #Which is why correct is one item shorter
-        
-        this_fit,keep_x,keep_y = get_thresh(amp,c)
-        #print keep_x
-        #print keep_y
-        
-        bootstrap_th = []
-        bootstrap_slope = []
-        keep_amp = amp
-        keep_c = c
-        keep_slope = this_fit[1]
-        keep_th = this_fit[0]
-        for b in xrange(bootstrap_n):
-            b_idx = np.random.randint(0,c.shape[0],c.shape[0])
-            amp = keep_amp[b_idx]
-            c = keep_c[b_idx]
-            this_fit,x,y = get_thresh(amp,c)
-            bootstrap_th.append(this_fit[0])
-
-        upper = np.sort(bootstrap_th)[bootstrap_n*0.84]
-        lower = np.sort(bootstrap_th)[bootstrap_n*0.16]
+        levels, n_trials, n_hits = self.counts()
+        n_levels = levels.shape[0]
+        # The boot samples resample the trials (including the ones with
+        # correct=None), so the numbers of hits and misses at each intensity
+        # in a boot sample are drawn from a multinomial over these cells:
+        cells = np.hstack([n_hits, n_trials - n_hits, self.n_none])
+        n = cells.sum()
+        draws = np.random.multinomial(n, cells / float(n), size=bootstrap_n)
+        hits = np.vstack([n_hits, draws[:, :n_levels]])
+        trials = hits + np.vstack([n_trials - n_hits,
+                                   draws[:, n_levels:2 * n_levels]])
+        #Take only cases where there were at least n_up observations:
+        w = np.where(trials >= self.n_up, trials, 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            y = np.where(w > 0, hits / trials.astype(float), 0)
+            mean_x = np.dot(w, levels) / w.sum(-1)
+
+        if method == 'lm':
+            initial = np.array([mean_x, np.ones(w.shape[0]) * slope,
+                                np.ones(w.shape[0]) * guess,
+                                np.ones(w.shape[0]) * flake]).T
+            free = [True, True, False, False]
+            # The staircase fit is not bounded:
+            bounds = [(-np.inf, np.inf)] * 4
+            this_fit, fit_info = fit_th_batch(levels, y[:1], w[:1],
+                                              initial[:1], 'weib', free,
+                                              bounds, full_output=True)
+            keep_th, keep_slope = this_fit[0, :2]
+            fit_info = dict([(k, v[0]) for k, v in fit_info.items()])
+            if warm_start:
+                initial[1:, :2] = this_fit[0, :2]
+            boot_fit, boot_info = fit_th_batch(levels, y[1:], w[1:],
+                                               initial[1:], 'weib', free,
+                                               bounds, full_output=True)
+            bootstrap_th = boot_fit[:, 0]
+        else:
+            def get_thresh(w, y, initial):
+                """Fit the weibull to the counts, weighting each intensity by
+                its number of trials"""
+                keep = w > 0
+                x = levels[keep]
+                sqrt_w = np.sqrt(w[keep])
+                y = y[keep]
+
+                def err_func(pars):
+                    thresh,slope = pars
+                    return sqrt_w * (y - weibull(x,thresh,slope,guess,flake))
+
+                this_fit, cov, infodict, msg, ier = leastsq(err_func, initial,
+                                                            full_output=True)
+                info = dict(nfev=infodict['nfev'], converged=ier in (1,2,3,4),
+                            n_nan=np.sum(np.isnan(this_fit)))
+                return this_fit,info
+
+            this_fit,fit_info = get_thresh(w[0], y[0], (mean_x[0], slope))
+            keep_th, keep_slope = this_fit
+            bootstrap_th = []
+            boot_info = []
+            for b in range(bootstrap_n):
+                if warm_start:
+                    boot_initial = keep_th, keep_slope
+                else:
+                    boot_initial = mean_x[b + 1], slope
+                this_fit,info = get_thresh(w[b + 1], y[b + 1], boot_initial)
+                bootstrap_th.append(this_fit[0])
+                boot_info.append(info)
+            boot_info = _stack_info(boot_info)
+
+        lower, upper = order_statistic(bootstrap_th, [0.16, 0.84])
+        keep_x = np.repeat(levels, w[0])
+        keep_y = np.repeat(y[0], w[0])
+        self._plot(fig_name, keep_x, keep_y, keep_th, keep_slope, lower,
+                   upper, lambda x: weibull(x, keep_th, keep_slope, guess,
+                                            flake))
+
+        if full_output:
+            return keep_th,lower,upper,dict(fit_info=fit_info,
+                                            boot_info=boot_info)
+        return keep_th,lower,upper
 
+    def _plot(self, fig_name, keep_x, keep_y, keep_th, keep_slope, lower,
+              upper, fit_curve):
+        """
+        Save a figure of the data and the fit, if required
+        """
         #Make a figure, if required:
         if fig_name is not None: 
             fig = plt.figure()
@@ -583,17 +643,12 @@ class Staircase(object):
                 ax.plot(this_x,keep_y[idx],'o',color = 'b',markersize = n)
 
             x_for_plot = np.linspace(np.min(keep_x)-0.05,np.max(keep_x)+0.05,100)
-            ax.plot(x_for_plot,weibull(x_for_plot,keep_th,
-                                       keep_slope,
-                                       guess,
-                                       flake),
+            ax.plot(x_for_plot,fit_curve(x_for_plot),
                     color = 'g')
             ax.set_title('Threshold=%1.2f +/- %1.2f ::Slope=%1.2f'
                          %(keep_th,(upper-lower)/2,keep_slope))
             fig.savefig(fig_name)
 
-        return keep_th,lower,upper
-
 # Helper function in order to get rid of small round-off error in the
 # representation of trial contrasts in the staircase object:
 def defloaterrorize(a):
@@ -605,11 +660,155 @@ def defloaterrorize(a):
     a = a/100.0
     return a
 
-def get_data(file_name=None, even_or_odd=False):
+# Parsed sessions are cached in memory, so that repeated analyses don't
+# reparse the csv files. They can also be cached on disk, in this directory,
+# which is off (None) unless it is set here or in the ATT_SS_CACHE_DIR
+# environment variable. The cache files are pickles, which are loaded without
+# any check, so only point this at a directory that no one else can write
+# to. Nothing limits their size (see `clear_data_cache`):
+data_cache_dir = os.environ.get('ATT_SS_CACHE_DIR') or None
+# The number of sessions held in memory:
+data_cache_size = 512
+# Bump this whenever the output of _parse_data changes, so that stale cache
+# files are ignored:
+_data_cache_version = 2
+_data_cache = collections.OrderedDict()
+
+
+# The types of the columns in the data files. Columns not in here are read as
+# floats:
+data_dtypes = dict(trial=int,
+                   cue_side=np.dtype((str, 1)),
+                   ask_side=np.dtype((str, 1)),
+                   r_contrast1=float,
+                   r_contrast2=float,
+                   l_contrast1=float,
+                   l_contrast2=float,
+                   answer=int,
+                   ask_contrast=float,
+                   rt=float)
+
+
+def _parse_data(file_name):
+    """
+    Read the parameters and the data_rec from file in one pass (see
+    `get_data`)
+    """
+    p = {} #This will hold the params
+    data = []
+    with open(file_name, 'r') as file_read:
+        # The first line holds the time of the experiment:
+        l = file_read.readline()
+        l = file_read.readline()
+        if l == '':
+            return p,l,data
+
+        while l.startswith('#'):
+            key, value = l[1:].split(':', 1)
+            value = value.strip()
+            #Not all the parameters can be cast as float (the task and the
+            #subject):
+            try:
+                value = float(value)
+            except ValueError:
+                pass
+            p[key.strip()] = value
+            l = file_read.readline()
+
+        names = [n.strip() for n in l.split(',')]
+        dtype = np.dtype([(n, data_dtypes.get(n, float)) for n in names])
+        convert = [dtype[n].type for n in names]
+        for line in file_read:
+            if line.strip():
+                data.append(tuple([c(v.strip()) for c, v in
+                                   zip(convert, line.split(','))]))
+
+    if len(data) == 0:
+        # Nothing to analyze in here:
+        return [],l,[]
+
+    data_rec = np.array(data, dtype=dtype).view(np.recarray)
+    return p,l,data_rec
+
+
+def _data_cache_key(file_name):
+    """
+    The cache key of a file: its path, modification time and size (so that
+    the entry is invalidated when the file changes)
+    """
+    st = os.stat(file_name)
+    key = '%s|%r|%d|%d'%(os.path.abspath(file_name), st.st_mtime, st.st_size,
+                         _data_cache_version)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def _cached_parse_data(file_name):
+    """
+    `_parse_data`, looked up first in memory, then on disk
+    """
+    key = _data_cache_key(file_name)
+    if key in _data_cache:
+        parsed = _data_cache.pop(key)
+    else:
+        parsed = None
+        if data_cache_dir is not None:
+            cache_file = os.path.join(data_cache_dir, key + '.pkl')
+            try:
+                with open(cache_file, 'rb') as f:
+                    parsed = pickle.load(f)
+            except Exception:
+                parsed = None
+
+        if parsed is None:
+            parsed = _parse_data(file_name)
+            if data_cache_dir is not None:
+                # Write to a temporary file first, so that other processes
+                # never read a partial cache file:
+                try:
+                    if not os.path.isdir(data_cache_dir):
+                        os.makedirs(data_cache_dir)
+                    tmp_file = '%s.%d.tmp'%(cache_file, os.getpid())
+                    with open(tmp_file, 'wb') as f:
+                        pickle.dump(parsed, f, pickle.HIGHEST_PROTOCOL)
+                    getattr(os, 'replace', os.rename)(tmp_file, cache_file)
+                except (IOError, OSError):
+                    pass
+
+    _data_cache[key] = parsed
+    while len(_data_cache) > data_cache_size:
+        _data_cache.popitem(last=False)
+
+    # Hand out copies, so that callers can't change what's in the cache:
+    p,l,data_rec = parsed
+    if isinstance(p, dict):
+        p = dict(p)
+    if isinstance(data_rec, np.ndarray):
+        data_rec = data_rec.copy()
+    return p,l,data_rec
+
+
+def clear_data_cache(disk=False):
+    """
+    Empty the in-memory cache of parsed data files. If disk is True, the
+    on-disk cache files are removed as well.
+    """
+    _data_cache.clear()
+    if disk and data_cache_dir is not None and os.path.isdir(data_cache_dir):
+        for f in os.listdir(data_cache_dir):
+            if f.endswith('.pkl') or f.endswith('.tmp'):
+                os.remove(os.path.join(data_cache_dir, f))
+
+
+def get_data(file_name=None, even_or_odd=False, cache=True):
     """
     Get the data from file, returning parameters, the line with variable names
     and a data_rec using these variable names.
 
+    The parameters are read from the '#' lines at the top of the file. Their
+    keys and values are stripped of white-space and values are cast as float
+    where possible. The data_rec is a record array, with the types given in
+    `data_dtypes`.
+
     Parameters
     ----------
 
@@ -620,33 +819,23 @@ def get_data(file_name=None, even_or_odd=False):
     even_or_odd : str
        For split half analysis, this variable allows choosing to output only
        even or only odd trials from the file
+
+    cache : bool
+       Whether to use the cache of parsed files. The cache is keyed on the
+       path, modification time and size of the file. It is held in memory
+       and, only if `data_cache_dir` is set (or the ATT_SS_CACHE_DIR
+       environment variable), also written to disk as pickle files.
     
     """
 
     if file_name is None: 
         path_to_files = './data/'
         file_name =  str(gui.fileOpenDlg(path_to_files)[0])
-    
-    file_read = open(file_name,'r')
-    l = file_read.readline()
-    p = {} #This will hold the params
-    l = file_read.readline()
-    data_rec = []
-    
-    if l=='':
-        return p,l,data_rec
 
-    while l[0]=='#':
-        try:
-            p[l[1:l.find(':')-1]]=float(l[l.find(':')+1:l.find('\n')]) 
-        except:
-            p[l[2:l.find(':')-1]]=l[l.find(':')+1:l.find('\n')]
-        l = file_read.readline()
-        
-    try:
-        data_rec = csv2rec(file_name)
-    except ValueError:
-        p = []
+    if cache:
+        p,l,data_rec = _cached_parse_data(file_name)
+    else:
+        p,l,data_rec = _parse_data(file_name)
 
     # For split half analysis, you might want to pull only even or only odd
     # trials (and compare...):
@@ -658,6 +847,285 @@ def get_data(file_name=None, even_or_odd=False):
     return p,l,data_rec
 
 
+def _header_value(p, key):
+    """
+    Get a parameter from a file header. In headers read by older versions of
+    `get_data`, parameters that could be cast as float have a leading space in
+    their key.
+    """
+    if key in p:
+        return p[key]
+    return p[' ' + key]
+
+
+def compile_dataset(path_to_files, dataset_dir=None):
+    """
+    Gather all the data files in a directory into one columnar data-set.
+
+    Every column of the data files is concatenated across files and saved as
+    a separate .npy file, so that it can be memory-mapped. A session table
+    holds, for each file, the rows in which its trials are stored, together
+    with the subject and the condition. The file headers are kept as well.
+
+    Parameters
+    ----------
+    path_to_files : str
+        The directory holding the data files.
+
+    dataset_dir : str
+        Where to save the data-set. Defaults to a 'compiled' directory inside
+        path_to_files.
+
+    Returns
+    -------
+    dataset_dir : str
+        The directory in which the data-set was saved (see `load_dataset`).
+
+    """
+    if dataset_dir is None:
+        dataset_dir = os.path.join(path_to_files, 'compiled')
+    if not os.path.isdir(dataset_dir):
+        os.makedirs(dataset_dir)
+
+    file_names = []
+    params = []
+    recs = []
+    for this_file in sorted(os.listdir(path_to_files)):
+        if not this_file.endswith('.csv'):
+            continue
+        p,l,d = get_data(os.path.join(path_to_files, this_file))
+        # Files without any trials can't be analyzed:
+        if not isinstance(p, dict) or len(d) == 0:
+            continue
+        file_names.append(this_file)
+        params.append(p)
+        recs.append(d)
+
+    names = recs[0].dtype.names
+    for this_file, d in zip(file_names, recs):
+        if d.dtype.names != names:
+            raise ValueError("The columns in %s differ from those in %s"%(
+                this_file, file_names[0]))
+
+    for name in names:
+        col = np.concatenate([np.asarray(d[name]) for d in recs])
+        # Strings are stored with a fixed width, so that they can be mapped:
+        if col.dtype.kind in 'SUO':
+            col = col.astype(np.dtype((str, max([len(str(c)) for c in col]))))
+        np.save(os.path.join(dataset_dir, name + '.npy'), col)
+
+    n_trials = np.array([len(d) for d in recs])
+    stop = np.cumsum(n_trials)
+    cue_reliability = []
+    for p in params:
+        c = _header_value(p, 'cue_reliability')
+        # In the neutral condition, this is not a number:
+        cue_reliability.append(c if isinstance(c, float) else np.nan)
+    str_len = max([len(f) for f in file_names])
+    sessions = np.rec.fromarrays(
+        [np.array(file_names, dtype=np.dtype((str, str_len))),
+         np.array([f[:3] for f in file_names], dtype=np.dtype((str, 3))),
+         np.array([_header_value(p, 'center_ori') for p in params]),
+         np.array([_header_value(p, 'surr_ori') for p in params]),
+         np.array(cue_reliability),
+         stop - n_trials,
+         stop],
+        names=['file_name', 'subject', 'center_ori', 'surr_ori',
+               'cue_reliability', 'start', 'stop'])
+    np.save(os.path.join(dataset_dir, 'sessions.npy'), sessions)
+
+    with open(os.path.join(dataset_dir, 'params.pkl'), 'wb') as f:
+        pickle.dump(dict(columns=list(names), params=params), f,
+                    pickle.HIGHEST_PROTOCOL)
+
+    # Loaded copies of this data-set are now stale:
+    _datasets.pop(os.path.abspath(dataset_dir), None)
+
+    return dataset_dir
+
+
+class Dataset(object):
+    """
+    A data-set compiled with `compile_dataset`. The trial columns are
+    memory-mapped, so only the rows that are used are read from disk.
+
+    """
+    def __init__(self, dataset_dir):
+        """
+        Parameters
+        ----------
+        dataset_dir : str
+            The directory in which the data-set was saved.
+
+        """
+        self.path = os.path.abspath(dataset_dir)
+        with open(os.path.join(dataset_dir, 'params.pkl'), 'rb') as f:
+            meta = pickle.load(f)
+        self.params = meta['params']
+        self.names = meta['columns']
+        self.sessions = np.load(os.path.join(dataset_dir, 'sessions.npy'),
+                                allow_pickle=False).view(np.recarray)
+        self.columns = {}
+        for name in self.names:
+            self.columns[name] = np.load(os.path.join(dataset_dir,
+                                                      name + '.npy'),
+                                         mmap_mode='r')
+        self._session_idx = dict([(f, i) for i, f in
+                                  enumerate(self.sessions.file_name)])
+
+    def _rows(self, rows):
+        """
+        Read the given rows of all the trial columns into a rec-array
+        """
+        return np.rec.fromarrays([np.array(self.columns[name][rows])
+                                  for name in self.names], names=self.names)
+
+    def get_data(self, file_name, even_or_odd=False):
+        """
+        Like `get_data`, but for one of the files in the data-set
+
+        Parameters
+        ----------
+        file_name : str
+            The name of the original data file (the directory is ignored).
+
+        even_or_odd : str
+            Output only even or only odd trials (see `get_data`).
+
+        """
+        i = self._session_idx[os.path.basename(file_name)]
+        data_rec = self._rows(slice(self.sessions.start[i],
+                                    self.sessions.stop[i]))
+        if even_or_odd == 'odd':
+            data_rec = data_rec[::2]
+        elif even_or_odd == 'even':
+            data_rec = data_rec[1::2]
+        return self.header(file_name), ','.join(self.names), data_rec
+
+    def header(self, file_name):
+        """
+        The parameters in the header of one of the files in the data-set
+        """
+        return dict(self.params[self._session_idx[os.path.basename(file_name)]])
+
+    def select(self, subject=None, center_ori=None, surr_ori=None,
+               neutral=None):
+        """
+        The indices of the sessions matching all of the given conditions
+
+        Parameters
+        ----------
+        subject : str
+            For example, 'S01'.
+
+        center_ori, surr_ori : float
+
+        neutral : bool
+            Whether to select the neutral (True) or cued (False) sessions.
+
+        """
+        s = self.sessions
+        mask = np.ones(s.shape[0], dtype=bool)
+        if subject is not None:
+            mask &= s.subject == subject
+        if center_ori is not None:
+            mask &= s.center_ori == center_ori
+        if surr_ori is not None:
+            mask &= s.surr_ori == surr_ori
+        if neutral is not None:
+            mask &= np.isnan(s.cue_reliability) == neutral
+        return np.where(mask)[0]
+
+    def trials(self, **conditions):
+        """
+        All the trials from the sessions matching the conditions (see
+        `select`), in one rec-array. A 'session' column gives the index of the
+        session each trial came from.
+
+        """
+        idx = self.select(**conditions)
+        s = self.sessions
+        n_trials = s.stop[idx] - s.start[idx]
+        rows = np.concatenate([np.arange(s.start[i], s.stop[i]) for i in idx]
+                              + [np.array([], dtype=int)])
+        rec = self._rows(rows)
+        session = np.repeat(idx, n_trials)
+        return np.rec.fromarrays([rec[name] for name in self.names]
+                                 + [session],
+                                 names=list(self.names) + ['session'])
+
+
+_datasets = {}
+
+def load_dataset(dataset):
+    """
+    Load a data-set saved with `compile_dataset`. Loaded data-sets are kept,
+    so loading the same one again is free.
+
+    Parameters
+    ----------
+    dataset : str or Dataset
+        The directory of the data-set. A Dataset is just returned.
+
+    """
+    if isinstance(dataset, Dataset):
+        return dataset
+    key = os.path.abspath(dataset)
+    if key not in _datasets:
+        _datasets[key] = Dataset(dataset)
+    return _datasets[key]
+
+
+# Evaluate cumgauss from a table of the normal CDF (see `tabulated_ndtr`),
+# instead of with erf:
+use_cdf_table = False
+# The table holds a cubic between each pair of knots, _cdf_table_step apart,
+# on [-_cdf_table_max, _cdf_table_max]. Beyond that, the CDF is 0 or 1 to
+# within 1e-17:
+_cdf_table_step = 1.0 / 32
+_cdf_table_max = 8.5
+_cdf_table = None
+
+def _make_cdf_table():
+    """
+    The coefficients of the cubic Hermite interpolant of the normal CDF in
+    each interval between the knots, from the highest power down
+    """
+    knots = np.arange(-_cdf_table_max, _cdf_table_max + _cdf_table_step / 2,
+                      _cdf_table_step)
+    f = ndtr(knots)
+    # The derivative, in units of the interval:
+    d = np.exp(-knots ** 2 / 2) / np.sqrt(2 * np.pi) * _cdf_table_step
+    f0, f1, d0, d1 = f[:-1], f[1:], d[:-1], d[1:]
+    return np.array([2 * (f0 - f1) + d0 + d1,
+                     3 * (f1 - f0) - 2 * d0 - d1,
+                     d0,
+                     f0])
+
+def tabulated_ndtr(z):
+    """
+    The standard normal CDF at z, interpolated (cubic Hermite) in a table
+    that is computed the first time it is needed. The error is below 2e-9
+    everywhere.
+    """
+    global _cdf_table
+    if _cdf_table is None:
+        _cdf_table = _make_cdf_table()
+    n = _cdf_table.shape[1]
+    u = np.clip((np.asarray(z, dtype=float) + _cdf_table_max) /
+                _cdf_table_step, 0, n)
+    # fmax/fmin put nan at 0 (so it can be cast), and t stays nan:
+    i = np.fmin(np.fmax(u, 0), n - 1).astype(int)
+    t = u - i
+    c3, c2, c1, c0 = _cdf_table
+    p = c3[i] * t
+    p += c2[i]
+    p *= t
+    p += c1[i]
+    p *= t
+    p += c0[i]
+    return p
+
 def cumgauss(x, mu, sigma, low_asym=0, high_asym=1):
     """
     The cumulative Gaussian at x, for the distribution with mean mu and
@@ -667,7 +1135,12 @@ def cumgauss(x, mu, sigma, low_asym=0, high_asym=1):
     Based on:
     http://en.wikipedia.org/wiki/Normal_distribution#Cumulative_distribution_function
 
+    With `use_cdf_table` set, the normal CDF is interpolated in a table (see
+    `tabulated_ndtr`), instead of computed with erf.
+
     """
+    if use_cdf_table:
+        return tabulated_ndtr((x-mu)/sigma)
     cg = 0.5 * (1 + erf((x-mu)/(np.sqrt(2)*sigma)))
     #cg = cg/np.max(cg) * (high_asym - low_asym)
     #cg = cg + low_asym
@@ -686,13 +1159,52 @@ def weibull(x, threshx, slope, guess, flake, threshy=None):
 
 
 
-def fit_th(x, y, initial, fit_func='cumgauss'):
+def fit_th(x, y, initial, fit_func='cumgauss', method=None, warm_start=False,
+           full_output=False):
     """
 
     The core of the fitting. Get x values and get the responses (between 0
     and 1). Then, fit the function according to these values
+
+    Parameters
+    ----------
+    method : str
+        'lm' fits the cumulative Gaussian with `fit_cumgauss`, starting
+        from a probit regression, and is the default for 'cumgauss'. For
+        other functions, 'lm' uses `fit_th_batch`. 'leastsq' uses
+        scipy.optimize.leastsq, and is the default for everything else.
+        'mle' maximizes the binomial likelihood of the number of '1' answers
+        at each level, instead of minimizing the squared error (see
+        `fit_mle`).
+
+    warm_start : bool
+        Whether initial is already a good guess (e.g. the fit to all the data,
+        when fitting bootstrap samples). If so, 'lm' starts from it, instead
+        of from a probit regression.
+
+    full_output : bool
+        Whether to also return a dict with diagnostics of the fit: 'nfev', the
+        number of evaluations of the error, 'converged', whether the fit
+        converged, and 'n_nan', the number of parameters that came back as nan
+        and were replaced with the initial guess.
     
     """
+    if method is None:
+        if fit_func == 'cumgauss':
+            method = 'lm'
+        else:
+            method = 'leastsq'
+
+    if method in ('lm', 'mle'):
+        # The least-squares fit to all the trials is the same as the weighted
+        # fit to the mean of each level:
+        levels, inv = np.unique(x, return_inverse=True)
+        inv = inv.ravel()
+        n_trials = np.bincount(inv)
+        n_correct = np.bincount(inv, weights=np.asarray(y, dtype=float))
+        return fit_counts(levels, n_correct, n_trials, initial, fit_func,
+                          method, warm_start, full_output)
+
     def cumgauss_fit(params, x):
         """
         fit func
@@ -719,400 +1231,2238 @@ def fit_th(x, y, initial, fit_func='cumgauss'):
     def err_func(params, x, y, fit_func):
         """
         Error function. Handles boundary setting. For example, thresholds can't
-        be smaller than 0, or larger than 1.
+        be smaller than 0, or larger than 1. Out of bounds, every residual is
+        set to a large value (leastsq needs the same number of residuals on
+        every call).
 
         """
+        out_of_bounds = np.ones(np.shape(y)) * 1e10
         if fit_func=='cumgauss':
             if params[0] > 1:
-                return np.inf
+                return out_of_bounds
             if params[0] < 0:
-                return np.inf
+                return out_of_bounds
             return y - cumgauss_fit(params, x)
         elif fit_func=='cumgauss_w_asym':
             if params[2]<0:
-                return np.inf
+                return out_of_bounds
             if params[3]>1:
-                return np.inf
+                return out_of_bounds
             return y - cumgauss_fit_w_asym(params, x)
         elif fit_func=='weib':
             if params[0] > 1:
-                return np.inf
+                return out_of_bounds
             if params[0] < 0:
-                return np.inf
+                return out_of_bounds
             #if params[1] < 3.4:
-            #    return np.inf
+            #    return out_of_bounds
             #if params[1] > 3.6:
-            #    return np.inf
+            #    return out_of_bounds
             return y - weib_fit(params, x)
 
-    this_fit, msg = leastsq(err_func, initial, args=(x, y, fit_func))
+    this_fit, cov, infodict, msg, ier = leastsq(err_func, initial,
+                                                args=(x, y, fit_func),
+                                                full_output=True)
     # If you get back a nan, replace with the initial guess:
-    this_fit[np.isnan(this_fit)] = np.array(initial)[np.isnan(this_fit)]
+    n_nan = _replace_nans(this_fit, initial)
+    if full_output:
+        return this_fit, dict(nfev=infodict['nfev'],
+                              converged=ier in (1, 2, 3, 4),
+                              n_nan=n_nan)
     return this_fit
 
-def analyze_constant(data_file=None, fig_name=None, cue_cond='cued',
-                     fit_func='cumgauss', log_scale=False, boot=1000,
-                     leave_one_out=False, verbose=True, even_or_odd=False,
-                     distractor_high=None, distractor_low=None,
-                     analyze_distractor=False ):
+def _replace_nans(fit, initial):
     """
-    This analyzes data from the constant stimuli experiment
+    Replace nans in the fit (in place) with the initial guess, returning how
+    many were replaced (per row, for a 2-d fit)
+    """
+    nans = np.isnan(fit)
+    fit[nans] = np.broadcast_to(np.asarray(initial, dtype=float),
+                                fit.shape)[nans]
+    return nans.sum(-1)
+
+def fit_counts(x, n_correct, n_trials, initial, fit_func='cumgauss',
+               method=None, warm_start=False, full_output=False):
+    """
+    Fit a psychometric function to the number of '1' answers and the number
+    of trials at each level. This gives the same fit as `fit_th` on the
+    trials themselves.
 
     Parameters
     ----------
-    data_file : str,
-        the full path to a file with some data. If this is not provided, the
-        user will be prompted to navigate to the file with a file-browser. 
+    x : array (n_levels,)
+        The stimulus levels. Levels without trials are ignored.
 
-    fig_name : str, 
-        The name of the figure to save. If not provided, the figure will not be
-        saved.
-    cue_cond : str,
-        whether to analyze the 'cued' condition or the 'other' condition.
+    n_correct : array (n_levels,)
+        The number of '1' answers at each level.
 
-    fit_func : str,
-         What type of function to fit to the data ('cumgauss' or 'weib')
+    n_trials : array (n_levels,)
+        The number of trials at each level.
 
-    log_scale : bool,
-        Whether to transform things into a log scale (FWIW).
+    initial : tuple
+        The initial guess for the parameters.
 
-    boot : int,
-        The number of iterations of fitting in the boot-strap procedure.
+    fit_func : str
+        'cumgauss', 'cumgauss_w_asym' or 'weib'
 
-    leave_one_out : bool
-        Whether to 
+    method, warm_start, full_output :
+        See `fit_th`.
 
-    even_or_odd : bool
-        Whether to take only even or only odd trials in each sample.
+    """
+    if method is None:
+        if fit_func == 'cumgauss':
+            method = 'lm'
+        else:
+            method = 'leastsq'
+
+    keep = np.asarray(n_trials) > 0
+    x = np.asarray(x, dtype=float)[keep]
+    n_correct = np.asarray(n_correct, dtype=float)[keep]
+    n_trials = np.asarray(n_trials)[keep]
+
+    if method == 'mle':
+        return fit_mle(x, n_correct, n_trials, initial, fit_func, full_output)
+    p = n_correct / n_trials
+    if method == 'lm':
+        if fit_func != 'cumgauss':
+            fit = fit_th_batch(x, p, n_trials, initial, fit_func,
+                               full_output=full_output)
+            if full_output:
+                fit, info = fit
+                return fit[0], dict([(k, v[0]) for k, v in info.items()])
+            return fit[0]
+        if not warm_start:
+            initial = _probit_initial(x, p, n_trials, initial)[0]
+        return fit_cumgauss(x, p, n_trials, initial, full_output=full_output)
+    n_trials = n_trials.astype(int)
+    return fit_th(np.repeat(x, n_trials), np.repeat(p, n_trials), initial,
+                  fit_func, method, full_output=full_output)
+
+# Whether to use the numba-compiled versions of the kernels (see
+# `cumgauss_jac` and `weibull_jac`), which requires numba. On a single core,
+# the numpy versions are about as fast (see benchmarks.py), so they are the
+# default:
+use_numba = False
+_numba_kernels = {}
+
+def _numba_kernel(fit_func):
+    """
+    The numba version of the kernel for fit_func, compiled the first time it
+    is needed. These are generalized ufuncs with scalar core dimensions, so
+    they broadcast their inputs and write into their output arguments.
+    """
+    if fit_func in _numba_kernels:
+        return _numba_kernels[fit_func]
+    import numba
+
+    if fit_func == 'cumgauss':
+        @numba.guvectorize(['void(f8, f8, f8, f8[:], f8[:], f8[:])'],
+                           '(),(),()->(),(),()', nopython=True)
+        def kernel(x, mu, sigma, p, d_mu, d_sigma):
+            z = (x - mu) / sigma
+            p[0] = 0.5 * (1 + math.erf(z / math.sqrt(2)))
+            d_mu[0] = -math.exp(-z ** 2 / 2) / (math.sqrt(2 * math.pi) * sigma)
+            d_sigma[0] = d_mu[0] * z
+
+    elif fit_func == 'weib':
+        @numba.guvectorize(['void(f8, f8, f8, f8, f8, f8[:], f8[:], f8[:], '
+                            'f8[:], f8[:])'],
+                           '(),(),(),(),()->(),(),(),(),()', nopython=True)
+        def kernel(x, thresh, slope, guess, flake, p, d_thresh, d_slope,
+                   d_guess, d_flake):
+            r = x / thresh
+            if r > 0:
+                log_r = math.log(r)
+            elif r == 0:
+                log_r = -np.inf
+            else:
+                log_r = np.nan
+            u = r ** slope
+            e = math.exp(-u)
+            d = flake - guess
+            p[0] = flake - d * e
+            d_thresh[0] = -d * e * u * slope / thresh
+            d_slope[0] = d * e * u * log_r
+            d_guess[0] = e
+            d_flake[0] = 1 - e
+
+    _numba_kernels[fit_func] = kernel
+    return kernel
+
+def _kernel_out(n_out, *args):
+    """
+    Allocate the outputs of a kernel, with the broadcast shape of its inputs
+    """
+    shape = np.broadcast(*args).shape
+    return tuple([np.empty(shape) for i in range(n_out)])
 
-    distractor_high, distractor_low : float
-       If this is None (default), it's just ignored. Otherwise, these are the
-       low and high bounds on selecting distractor contrasts
+def cumgauss_jac(x, mu, sigma, out=None):
+    """
+    The cumulative Gaussian (see `cumgauss`) together with its derivatives
+    with respect to mu and sigma, computed in one pass.
 
-    analyze_distractor : bool
-        When set to True, the curves are of the distractor contrast instead of
-        the target contrast.
+    Parameters
+    ----------
+    x, mu, sigma : float or array
+        Broadcast against each other (e.g. x (n_fits, n_levels) with mu and
+        sigma (n_fits, 1)).
+
+    out : tuple of 3 arrays, optional
+        Buffers for p, d_mu and d_sigma, with the broadcast shape of the
+        inputs. With these, no arrays of that size are allocated, so the
+        kernel can be called over and over inside a fitting loop.
+
+    Returns
+    -------
+    p, d_mu, d_sigma : arrays
 
     """
+    if out is None:
+        out = _kernel_out(3, x, mu, sigma)
+    p, d_mu, d_sigma = out
+    if use_numba:
+        _numba_kernel('cumgauss')(x, mu, sigma, p, d_mu, d_sigma)
+        return p, d_mu, d_sigma
+
+    # z goes in d_sigma, until it's needed for the derivative:
+    np.subtract(x, mu, out=d_sigma)
+    np.divide(d_sigma, sigma, out=d_sigma)
+    np.divide(d_sigma, np.sqrt(2), out=p)
+    erf(p, out=p)
+    p += 1
+    p *= 0.5
+    np.square(d_sigma, out=d_mu)
+    np.negative(d_mu, out=d_mu)
+    d_mu /= 2
+    np.exp(d_mu, out=d_mu)
+    np.divide(d_mu, np.sqrt(2 * np.pi) * sigma, out=d_mu)
+    np.negative(d_mu, out=d_mu)
+    d_sigma *= d_mu
+    return p, d_mu, d_sigma
+
+def weibull_jac(x, thresh, slope, guess, flake, out=None):
+    """
+    The cumulative Weibull (see `weibull`, with the default threshy)
+    together with its derivatives with respect to each of its parameters,
+    computed in one pass.
 
-    p,l,data_rec = get_data(data_file, even_or_odd=even_or_odd)
+    With the default threshy, the scaling of x by k in `weibull` is exactly
+    1, so it isn't computed.
 
-    if cue_cond == 'cued':
-        cue_cond_idx = np.where(data_rec['cue_side']==data_rec['ask_side'])[0]
-    elif cue_cond == 'other':
-        cue_cond_idx = np.where(data_rec['cue_side']!=data_rec['ask_side'])[0]
+    Parameters
+    ----------
+    x, thresh, slope, guess, flake : float or array
+        Broadcast against each other.
 
-    center_contrasts = [float(t) for t in
-    p['center_contrast'].split('[')[1].split(']')[0].split(' ')[1::2]]
-    
-    base_contrast = []
-    for i, ask_side in enumerate(data_rec['ask_side'][cue_cond_idx]):
-        base_contrast.append(data_rec[ask_side + '_contrast2'][cue_cond_idx][i])
+    out : tuple of 5 arrays, optional
+        Buffers for the outputs (see `cumgauss_jac`).
 
-    if fig_name is not None: 
-        # Get the color cycle from the mpl rc params:
-        rc = matplotlib.rc_params()
-        colors = rc['axes.color_cycle'][:len(center_contrasts)]
-        fig = plt.figure()
-        ax = fig.add_subplot(1,1,1)
+    Returns
+    -------
+    p, d_thresh, d_slope, d_guess, d_flake : arrays
 
-    fits = []
-    keep_x = []
-    keep_y = []
+    """
+    if out is None:
+        out = _kernel_out(5, x, thresh, slope, guess, flake)
+    p, d_thresh, d_slope, d_guess, d_flake = out
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if use_numba:
+            _numba_kernel('weib')(x, thresh, slope, guess, flake, p, d_thresh,
+                                  d_slope, d_guess, d_flake)
+            return out
+
+        # r = x / thresh and u = r ** slope go in d_guess, log(r) in d_flake:
+        np.divide(x, thresh, out=d_guess)
+        np.log(d_guess, out=d_flake)
+        np.power(d_guess, slope, out=d_guess)
+        # e = exp(-u) in d_thresh:
+        np.negative(d_guess, out=d_thresh)
+        np.exp(d_thresh, out=d_thresh)
+        d = flake - guess
+        np.multiply(d_thresh, d, out=p)
+        np.subtract(flake, p, out=p)
+        # d * e * u:
+        np.multiply(d_thresh, d_guess, out=d_slope)
+        d_slope *= d
+        np.copyto(d_guess, d_thresh)
+        np.multiply(d_slope, slope, out=d_thresh)
+        np.divide(d_thresh, thresh, out=d_thresh)
+        np.negative(d_thresh, out=d_thresh)
+        d_slope *= d_flake
+        np.subtract(1, d_guess, out=d_flake)
+    return out
 
-    boot_th_ub = []
-    boot_sl_ub = []
-    boot_th_lb = []
-    boot_sl_lb = []
+def psychometric_jac(x, params, fit_func='cumgauss', out=None):
+    """
+    The psychometric function at x, together with its derivatives with respect
+    to each of the parameters (see `cumgauss_jac` and `weibull_jac`).
 
-    min_x=1
-    max_x=0
-    for contrast in center_contrasts:
-        c_idx = np.where(np.abs(np.array(base_contrast)-contrast)<0.01)[0]
-        this_ask = data_rec['ask_contrast'][cue_cond_idx][c_idx]
-        # Move it into the interval [0,1] with the right directionality: when
-        # the value of this_ask was high, the chances were higher for a '1'
-        # answer than for a '2' answer (that's the "1 - " at the beginning of
-        # next line):
-        this_ans = 1 - (data_rec['answer'][cue_cond_idx][c_idx] - 1) 
-        x = np.array(contrast) + this_ask
+    Parameters
+    ----------
+    x : array
+        The stimulus levels.
 
-        if analyze_distractor:
-            x = []
-            for i in range(len(this_ans)):
-                if data_rec['ask_side'][i] == 'r':
-                    x.append(data_rec['l_contrast1'][i] -
-                             data_rec['l_contrast2'][i])
-                elif data_rec['ask_side'][i] == 'l':
-                    x.append(data_rec['r_contrast1'][i] -
-                             data_rec['r_contrast2'][i])
-        
-        if log_scale:
-            x = np.log10(x)
-        
-        # Begin by guessing that the mean is the same as the contrast shown
-        # (no bias):
-        if fit_func == 'cumgauss':
-            initial = contrast, 1
-        elif fit_func == 'cumgauss_w_asym':
-            initial = contrast, 1, 0, 1
-        elif fit_func == 'weib':
-            initial = contrast, 3.5, 0, 1
+    params : sequence
+        The parameters, in the order used by `fit_th` for this fit_func. Each
+        of them can be an array, broadcast against x.
 
-        # Generate the y axis:
-        y = []
+    fit_func : str
+        'cumgauss', 'cumgauss_w_asym' or 'weib'
 
-        # If we want to select trials by distractor, we'll need to pay
-        # attention to that right about here:
-        if distractor_high is not None:
-            other_contrast = []
-            for i in range(len(this_ans)):
-                if data_rec['ask_side'][i] == 'r':
-                    other_contrast.append(data_rec['l_contrast1'][i])
-                elif data_rec['ask_side'][i] == 'l':
-                    other_contrast.append(data_rec['r_contrast1'][i])
-
-            other_contrast = np.array(other_contrast)
-            distract_idx = np.where(np.logical_and(
-                                    other_contrast > distractor_low,
-                                    other_contrast < distractor_high))
+    out : tuple (p, jac), optional
+        Buffers for the outputs, of the shapes below.
 
-            # We're going to curtail both of these puppies:
-            x = x[distract_idx]
-            
-            for i in range(len(x)):
-                # Need to take into account that this is in a new
-                # coordinate-system! 
-                y.append(np.mean(this_ans[distract_idx][x==x[i]]))
+    Returns
+    -------
+    p : array, the broadcast shape of x and the parameters
+    jac : array (n_params,) + p.shape
+    
+    """
+    x = np.asarray(x, dtype=float)
+    if out is None:
+        p = _kernel_out(1, x, *params)[0]
+        jac = np.empty((len(params),) + p.shape)
+    else:
+        p, jac = out
+    if fit_func in ('cumgauss', 'cumgauss_w_asym'):
+        cumgauss_jac(x, params[0], params[1], out=(p, jac[0], jac[1]))
+        # cumgauss ignores the asymptotes, so their derivatives stay 0
+        jac[2:] = 0
+    elif fit_func == 'weib':
+        weibull_jac(x, *params, out=(p,) + tuple(jac))
+    else:
+        raise ValueError("Unknown fit_func: %s"%fit_func)
+    return p, jac
+
+# Bounds on the parameters in maximum-likelihood fits (see fit_mle). The
+# slopes need to stay positive and the asymptotes between 0 and 1, for the
+# likelihood to be defined:
+_mle_bounds = dict(cumgauss=[(0, 1), (1e-6, None)],
+                   cumgauss_w_asym=[(None, None), (1e-6, None), (0, 1),
+                                    (0, 1)],
+                   weib=[(1e-6, 1), (1e-6, None), (0, 1), (0, 1)])
+
+def fit_mle(x, n_correct, n_trials, initial, fit_func='cumgauss',
+            full_output=False):
+    """
+    Maximum-likelihood fit of a psychometric function to the number of '1'
+    answers at each level.
 
-        else:
-            for i in range(len(this_ans)):
-                y.append(np.mean(this_ans[this_ask==this_ask[i]]))
+    The binomial likelihood is maximized with L-BFGS-B, using the analytic
+    gradient (see `psychometric_jac`). The size of the problem depends only on
+    the number of levels, not on the number of trials.
 
-        # Make sure: 
-        y = np.array(y)
-        x = np.array(x)
+    Parameters
+    ----------
+    x : array (n_levels,)
+        The stimulus levels.
 
-        if verbose:
-            print("Using the %s function to analyze this"%fit_func)
+    n_correct : array (n_levels,)
+        The number of '1' answers at each level.
 
-        if even_or_odd == 'even':
-            fit_x = x[::2]
-            fit_y = y[::2]
-        elif even_or_odd == 'odd':
-            fit_x = x[1::2]
-            fit_y = y[1::2]
+    n_trials : array (n_levels,)
+        The number of trials at each level.
+
+    initial : tuple
+        The initial guess for the parameters.
+
+    fit_func : str
+        'cumgauss', 'cumgauss_w_asym' or 'weib'
+
+    full_output : bool
+        Whether to also return the diagnostics of the fit (see `fit_th`).
+
+    Returns
+    -------
+    this_fit : array
+    
+    """
+    x = np.asarray(x, dtype=float)
+    n_correct = np.asarray(n_correct, dtype=float)
+    n_trials = np.asarray(n_trials, dtype=float)
+    # Keep away from log(0):
+    eps = 1e-10
+
+    def neg_log_lik(params):
+        p, jac = psychometric_jac(x, params, fit_func)
+        p = np.clip(p, eps, 1 - eps)
+        nll = -np.sum(n_correct * np.log(p) +
+                      (n_trials - n_correct) * np.log(1 - p))
+        grad = -np.dot(jac, (n_correct - n_trials * p) / (p * (1 - p)))
+        return nll, grad
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        res = minimize(neg_log_lik, np.array(initial, dtype=float),
+                       jac=True, method='L-BFGS-B',
+                       bounds=_mle_bounds[fit_func])
+    this_fit = res.x
+    # If you get back a nan, replace with the initial guess:
+    n_nan = _replace_nans(this_fit, initial)
+    if full_output:
+        return this_fit, dict(nfev=res.nfev, converged=res.success,
+                              n_nan=n_nan)
+    return this_fit
+
+def _probit_initial(x, y, w, initial):
+    """
+    Initial guess for cumulative Gaussian fits, from a weighted linear
+    regression of the probit of y on x. Rows of y for which this can't be done
+    (fewer than two levels with some trials, or a flat line) get `initial`.
+
+    Parameters
+    ----------
+    x : array (n_levels,) or (n_fits, n_levels)
+    y : array (n_fits, n_levels)
+    w : array (n_fits, n_levels)
+        The number of trials at each level.
+    initial : tuple (mu, sigma) or array (n_fits, 2)
+
+    Returns
+    -------
+    guess : array (n_fits, 2)
+
+    """
+    y = np.atleast_2d(np.asarray(y, dtype=float))
+    w = np.atleast_2d(np.asarray(w, dtype=float))
+    x = np.asarray(x, dtype=float)
+    guess = np.array(np.broadcast_to(np.asarray(initial, dtype=float),
+                                     (y.shape[0], 2)))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Keep away from 0 and 1 by half a trial:
+        half = 0.5 / w
+        z = ndtri(np.minimum(np.maximum(y, half), 1 - half))
+        # Weigh each level by the inverse of the variance of its probit:
+        ww = w * np.exp(-z * z)
+        empty = w == 0
+        if empty.any():
+            z[empty] = 0
+            ww[empty] = 0
+        sw = ww.sum(-1)
+        mx = (ww * x).sum(-1) / sw
+        mz = (ww * z).sum(-1) / sw
+        dx = x - mx[:, np.newaxis]
+        wdx = ww * dx
+        slope = (wdx * z).sum(-1) / (wdx * dx).sum(-1)
+        mu = mx - mz / slope
+        sigma = 1 / slope
+    ok = np.isfinite(mu) & np.isfinite(sigma) & (slope != 0)
+    guess[ok, 0] = mu[ok]
+    guess[ok, 1] = sigma[ok]
+    return guess
+
+def fit_cumgauss(x, y, w, initial, max_iter=100, tol=1.49012e-08,
+                 bounds=((0, 1), (-np.inf, np.inf)), full_output=False):
+    """
+    Fit the cumulative Gaussian to one set of data.
+
+    This is the same fit as `fit_cumgauss_batch`, for a single row of data.
+    For the handful of levels in one curve, the overhead of numpy calls
+    dominates, so the iterations are done on plain floats instead.
+
+    Parameters
+    ----------
+    x : array (n_levels,)
+        The stimulus levels.
+
+    y : array (n_levels,)
+        The proportion of '1' answers at each level.
+
+    w : array (n_levels,)
+        The weight of each level (typically, the number of trials).
+
+    initial : tuple
+        (mu, sigma) to start from.
+
+    max_iter, tol, bounds :
+        See `fit_cumgauss_batch`
+
+    full_output : bool
+        Whether to also return the diagnostics of the fit (see `fit_th`).
+
+    Returns
+    -------
+    fit : array (2,)
+        mu and sigma
+
+    """
+    levels = [(float(xx), float(yy) - 0.5, float(ww))
+              for xx, yy, ww in zip(x, y, w) if ww > 0]
+    (mu_lb, mu_ub), (sigma_lb, sigma_ub) = bounds
+    mu = min(max(float(initial[0]), mu_lb), mu_ub)
+    sigma = min(max(float(initial[1]), sigma_lb), sigma_ub)
+    c_erf = 1 / math.sqrt(2)
+    c_pdf = -1 / math.sqrt(2 * math.pi)
+
+    def err(mu, sigma):
+        ss = 0.0
+        rz = []
+        for xx, yy, ww in levels:
+            z = (xx - mu) / sigma
+            r = yy - 0.5 * math.erf(z * c_erf)
+            ss += ww * r * r
+            rz.append((r, z))
+        return ss, rz
+
+    nfev = 1
+    converged = False
+    try:
+        ss, rz = err(mu, sigma)
+    except ZeroDivisionError:
+        fit = np.array(initial, dtype=float)
+        if full_output:
+            return fit, dict(nfev=nfev, converged=converged, n_nan=0)
+        return fit
+
+    lam = 0.1
+    for i in range(max_iter):
+        # Damped normal equations, with the analytic Jacobian:
+        a00 = a01 = a11 = g0 = g1 = 0.0
+        k = c_pdf / sigma
+        for (r, z), (xx, yy, ww) in zip(rz, levels):
+            j_mu = math.exp(-0.5 * z * z) * k
+            j_sigma = j_mu * z
+            wj_mu = ww * j_mu
+            wj_sigma = ww * j_sigma
+            a00 += wj_mu * j_mu
+            a01 += wj_mu * j_sigma
+            a11 += wj_sigma * j_sigma
+            g0 += wj_mu * r
+            g1 += wj_sigma * r
+        d00 = a00 * (1 + lam)
+        d11 = a11 * (1 + lam)
+        det = d00 * d11 - a01 * a01
+        if det <= 0:
+            break
+        d_mu = (d11 * g0 - a01 * g1) / det
+        d_sigma = (d00 * g1 - a01 * g0) / det
+
+        # Parameters sitting on a bound, that the step would push out, are
+        # held there, and the other one is stepped alone:
+        hold_mu = ((mu <= mu_lb and d_mu < 0) or (mu >= mu_ub and d_mu > 0))
+        hold_sigma = ((sigma <= sigma_lb and d_sigma < 0) or
+                      (sigma >= sigma_ub and d_sigma > 0))
+        if hold_mu:
+            d_mu = 0.0
+            d_sigma = 0.0 if hold_sigma else g1 / d11
+        elif hold_sigma:
+            d_sigma = 0.0
+            d_mu = g0 / d00
+
+        new_mu = min(max(mu + d_mu, mu_lb), mu_ub)
+        new_sigma = min(max(sigma + d_sigma, sigma_lb), sigma_ub)
+        nfev += 1
+        try:
+            new_ss, new_rz = err(new_mu, new_sigma)
+        except ZeroDivisionError:
+            new_ss = np.inf
+        if new_ss <= ss:
+            done = ss - new_ss <= tol * ss
+            mu, sigma, ss, rz = new_mu, new_sigma, new_ss, new_rz
+            lam /= 10
+            if done:
+                converged = True
+                break
+        else:
+            lam *= 10
+            if lam > 1e10:
+                # No step makes it any better, so this is a minimum:
+                converged = True
+                break
+
+    fit = np.array([mu, sigma])
+    # If you get back a nan, replace with the initial guess:
+    n_nan = _replace_nans(fit, initial)
+    if full_output:
+        return fit, dict(nfev=nfev, converged=converged, n_nan=n_nan)
+    return fit
+
+def fit_cumgauss_batch(x, y, w, initial, max_iter=100, tol=1.49012e-08,
+                       bounds=((0, 1), (-np.inf, np.inf)), full_output=False):
+    """
+    Fit the cumulative Gaussian to many sets of data at once.
+
+    Each row of y is fit separately, by weighted least-squares, using
+    Levenberg-Marquardt steps with the analytic Jacobian. All the rows are
+    updated together, so the cost of fitting a few thousand curves is not much
+    larger than the cost of fitting one.
+
+    Parameters
+    ----------
+    x : array (n_levels,) or (n_fits, n_levels)
+        The stimulus levels.
+
+    y : array (n_fits, n_levels)
+        The proportion of '1' answers at each level.
+
+    w : array (n_fits, n_levels)
+        The weight of each level (typically, the number of trials). Fitting
+        with these weights is equivalent to fitting each trial separately, as
+        `fit_th` does.
+
+    initial : tuple (mu, sigma) or array (n_fits, 2)
+        The starting point for the fit.
+
+    max_iter : int
+        The maximal number of iterations.
+
+    tol : float
+        Fits stop when the relative reduction of the error is smaller than
+        this (the default is the same as in scipy.optimize.leastsq).
+
+    bounds : sequence of (min, max) pairs
+        Bounds on mu and on sigma. Steps that take the parameters out of these
+        bounds are projected back into them. As in `fit_th`, the default
+        keeps mu between 0 and 1.
+
+    full_output : bool
+        Whether to also return the diagnostics of the fits (see `fit_th`), as
+        arrays with one value per row of y.
+
+    Returns
+    -------
+    fits : array (n_fits, 2)
+        mu and sigma for each row of y.
+
+    """
+    y = np.atleast_2d(np.asarray(y, dtype=float))
+    w = np.atleast_2d(np.asarray(w, dtype=float))
+    x = np.broadcast_to(np.asarray(x, dtype=float), y.shape)
+    n_fits = y.shape[0]
+    initial = np.broadcast_to(np.asarray(initial, dtype=float), (n_fits, 2))
+    lb, ub = np.array(bounds, dtype=float).T
+    params = np.clip(initial, lb, ub)
+
+    def err(params):
+        r = y - cumgauss(x, params[:, 0:1], params[:, 1:2])
+        return np.sum(w * r ** 2, -1), r
+
+    ss, r = err(params)
+    lam = np.ones(n_fits) * 0.1
+    active = np.isfinite(ss)
+    nfev = np.ones(n_fits, dtype=int)
+    converged = np.zeros(n_fits, dtype=bool)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        for i in range(max_iter):
+            if not np.any(active):
+                break
+            mu = params[:, 0:1]
+            sigma = params[:, 1:2]
+            z = (x - mu) / sigma
+            pdf = np.exp(-z ** 2 / 2) / np.sqrt(2 * np.pi)
+            j_mu = -pdf / sigma
+            j_sigma = j_mu * z
+
+            # Damped normal equations, solved in closed form for each row:
+            a00 = np.sum(w * j_mu ** 2, -1)
+            a01 = np.sum(w * j_mu * j_sigma, -1)
+            a11 = np.sum(w * j_sigma ** 2, -1)
+            g0 = np.sum(w * j_mu * r, -1)
+            g1 = np.sum(w * j_sigma * r, -1)
+            d00 = a00 * (1 + lam)
+            d11 = a11 * (1 + lam)
+            det = d00 * d11 - a01 ** 2
+            d_mu = (d11 * g0 - a01 * g1) / det
+            d_sigma = (d00 * g1 - a01 * g0) / det
+
+            # Parameters sitting on a bound, that the step would push out,
+            # are held there, and the other one is stepped alone:
+            hold_mu = (((params[:, 0] <= lb[0]) & (d_mu < 0)) |
+                       ((params[:, 0] >= ub[0]) & (d_mu > 0)))
+            hold_sigma = (((params[:, 1] <= lb[1]) & (d_sigma < 0)) |
+                          ((params[:, 1] >= ub[1]) & (d_sigma > 0)))
+            d_mu = np.where(hold_mu, 0, np.where(hold_sigma, g0 / d00, d_mu))
+            d_sigma = np.where(hold_sigma, 0,
+                               np.where(hold_mu, g1 / d11, d_sigma))
+
+            new_params = np.clip(params + np.array([d_mu, d_sigma]).T, lb, ub)
+            new_ss, new_r = err(new_params)
+            nfev += active
+            better = active & (new_ss <= ss)
+            done = better & (ss - new_ss <= tol * ss)
+            params[better] = new_params[better]
+            r[better] = new_r[better]
+            ss[better] = new_ss[better]
+            lam[better] /= 10
+            lam[active & ~better] *= 10
+            # As in fit_cumgauss, stopping because no step makes it any better
+            # counts as converging:
+            converged |= done | (active & (lam >= 1e10))
+            active &= ~done & (lam < 1e10)
+
+    # If you get back a nan, replace with the initial guess:
+    n_nan = _replace_nans(params, initial)
+    if full_output:
+        return params, dict(nfev=nfev, converged=converged, n_nan=n_nan)
+    return params
+
+# Bounds on the parameters in batched least-squares fits (see fit_th_batch),
+# the same as the limits set in the error function of fit_th. The weibull is
+# also bounded as in fit_mle, since with its asymptotes free, LM otherwise
+# drifts to a curve with a negative slope and flipped asymptotes:
+_lm_bounds = dict(cumgauss=[(0, 1), (-np.inf, np.inf)],
+                  cumgauss_w_asym=[(-np.inf, np.inf), (-np.inf, np.inf),
+                                   (0, np.inf), (-np.inf, 1)],
+                  weib=[(0, 1), (1e-6, np.inf), (0, 1), (0, 1)])
+
+def _uses_lm(fit_func, method):
+    """
+    Whether fits with this fit_func and method are done with batched
+    Levenberg-Marquardt (see `fit_th`)
+    """
+    return method == 'lm' or (method is None and fit_func == 'cumgauss')
+
+def fit_th_batch(x, y, w, initial, fit_func='cumgauss', free=None,
+                 bounds=None, max_iter=100, tol=1.49012e-08,
+                 full_output=False):
+    """
+    Fit a psychometric function to many sets of data at once.
+
+    Each row of y is fit separately, by weighted least-squares, using
+    Levenberg-Marquardt steps with the analytic Jacobian (see
+    `psychometric_jac`). All the rows are updated together, and rows stop
+    changing once they have converged. The cumulative Gaussian is fit with
+    `fit_cumgauss_batch`, which does the same for its two parameters in
+    closed form.
+
+    Parameters
+    ----------
+    x : array (n_levels,) or (n_fits, n_levels)
+        The stimulus levels.
+
+    y : array (n_fits, n_levels)
+        The proportion of '1' answers at each level.
+
+    w : array (n_fits, n_levels)
+        The weight of each level (typically, the number of trials).
+
+    initial : tuple or array (n_fits, n_params)
+        The starting point for the fit.
+
+    fit_func : str
+        'cumgauss', 'cumgauss_w_asym' or 'weib'
+
+    free : sequence of bool, optional
+        Which of the parameters to fit. The others are held at their initial
+        values. Defaults to all of them. Parameters that the function doesn't
+        depend on (the asymptotes of 'cumgauss_w_asym') are also held.
+
+    bounds : sequence of (min, max) pairs, optional
+        Bounds on each parameter. As in `fit_cumgauss_batch`, steps are
+        clipped to these bounds, and parameters sitting on a bound that the
+        step would push out are held there. Defaults to the limits used by
+        `fit_th` for this fit_func (with the weibull also bounded as in
+        `fit_mle`).
+
+    max_iter, tol, full_output :
+        See `fit_cumgauss_batch`.
+
+    Returns
+    -------
+    fits : array (n_fits, n_params)
+
+    """
+    if bounds is None:
+        bounds = _lm_bounds[fit_func]
+    if fit_func == 'cumgauss' and (free is None or np.all(free)):
+        return fit_cumgauss_batch(x, y, w, initial, max_iter, tol, bounds,
+                                  full_output)
+
+    y = np.atleast_2d(np.asarray(y, dtype=float))
+    w = np.atleast_2d(np.asarray(w, dtype=float))
+    x = np.broadcast_to(np.asarray(x, dtype=float), y.shape)
+    n_fits = y.shape[0]
+    initial = np.asarray(initial, dtype=float)
+    n_params = initial.shape[-1]
+    initial = np.broadcast_to(initial, (n_fits, n_params))
+    if free is None:
+        free = np.ones(n_params, dtype=bool)
+    free = np.asarray(free, dtype=bool)
+    lb, ub = np.array(bounds, dtype=float).T
+    params = np.clip(initial, lb, ub)
+    diag = np.arange(n_params)
+    # The fixed parameters get a step of 0, and the others are solved for
+    # without them:
+    fixed = ~free
+
+    # The residuals and derivatives at the current parameters and at the
+    # tried step are computed into these, so the iterations don't allocate
+    # them again:
+    r = np.empty(y.shape)
+    new_r = np.empty(y.shape)
+    jac_buf = np.empty((n_params,) + y.shape)
+    new_jac_buf = np.empty((n_params,) + y.shape)
+    # The same, with the parameters last:
+    jac = np.rollaxis(jac_buf, 0, 3)
+    new_jac = np.rollaxis(new_jac_buf, 0, 3)
+    unweighted = w == 0
+
+    def err(params, r, jac_buf):
+        psychometric_jac(x, params.T[..., np.newaxis], fit_func,
+                         out=(r, jac_buf))
+        np.subtract(y, r, out=r)
+        # Levels without any weight don't count, even where the function or
+        # its derivatives aren't defined:
+        np.copyto(r, 0, where=unweighted)
+        np.copyto(jac_buf, 0, where=unweighted)
+        ss = np.einsum('nl,nl,nl->n', w, r, r)
+        ss[np.any((params < lb) | (params > ub), -1)] = np.inf
+        return ss
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        ss = err(params, r, jac_buf)
+        lam = np.ones(n_fits) * 0.1
+        active = np.isfinite(ss)
+        nfev = np.ones(n_fits, dtype=int)
+        converged = np.zeros(n_fits, dtype=bool)
+        for i in range(max_iter):
+            if not np.any(active):
+                break
+            # Damped normal equations:
+            wjac = w[..., np.newaxis] * jac
+            a = np.einsum('nlp,nlq->npq', wjac, jac)
+            g = np.einsum('nlp,nl->np', wjac, r)
+            # Parameters on which the function doesn't depend here (such as
+            # the asymptotes of cumgauss_w_asym) can't be solved for, and are
+            # held, as the fixed ones:
+            held = fixed | (a[:, diag, diag] == 0)
+            # So are parameters sitting on a bound, that the step would push
+            # out (as in fit_cumgauss_batch), such as the asymptotes of the
+            # initial guess of the weibull:
+            held |= ((params <= lb) & (g < 0)) | ((params >= ub) & (g > 0))
+            a[:, diag, diag] *= (1 + lam[:, np.newaxis])
+            a[held[:, :, np.newaxis] | held[:, np.newaxis, :]] = 0
+            a[:, diag, diag] += held
+            g[held] = 0
+            # No step can be found from here:
+            ok = np.linalg.det(a) > 0
+            active &= ok
+            a[~ok] = np.eye(n_params)
+            g[~ok] = 0
+            step = np.linalg.solve(a, g[..., np.newaxis])[..., 0]
+
+            new_params = np.clip(params + step, lb, ub)
+            new_ss = err(new_params, new_r, new_jac_buf)
+            nfev += active
+            better = active & (new_ss <= ss)
+            done = better & (ss - new_ss <= tol * ss)
+            params[better] = new_params[better]
+            r[better] = new_r[better]
+            jac[better] = new_jac[better]
+            ss[better] = new_ss[better]
+            lam[better] /= 10
+            lam[active & ~better] *= 10
+            converged |= done | (active & (lam >= 1e10))
+            active &= ~done & (lam < 1e10)
+
+    # If you get back a nan, replace with the initial guess:
+    n_nan = _replace_nans(params, initial)
+    if full_output:
+        return params, dict(nfev=nfev, converged=converged, n_nan=n_nan)
+    return params
+
+def _boot_batch(x, ans, group, initial, boot, fit_func='cumgauss', rng=None,
+                method=None, stratified=False, warm_start=False,
+                full_output=False):
+    """
+    Fit `boot` bootstrap resamples of the trials, drawn all at once.
+
+    Each resample is reduced to the number of trials and the number of '1'
+    answers in every cell (a unique combination of x and group), so that the
+    cost of fitting does not depend on the number of trials. The proportion
+    fit at each trial is the mean answer in its group, as in the trial-by-trial
+    bootstrap of `analyze_constant`.
+
+    With stratified=True, the trials are resampled within each cell. Since the
+    answers are 0 or 1, the number of '1' answers in a resampled cell is
+    binomial, so the resamples are drawn directly as counts, without drawing
+    any trials.
+
+    Parameters
+    ----------
+    x : array (n_trials,)
+        The value at which each trial is fit.
+
+    ans : array (n_trials,)
+        The answer (0 or 1) on each trial.
+
+    group : array (n_trials,)
+        The value by which trials are grouped to calculate proportions.
+
+    initial : tuple
+        The initial guess for the fit.
+
+    boot : int
+        The number of bootstrap samples
+
+    fit_func : str
+        The function to fit.
+
+    rng : np.random.RandomState
+        Random number generator. Defaults to the global numpy random state.
+
+    method : str
+        See `fit_th`. With 'lm' (the default for 'cumgauss'), all the
+        resamples are fit together, with `fit_th_batch`. Otherwise, they are
+        fit one by one, with `fit_counts`.
+
+    stratified : bool
+        Whether to keep the number of trials in each cell fixed.
+
+    warm_start, full_output : bool
+        See `fit_th`. The diagnostics are arrays, with one value per
+        resample.
+
+    Returns
+    -------
+    fits : array (boot, n_params)
+
+    """
+    x = np.asarray(x)
+    n = x.shape[0]
+    x_u, x_inv = np.unique(x, return_inverse=True)
+    g_u, g_inv = np.unique(group, return_inverse=True)
+    n_groups = g_u.shape[0]
+    cells, cell_inv = np.unique(x_inv * n_groups + g_inv, return_inverse=True)
+    cell_inv = cell_inv.ravel()
+    n_cells = cells.shape[0]
+    cell_x = x_u[cells // n_groups]
+    cell_g = cells % n_groups
+    ans = np.asarray(ans, dtype=float)
+
+    if rng is None:
+        rng = np.random
+    if stratified:
+        cell_n = np.bincount(cell_inv, minlength=n_cells)
+        cell_p = np.bincount(cell_inv, weights=ans, minlength=n_cells) / cell_n
+        # All the resamples, in one (boot, n_cells) array of counts:
+        n_trials = np.tile(cell_n, (boot, 1))
+        n_correct = rng.binomial(n_trials, cell_p)
+    else:
+        idx = rng.randint(0, n, (boot, n))
+        flat = (np.arange(boot)[:, np.newaxis] * n_cells +
+                cell_inv[idx]).ravel()
+        n_trials = np.bincount(flat,
+                               minlength=boot * n_cells).reshape(boot, n_cells)
+        n_correct = np.bincount(flat, weights=ans[idx].ravel(),
+                                minlength=boot * n_cells).reshape(boot, n_cells)
+
+    # Pool cells into groups to get the proportions:
+    in_group = (cell_g[:, np.newaxis] == np.arange(n_groups)).astype(float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        y = (np.dot(n_correct, in_group) / np.dot(n_trials, in_group))[:, cell_g]
+    y[n_trials == 0] = 0
+
+    if _uses_lm(fit_func, method):
+        if fit_func == 'cumgauss' and not warm_start:
+            initial = _probit_initial(cell_x, y, n_trials, initial)
+        return fit_th_batch(cell_x, y, n_trials, initial, fit_func,
+                            full_output=full_output)
+
+    fits = []
+    infos = []
+    for b in range(boot):
+        this_fit, info = fit_counts(cell_x, y[b] * n_trials[b], n_trials[b],
+                                    initial, fit_func, method, warm_start,
+                                    full_output=True)
+        fits.append(this_fit)
+        infos.append(info)
+    if full_output:
+        return np.array(fits), _stack_info(infos)
+    return np.array(fits)
+
+def _stack_info(infos):
+    """
+    Gather the diagnostics of many fits (see `fit_th`) into arrays
+    """
+    return dict([(k, np.array([info[k] for info in infos]))
+                 for k in ['nfev', 'converged', 'n_nan']])
+
+def _bootstrap(rng, x, ans, ask, group, initial, boot, fit_func='cumgauss',
+               method=None, boot_method='loop', warm_start=False):
+    """
+    Bootstrap the fit of one curve in `analyze_constant`.
+
+    Parameters
+    ----------
+    rng : np.random.RandomState
+
+    x, ans, ask, group : arrays (n_trials,)
+        The value at which each trial is fit, its answer, its comparison
+        contrast, and the value by which proportions are calculated.
+
+    initial : tuple
+        The initial guess for the fits.
+
+    boot : int
+        The number of bootstrap samples.
+
+    fit_func, method, boot_method, warm_start :
+        See `analyze_constant`
+
+    Returns
+    -------
+    fits : array (boot, n_params)
+    info : dict
+        The diagnostics of the fits (see `fit_th`).
+
+    """
+    if boot_method in ('batch', 'counts'):
+        return _boot_batch(x, ans, group, initial, boot, fit_func, rng,
+                           method, stratified=boot_method == 'counts',
+                           warm_start=warm_start, full_output=True)
+
+    fits = []
+    infos = []
+    for b in range(boot):
+        # Choose this boot sample
+        idx = rng.randint(0, len(x), len(x))
+        boot_x = x[idx]
+        boot_ans = ans[idx]
+        boot_ask = ask[idx]
+        boot_y = _group_mean(boot_ans, boot_ask)
+
+        # Start from the same initial value guess as the fit to all the data
+        # (or from that fit, with warm_start):
+        boot_fit, info = fit_th(boot_x, boot_y, initial, fit_func, method,
+                                warm_start=warm_start, full_output=True)
+        fits.append(boot_fit)
+        infos.append(info)
+    return np.array(fits).reshape(boot, len(initial)), _stack_info(infos)
+
+def _boot_job(args):
+    """
+    Run one worker's share of `_parallel_bootstrap`. This needs to be defined
+    at the module level, so that it can be sent to worker processes.
+    """
+    seed_seq, boot_args = args
+    rng = np.random.RandomState(np.random.MT19937(seed_seq))
+    return _bootstrap(rng, *boot_args)
+
+def _parallel_bootstrap(n_jobs, seed_seqs, boot_args):
+    """
+    Divide the samples of `_bootstrap` among n_jobs worker processes, each
+    drawing from the random stream of one of seed_seqs. The fits come back in
+    the order of the workers, so the result only depends on the seeds.
+    """
+    boot = boot_args[5]
+    jobs = []
+    for seed_seq, this_boot in zip(seed_seqs,
+                                   np.array_split(np.arange(boot), n_jobs)):
+        this_args = boot_args[:5] + (len(this_boot),) + boot_args[6:]
+        jobs.append((seed_seq, this_args))
+
+    pool = multiprocessing.Pool(n_jobs)
+    try:
+        results = pool.map(_boot_job, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+    fits = np.concatenate([fits for fits, info in results])
+    info = dict([(k, np.concatenate([info[k] for fits, info in results]))
+                 for k in results[0][1]])
+    return fits, info
+
+def _side_contrast(data_rec, name, other=False):
+    """
+    For each trial, the contrast called `name` (e.g. 'contrast2') on the side
+    that was asked about. If other is True, on the other side.
+    """
+    on_right = data_rec['ask_side'] == 'r'
+    if other:
+        on_right = ~on_right
+    return np.where(on_right, data_rec['r_' + name], data_rec['l_' + name])
+
+
+def _center_contrasts(p):
+    """
+    The base contrasts of the center, from the file header
+    """
+    return [float(t) for t in
+    p['center_contrast'].split('[')[1].split(']')[0].split(' ')[1::2]]
+
+
+def _initial_guess(fit_func, contrast):
+    """
+    Begin by guessing that the mean is the same as the contrast shown (no
+    bias)
+    """
+    if fit_func == 'cumgauss':
+        return contrast, 1
+    elif fit_func == 'cumgauss_w_asym':
+        return contrast, 1, 0, 1
+    elif fit_func == 'weib':
+        return contrast, 3.5, 0, 1
+
+
+def _group_mean(values, group):
+    """
+    For each element of values, the mean of values over all the elements in
+    the same group
+    """
+    g_u, g_inv = np.unique(group, return_inverse=True)
+    g_inv = g_inv.ravel()
+    sums = np.bincount(g_inv, weights=values)
+    return (sums / np.bincount(g_inv))[g_inv]
+
+
+def analyze_constant(data_file=None, fig_name=None, cue_cond='cued',
+                     fit_func='cumgauss', log_scale=False, boot=1000,
+                     leave_one_out=False, verbose=True, even_or_odd=False,
+                     distractor_high=None, distractor_low=None,
+                     analyze_distractor=False, boot_method='loop', seed=None,
+                     fit_method=None, dataset=None, warm_start=False,
+                     n_jobs=1):
+    """
+    This analyzes data from the constant stimuli experiment
+
+    Parameters
+    ----------
+    data_file : str,
+        the full path to a file with some data. If this is not provided, the
+        user will be prompted to navigate to the file with a file-browser. 
+
+    fig_name : str, 
+        The name of the figure to save. If not provided, the figure will not be
+        saved.
+    cue_cond : str,
+        whether to analyze the 'cued' condition or the 'other' condition.
+
+    fit_func : str,
+         What type of function to fit to the data ('cumgauss' or 'weib')
+
+    log_scale : bool,
+        Whether to transform things into a log scale (FWIW).
+
+    boot : int,
+        The number of iterations of fitting in the boot-strap procedure.
+
+    leave_one_out : bool
+        Whether to 
+
+    even_or_odd : bool
+        Whether to take only even or only odd trials in each sample.
+
+    distractor_high, distractor_low : float
+       If this is None (default), it's just ignored. Otherwise, these are the
+       low and high bounds on selecting distractor contrasts
+
+    analyze_distractor : bool
+        When set to True, the curves are of the distractor contrast instead of
+        the target contrast.
+
+    boot_method : str
+        'loop' (default) refits the bootstrap samples one at a time. 'batch'
+        draws all the bootstrap samples at once and fits them together (see
+        `fit_th_batch`). 'counts' does the same, but resamples the
+        trials within each comparison level, drawing binomial counts instead
+        of trials, so that its cost doesn't depend on the number of trials
+        (see `_boot_batch`).
+
+    seed : int
+        Seed for the random number generator used in the bootstrap. If None
+        (default), the global numpy random state is used.
+
+    fit_method : str
+        How to fit the curves (see `fit_th`). Use 'mle' for a maximum
+        likelihood fit to the binomial counts.
+
+    dataset : str or Dataset
+        A data-set compiled with `compile_dataset`. If provided, the trials of
+        data_file are read from the data-set, instead of from the file.
+
+    warm_start : bool
+        Whether to start the fits of the bootstrap samples from the fit to all
+        the data, rather than from the initial guess.
+
+    n_jobs : int
+        The number of worker processes among which the bootstrap samples are
+        divided. Defaults to 1 (no worker processes). Set to -1 to use all the
+        CPUs. Each worker draws from its own stream of random numbers, spawned
+        from seed, so results are reproducible for a given seed and n_jobs
+        (but differ between values of n_jobs).
+
+    Returns
+    -------
+    out : dict
+        x, y and the number of trials at each level, the fits, and the
+        bootstrap confidence intervals of the threshold and the slope. Also,
+        'fit_info' and 'boot_info' hold the diagnostics of the fits to all the
+        data and of the bootstrap fits (see `fit_th`): one dict for each base
+        contrast, with arrays of one value per bootstrap sample in
+        'boot_info'.
+
+    """
+
+    if dataset is None:
+        p,l,data_rec = get_data(data_file, even_or_odd=even_or_odd)
+    else:
+        p,l,data_rec = load_dataset(dataset).get_data(data_file,
+                                                      even_or_odd=even_or_odd)
+
+    if seed is None:
+        rng = np.random
+    else:
+        rng = np.random.RandomState(seed)
+    if n_jobs < 1:
+        n_jobs = multiprocessing.cpu_count()
+    if n_jobs != 1:
+        if seed is None:
+            seed = np.random.randint(0, 2**31 - 1)
+        seed_seq = np.random.SeedSequence(seed)
+
+    if cue_cond == 'cued':
+        cue_cond_idx = np.where(data_rec['cue_side']==data_rec['ask_side'])[0]
+    elif cue_cond == 'other':
+        cue_cond_idx = np.where(data_rec['cue_side']!=data_rec['ask_side'])[0]
+
+    center_contrasts = _center_contrasts(p)
+    
+    cond_rec = data_rec[cue_cond_idx]
+    base_contrast = _side_contrast(cond_rec, 'contrast2')
+
+    if fig_name is not None: 
+        # Get the color cycle from the mpl rc params:
+        rc = matplotlib.rc_params()
+        colors = rc['axes.color_cycle'][:len(center_contrasts)]
+        fig = plt.figure()
+        ax = fig.add_subplot(1,1,1)
+
+    fits = []
+    keep_x = []
+    keep_y = []
+
+    boot_th_ub = []
+    boot_sl_ub = []
+    boot_th_lb = []
+    boot_sl_lb = []
+    fit_info = []
+    boot_info = []
+
+    min_x=1
+    max_x=0
+    for contrast in center_contrasts:
+        c_rec = cond_rec[np.abs(base_contrast - contrast) < 0.01]
+        this_ask = c_rec['ask_contrast']
+        # Move it into the interval [0,1] with the right directionality: when
+        # the value of this_ask was high, the chances were higher for a '1'
+        # answer than for a '2' answer (that's the "1 - " at the beginning of
+        # next line):
+        this_ans = 1 - (c_rec['answer'] - 1) 
+        x = np.array(contrast) + this_ask
+
+        if analyze_distractor:
+            x = (_side_contrast(c_rec, 'contrast1', other=True) -
+                 _side_contrast(c_rec, 'contrast2', other=True))
+        
+        if log_scale:
+            x = np.log10(x)
+        
+        initial = _initial_guess(fit_func, contrast)
+
+        # If we want to select trials by distractor, we'll need to pay
+        # attention to that right about here:
+        if distractor_high is not None:
+            other_contrast = _side_contrast(c_rec, 'contrast1', other=True)
+            distract_idx = np.where(np.logical_and(
+                                    other_contrast > distractor_low,
+                                    other_contrast < distractor_high))
+
+            # We're going to curtail both of these puppies:
+            x = x[distract_idx]
+            this_ans = this_ans[distract_idx]
+            this_ask = this_ask[distract_idx]
+            # Proportions are calculated per value of x (need to take into
+            # account that this is in a new coordinate-system!):
+            group = x
+        else:
+            group = this_ask
+
+        # Generate the y axis:
+        y = _group_mean(this_ans, group)
+
+        if verbose:
+            print("Using the %s function to analyze this"%fit_func)
+
+        if even_or_odd == 'even':
+            fit_x = x[::2]
+            fit_y = y[::2]
+        elif even_or_odd == 'odd':
+            fit_x = x[1::2]
+            fit_y = y[1::2]
         else:
             fit_x = x
             fit_y = y
 
-        this_fit = fit_th(fit_x, fit_y, initial, fit_func)
-        # Store stuff for plotting:
-        fits.append(this_fit)
-        keep_x.append(x)
-        keep_y.append(y)
+        this_fit, this_info = fit_th(fit_x, fit_y, initial, fit_func,
+                                     fit_method, full_output=True)
+        fit_info.append(this_info)
+        if warm_start:
+            boot_initial = this_fit
+        else:
+            boot_initial = initial
+        # Store stuff for plotting:
+        fits.append(this_fit)
+        keep_x.append(x)
+        keep_y.append(y)
+
+        min_x = min([min_x, np.min(x)])
+        max_x = max([max_x, np.max(x)])
+        # Bootstrap estimate the parameters
+        boot_args = (x, this_ans, this_ask, group, boot_initial, boot,
+                     fit_func, fit_method, boot_method, warm_start)
+        if n_jobs == 1:
+            boot_fits, info = _bootstrap(rng, *boot_args)
+        else:
+            # Each worker gets its own stream of random numbers:
+            boot_fits, info = _parallel_bootstrap(n_jobs,
+                                                  seed_seq.spawn(n_jobs),
+                                                  boot_args)
+        boot_info.append(info)
+        boot_th = boot_fits[:, 0]
+        boot_sl = boot_fits[:, 1]
+
+        th_lb, th_ub = order_statistic(boot_th, [0.16, 0.84])
+        sl_lb, sl_ub = order_statistic(boot_sl, [0.16, 0.84])
+        boot_th_ub.append(th_ub)
+        boot_th_lb.append(th_lb)
+        boot_sl_ub.append(sl_ub)
+        boot_sl_lb.append(sl_lb)
+
+    if fig_name is not None:
+        for i,fit in enumerate(fits):
+            for idx, this_x in enumerate(keep_x[i]):
+                n = np.sum(keep_x[i]==this_x) # How many trials, sets the
+                                               # markersize
+                ax.plot(this_x,keep_y[i][idx],
+                        'o',color = colors[i], markersize = n)
+                
+                x_for_plot = np.linspace(min_x-0.05,
+                                         max_x+0.05,100)
+
+            if fit_func == 'cumgauss':
+                plotter = cumgauss
+            elif fit_func == 'cumgauss_w_asym':
+                plotter = cumgauss
+            elif fit_func == 'weib':
+                plotter = weibull
+            ax.plot(x_for_plot,plotter(x_for_plot,*fits[i]),
+                    color = colors[i])
+            texter = (
+                'PSE: %1.2f +/- %1.2f \nslope: %1.2f +/- %1.2f'%(fits[i][0],
+                                            (boot_th_ub[i]-boot_th_lb[i])/2,
+                                                      fits[i][1],
+                                            (boot_sl_ub[i]-boot_sl_lb[i])/2))
+            print("For the file: %s \n %s \n"%(data_file, cue_cond) + texter)
+
+            # Indicate the values of the fit:
+            ax.text(fits[i][0] + 0.1, fits[i][0] + 0.1,texter)
+
+        fig.savefig(fig_name)
+
+    out = dict(x=[], y=[], trials=[],
+               fit=[],
+               boot_th_lb=boot_th_lb, boot_th_ub=boot_th_ub,
+               boot_sl_lb=boot_sl_lb, boot_sl_ub=boot_sl_ub,
+               fit_info=fit_info, boot_info=boot_info)
+
+    # Make the return values:
+    for i, fit in enumerate(fits):
+        out['fit'].append(fit)
+        x_u, x_first, x_n = np.unique(keep_x[i], return_index=True,
+                                      return_counts=True)
+        out['x'].extend(keep_x[i][x_first])
+        out['y'].extend(keep_y[i][x_first])
+        out['trials'].extend(x_n)
+    return out
+
+def _analyze_job(kwargs):
+    """
+    Run analyze_constant for one job of get_df. This needs to be defined at
+    the module level, so that it can be sent to worker processes.
+    """
+    return analyze_constant(**kwargs)
+
+# Bump this whenever the output of analyze_constant changes, so that stale
+# results in an AnalysisStore are ignored:
+_analysis_store_version = 1
+
+
+class AnalysisStore(object):
+    """
+    A directory of `analyze_constant` results, one file per analysis, keyed
+    by the content of the data file and by the analysis parameters (fit_func,
+    boot, even_or_odd, distractor bounds, seed, ...). A new or changed data
+    file, or different parameters, get a new key, so `get_df` only reruns
+    those analyses and takes everything else from the store.
+
+    """
+    def __init__(self, store_dir):
+        """
+        Parameters
+        ----------
+        store_dir : str
+            The directory in which the results are kept. Created if it
+            doesn't exist.
+
+        """
+        self.path = os.path.abspath(store_dir)
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    def key(self, kwargs):
+        """
+        The key of an analysis, from the keyword arguments of
+        `analyze_constant` (as made by `get_df`). verbose is ignored, and the
+        data file (or data-set) is represented by the hash of its content.
+        """
+        h = hashlib.sha1()
+        if kwargs.get('dataset') is not None:
+            p,l,data_rec = load_dataset(kwargs['dataset']).get_data(
+                                                        kwargs['data_file'])
+            h.update(repr(sorted(p.items())).encode('utf-8'))
+            h.update(np.ascontiguousarray(data_rec).tobytes())
+        else:
+            with open(kwargs['data_file'], 'rb') as f:
+                h.update(f.read())
+        params = [(k, v) for k, v in sorted(kwargs.items())
+                  if k not in ['data_file', 'dataset', 'verbose']]
+        h.update(repr((params, _analysis_store_version)).encode('utf-8'))
+        return h.hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, key + '.pkl')
+
+    def get(self, key):
+        """
+        The stored result for key, or None if there isn't one
+        """
+        try:
+            with open(self._file(key), 'rb') as f:
+                return pickle.load(f)
+        except Exception:
+            return None
+
+    def put(self, key, result):
+        """
+        Store the result for key
+        """
+        # Write to a temporary file first, so that other processes never read
+        # a partial result:
+        tmp_file = '%s.%d.tmp'%(self._file(key), os.getpid())
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(result, f, pickle.HIGHEST_PROTOCOL)
+        getattr(os, 'replace', os.rename)(tmp_file, self._file(key))
+
+    def clear(self):
+        """
+        Remove all the stored results
+        """
+        for f in os.listdir(self.path):
+            if f.endswith('.pkl') or f.endswith('.tmp'):
+                os.remove(os.path.join(self.path, f))
+
+
+def _job_seed(seed, data_file, cue):
+    """
+    A seed for one analysis of get_df, which depends only on the seed of the
+    whole analysis, the name of the file and the cue condition
+    """
+    key = '%s|%s|%s'%(seed, os.path.basename(data_file), cue)
+    return int(hashlib.sha1(key.encode('utf-8')).hexdigest()[:8], 16) % (
+                                                                  2**31 - 1)
+
+def get_df(n_subjects,
+	   path_to_files='/Users/arokem/Dropbox/att_ss/Analysis/',
+	   file4R='/Users/arokem/Dropbox/att_ss/file4R.csv',
+	   fit_func='cumgauss',
+	   boots=1,
+	   exclude=None,
+	   verbose=True,
+	   cue_conds=['cued', 'other', 'neutral'],
+           even_or_odd=False,
+           distractor_high=None,
+           distractor_low=None,
+           analyze_distractor=False,
+           n_jobs=1,
+           seed=None,
+           fit_method=None,
+           dataset=None,
+           as_results=False,
+           store=None):
+
+    """
+
+    Make pandas data-frames from a whole data-set.
+
+    df contains all of the data (including performance on individual contrast
+    levels and so forth), but is very complicated.
+
+    df2 contains a summary of the data, but is very simple 
+
+    Parameters
+    ----------
+    n_jobs : int
+        The number of worker processes among which the (file, cue condition)
+        analyses are divided. Defaults to 1 (no worker processes). Set to -1
+        to use all the CPUs.
+
+    seed : int
+        Seed for the bootstrap. Each (file, cue condition) gets its own seed,
+        drawn from this one, so results are the same for any n_jobs.
+
+    fit_method : str
+        How to fit the curves (see `fit_th`).
+
+    dataset : str or Dataset
+        A data-set compiled with `compile_dataset`. If provided, the sessions
+        are taken from the data-set, instead of from path_to_files.
+
+    as_results : bool
+        Return df as a `GroupResults`, instead of a data-frame of dicts.
+
+    store : str or AnalysisStore
+        Keep the results of each (file, cue condition) analysis in this
+        store, and only analyze the files that are new or changed since the
+        last call with the same parameters (see `AnalysisStore`). Each
+        analysis then gets a seed derived from the seed (also when it is
+        None), the file name and the cue condition, so that it doesn't change
+        between calls, for any n_jobs, or as files are added.
+    
+    """
+    n_params_dict = dict(cumgauss=2,
+                         cumgauss_w_asym=4,
+                         weib=4)
+    
+    n_params = n_params_dict[fit_func]
+    if dataset is None:
+        dirlist = sorted(os.listdir(path_to_files))
+        dataset_path = None
+    else:
+        dataset = load_dataset(dataset)
+        dirlist = list(dataset.sessions.file_name)
+        # Workers load the data-set from its path:
+        dataset_path = dataset.path
+
+    sub_id = ['S%02d'%(i+1) for i in range(n_subjects)]
+
+    if exclude is not None:
+        # Make sure to exclude from the largest to smallest:
+        exclude = np.sort(exclude)[::-1]
+        for ex in exclude:
+            sub_id = sub_id[:ex-1] + sub_id[ex:]
+
+    if verbose:
+            print(sub_id)
+
+
+    df = {}
+    df2 = {'subject':[],
+           'abs_ori':[],
+           'rel_ori':[],
+           'cue':[]}
+
+    for para in range(n_params):
+            df2.update({'p%i'%(para+1):[]})
+    
+    surr_k = 'surr_ori'
+    center_k = 'center_ori'
+
+    # Collect all the (file, cue condition) jobs first. They are independent
+    # of each other, so they can be farmed out to worker processes:
+    jobs = []
+    for this_sub in sub_id:
+        if verbose:
+                print("Analyzing %s"%this_sub)
+        df[this_sub] = {(0,0):{}, (0,90):{}, (90,0):{}, (90,90):{}}
+        for this_file in dirlist:
+            # Only look at files from this subject:
+            if this_file.startswith(this_sub):
+                if verbose:
+                        print("File: %s"%this_file)
+                if dataset is None:
+                    p,l,d = get_data(path_to_files + this_file)
+                else:
+                    p = dataset.header(this_file)
+                # The key differs, depending on the 
+                cue_reliability = _header_value(p, 'cue_reliability')
+                if isinstance(cue_reliability, float):
+                    conds = [(cue, cue) for cue in cue_conds[:2]]
+                else:
+                    # The neutral condition takes "other" as input:
+                    conds = [('neutral', 'other')]
+
+                for cue, cue_cond in conds:
+                    if verbose:
+                            print("Condition: %s"%cue)
+                    jobs.append((this_sub, p, cue,
+                                 dict(data_file=path_to_files + this_file,
+                                      cue_cond=cue_cond,
+                                      log_scale=False,
+                                      fit_func=fit_func,
+                                      boot=boots,
+                                      verbose=verbose,
+                                      even_or_odd=even_or_odd,
+                                      distractor_high=distractor_high,
+                                      distractor_low=distractor_low,
+                                      analyze_distractor=analyze_distractor,
+                                      fit_method=fit_method,
+                                      dataset=dataset_path)))
+
+    if store is not None and not isinstance(store, AnalysisStore):
+        store = AnalysisStore(store)
+
+    # Each job gets its own seed, so that the bootstrap doesn't depend on the
+    # number of workers:
+    if store is not None:
+        # Adding files to the data-set shouldn't change the seeds of the
+        # others, or nothing would be reused. Without a seed, the seeds are
+        # still derived (from None), since a seed drawn at random would give
+        # every analysis a new key:
+        job_seeds = [_job_seed(seed, job[-1]['data_file'], job[2])
+                     for job in jobs]
+    elif seed is not None:
+        job_seeds = np.random.RandomState(seed).randint(0, 2**31 - 1,
+                                                        len(jobs))
+    elif n_jobs != 1:
+        # Otherwise, forked workers would all start from the same state:
+        job_seeds = np.random.randint(0, 2**31 - 1, len(jobs))
+    else:
+        job_seeds = [None] * len(jobs)
+
+    job_kwargs = []
+    for job, job_seed in zip(jobs, job_seeds):
+        job[-1]['seed'] = job_seed
+        job_kwargs.append(job[-1])
+
+    # Only run the analyses that aren't in the store already:
+    if store is not None:
+        store_keys = [store.key(kwargs) for kwargs in job_kwargs]
+        results = [store.get(key) for key in store_keys]
+    else:
+        results = [None] * len(job_kwargs)
+    todo = [i for i, this in enumerate(results) if this is None]
+    if verbose and store is not None:
+        print("Reusing %d of %d analyses"%(len(results) - len(todo),
+                                           len(results)))
+
+    todo_kwargs = [job_kwargs[i] for i in todo]
+    if n_jobs != 1 and len(todo):
+        if n_jobs < 1:
+            n_jobs = multiprocessing.cpu_count()
+        pool = multiprocessing.Pool(n_jobs)
+        try:
+            new_results = pool.map(_analyze_job, todo_kwargs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        new_results = [_analyze_job(kwargs) for kwargs in todo_kwargs]
+
+    for i, this in zip(todo, new_results):
+        if store is not None:
+            store.put(store_keys[i], this)
+        results[i] = this
+
+    # Put it all together, in the order in which the jobs were made:
+    for (this_sub, p, cue, kwargs), this in zip(jobs, results):
+        if cue != 'neutral':
+            for ii in range(len(this['fit'][0])):
+                if this['fit'][0][ii] > 1.0:
+                    this['fit'][0][ii] = 1.0
+
+        center_ori = _header_value(p, center_k)
+        surr_ori = _header_value(p, surr_k)
+        df[this_sub][center_ori,surr_ori][cue]=this
+        df2['subject'].append(this_sub)
+        # These should be treated as categorical in the ANOVA:
+        df2['abs_ori'].append(str(center_ori))
+        df2['rel_ori'].append(str(np.abs(center_ori - surr_ori)))
+        df2['cue'].append(cue)
+
+        for idx, para in enumerate(this['fit'][0]):
+            df2['p%i'%(idx+1)].append(para)
+
+    if as_results:
+        return (GroupResults(pd.DataFrame(df), cue_conds=cue_conds),
+                pd.DataFrame(df2))
+    return pd.DataFrame(df), pd.DataFrame(df2)
+
+class GroupResults(object):
+    """
+    The results of `get_df` as dense arrays, indexed by (subject, center_ori,
+    surr_ori, cue), instead of a data-frame of nested dicts. Cells with no
+    data are nan, as are the levels beyond the number of contrast levels in
+    each cell.
+
+    Group statistics are reductions over the first axis, e.g. the mean
+    threshold in each condition:
+
+    >>> res = GroupResults(df)
+    >>> np.nanmean(res.params[..., 0], 0)
+
+    Attributes
+    ----------
+    subjects : list
+    oris : list
+        The labels of both the center_ori and the surr_ori axes.
+    cue_conds : list
+    x, y, trials : arrays (subject, center_ori, surr_ori, cue, level)
+    params : array (subject, center_ori, surr_ori, cue, param)
+        The parameters of the fit.
+    th_lb, th_ub, sl_lb, sl_ub : arrays (subject, center_ori, surr_ori, cue)
+        The bootstrap confidence intervals of the threshold and slope.
+
+    Notes
+    -----
+    The fit and confidence intervals are those of the first base contrast
+    in each cell (see `analyze_constant`).
+
+    """
+    axes = ['subject', 'center_ori', 'surr_ori', 'cue']
+    ci_names = ['th_lb', 'th_ub', 'sl_lb', 'sl_ub']
+
+    def __init__(self, df, oris=[0,90],
+                 cue_conds=['cued', 'other', 'neutral']):
+        """
+        Parameters
+        ----------
+        df : DataFrame
+            The first output of `get_df`.
+
+        """
+        self.subjects = list(df.keys())
+        self.oris = list(oris)
+        self.cue_conds = list(cue_conds)
+        cells = []
+        for sub in self.subjects:
+            for center_ori in self.oris:
+                for surr_ori in self.oris:
+                    for cue in self.cue_conds:
+                        cells.append(df[sub][center_ori, surr_ori].get(cue))
+
+        shape = (len(self.subjects), len(self.oris), len(self.oris),
+                 len(self.cue_conds))
+        have = [c for c in cells if c is not None]
+        n_levels = max([len(c['x']) for c in have] + [0])
+        n_params = max([len(c['fit'][0]) for c in have] + [0])
+        for name, size in [('x', n_levels), ('y', n_levels),
+                           ('trials', n_levels), ('params', n_params)]:
+            setattr(self, name, np.empty((len(cells), size)) * np.nan)
+        for name in self.ci_names:
+            setattr(self, name, np.empty(len(cells)) * np.nan)
+
+        for i, c in enumerate(cells):
+            if c is None:
+                continue
+            for name in ['x', 'y', 'trials']:
+                getattr(self, name)[i, :len(c[name])] = c[name]
+            self.params[i, :len(c['fit'][0])] = c['fit'][0]
+            for name in self.ci_names:
+                getattr(self, name)[i] = c['boot_' + name][0]
+
+        for name in ['x', 'y', 'trials', 'params']:
+            this = getattr(self, name)
+            setattr(self, name, this.reshape(shape + this.shape[-1:]))
+        for name in self.ci_names:
+            setattr(self, name, getattr(self, name).reshape(shape))
+
+    def _labels(self, axis):
+        """
+        The labels along one of the axes
+        """
+        return dict(subject=self.subjects, center_ori=self.oris,
+                    surr_ori=self.oris, cue=self.cue_conds)[axis]
+
+    def sel(self, name, **labels):
+        """
+        One of the arrays, at the given labels of some of the axes
+
+        Parameters
+        ----------
+        name : str
+            The name of the array, e.g. 'params' or 'th_ub'.
+        labels :
+            The label to select for any of the axes, e.g. subject='S01',
+            cue='cued'.
+
+        Returns
+        -------
+        array with the remaining axes
+
+        Examples
+        --------
+        >>> res.sel('params', center_ori=0, surr_ori=0, cue='cued')[:, 0]
+
+        """
+        idx = []
+        for axis in self.axes:
+            if axis in labels:
+                idx.append(self._labels(axis).index(labels.pop(axis)))
+            else:
+                idx.append(slice(None))
+        if len(labels):
+            raise ValueError("Unknown axes: %s"%', '.join(labels.keys()))
+        return getattr(self, name)[tuple(idx)]
+
+    def to_long(self, levels=False):
+        """
+        A tidy (long-form) data-frame of the results
+
+        Parameters
+        ----------
+        levels : bool
+            Whether to make one row per contrast level, with the x, y and
+            trials, rather than one row per cell, with the parameters of the
+            fit ('p1', 'p2', ...) and the confidence intervals.
+
+        Returns
+        -------
+        DataFrame
+            With the columns 'subject', 'center_ori', 'surr_ori', 'abs_ori',
+            'rel_ori', 'cue' and the data. Empty cells (and levels) are
+            dropped.
+
+        """
+        if levels:
+            names = ['x', 'y', 'trials']
+            shape = self.x.shape
+        else:
+            names = self.ci_names
+            shape = self.th_lb.shape
+        idx = np.indices(shape).reshape(len(shape), -1)
+        out = {}
+        for axis, this_idx in zip(self.axes, idx):
+            out[axis] = np.array(self._labels(axis))[this_idx]
+        out['abs_ori'] = out['center_ori']
+        out['rel_ori'] = np.abs(out['center_ori'] - out['surr_ori'])
+        for name in names:
+            out[name] = getattr(self, name).ravel()
+        if levels:
+            keep = ~np.isnan(out['x'])
+        else:
+            for i in range(self.params.shape[-1]):
+                out['p%i'%(i+1)] = self.params[..., i].ravel()
+            keep = ~np.isnan(self.params[..., 0].ravel())
+        columns = (self.axes + ['abs_ori', 'rel_ori'] +
+                   sorted([k for k in out if k.startswith('p')]) + names)
+        return pd.DataFrame(dict([(k, out[k][keep]) for k in columns]),
+                            columns=columns)
+
+class SufficientStats(object):
+    """
+    The number of trials and the number of '1' answers for every subject,
+    condition and comparison level. Everything that the analysis does with the
+    trials of a session (fitting psychometric curves and bootstrapping the
+    fits) can be done from these counts alone.
+
+    The counts are held in two dense arrays, n_trials and n_ones, with the
+    dimensions:
+
+        (subject, center_ori, surr_ori, cue, base_contrast, level,
+         distractor_bin)
+
+    The values along each dimension are in the attributes subjects,
+    center_oris, surr_oris, cues, base_contrasts, levels (the comparison
+    contrasts, relative to the base contrast) and distractor_bins. Sessions of
+    the same subject in the same condition are pooled, unless pool_sessions
+    is False.
+
+    """
+    cues = ['cued', 'other', 'neutral']
+
+    def __init__(self, path_to_files=None, dataset=None, subjects=None,
+                 distractor_bins=None, pool_sessions=True):
+        """
+        Count the trials in a directory of data files.
+
+        Parameters
+        ----------
+        path_to_files : str
+            The directory holding the data files.
+
+        dataset : str or Dataset
+            A data-set compiled with `compile_dataset`, read instead of the
+            files in path_to_files.
+
+        subjects : list of str
+            The subjects to include (e.g. ['S01', 'S02']). Defaults to all.
+
+        distractor_bins : list of (low, high) pairs
+            Count the trials separately for each range of the distractor
+            contrast (the contrast on the side that was not asked about), in
+            the open interval (low, high), as in `analyze_constant`. Defaults
+            to one bin with all the trials.
+
+        pool_sessions : bool
+            Whether to add up the trials of all the sessions of a subject in
+            the same condition (the default). If False, only the last of
+            these sessions (in the order of the file names) is counted, as in
+            the results of `get_df`, which analyzes each session separately
+            and keeps the last one.
+
+        """
+        self.pool_sessions = pool_sessions
+        sessions = []
+        if dataset is None:
+            for this_file in sorted(os.listdir(path_to_files)):
+                if this_file.startswith('S') and this_file.endswith('.csv'):
+                    p,l,d = get_data(os.path.join(path_to_files, this_file))
+                    sessions.append((this_file[:3], p, d))
+        else:
+            dataset = load_dataset(dataset)
+            for this_file in dataset.sessions.file_name:
+                p,l,d = dataset.get_data(this_file)
+                sessions.append((this_file[:3], p, d))
+        # Files without any trials don't count:
+        sessions = [(sub, p, d) for sub, p, d in sessions if len(d) and
+                    (subjects is None or sub in subjects)]
+
+        self.subjects = sorted(set([sub for sub, p, d in sessions]))
+        self.center_oris = np.unique([_header_value(p, 'center_ori')
+                                      for sub, p, d in sessions])
+        self.surr_oris = np.unique([_header_value(p, 'surr_ori')
+                                    for sub, p, d in sessions])
+        self.base_contrasts = np.unique(np.hstack([_center_contrasts(p)
+                                                   for sub, p, d in sessions]))
+        self.levels = np.unique(np.hstack([d['ask_contrast']
+                                           for sub, p, d in sessions]))
+        if distractor_bins is None:
+            self.distractor_bins = [(-np.inf, np.inf)]
+        else:
+            self.distractor_bins = list(distractor_bins)
+
+        shape = (len(self.subjects), len(self.center_oris),
+                 len(self.surr_oris), len(self.cues),
+                 len(self.base_contrasts), len(self.levels),
+                 len(self.distractor_bins))
+        self.n_trials = np.zeros(shape, dtype=int)
+        self.n_ones = np.zeros(shape, dtype=int)
+        for sub, p, d in sessions:
+            self._add_session(sub, p, d)
+
+    def _add_session(self, subject, p, data_rec):
+        """
+        Add the trials of one session to the counts
+        """
+        cued = data_rec['cue_side'] == data_rec['ask_side']
+        if isinstance(_header_value(p, 'cue_reliability'), float):
+            keep = np.ones(cued.shape, dtype=bool)
+            cue = np.where(cued, 0, 1)
+        else:
+            # As in get_df, neutral sessions are analyzed as 'other':
+            keep = ~cued
+            cue = np.zeros(cued.shape, dtype=int) + 2
+
+        # Same criterion as in analyze_constant:
+        base_diff = np.abs(_side_contrast(data_rec, 'contrast2')[:, np.newaxis]
+                           - self.base_contrasts)
+        base = np.argmin(base_diff, -1)
+        keep &= np.min(base_diff, -1) < 0.01
+        level = np.searchsorted(self.levels, data_rec['ask_contrast'])
+        distractor = _side_contrast(data_rec, 'contrast1', other=True)
+        ans = 1 - (data_rec['answer'] - 1)
+
+        ii = np.zeros((len(self.n_trials.shape), cued.shape[0]), dtype=int)
+        ii[0] = self.subjects.index(subject)
+        ii[1] = np.searchsorted(self.center_oris,
+                                _header_value(p, 'center_ori'))
+        ii[2] = np.searchsorted(self.surr_oris, _header_value(p, 'surr_ori'))
+        ii[3] = cue
+        ii[4] = base
+        ii[5] = level
+        if not self.pool_sessions:
+            # Replace the counts of an earlier session in this condition:
+            for this_cue in np.unique(cue):
+                self.n_trials[tuple(ii[:3, 0]) + (this_cue,)] = 0
+                self.n_ones[tuple(ii[:3, 0]) + (this_cue,)] = 0
+        n_trials = self.n_trials.reshape(-1)
+        n_ones = self.n_ones.reshape(-1)
+        low, high = np.array(self.distractor_bins, dtype=float).T
+        if np.all(low[1:] >= high[:-1]):
+            # Sorted bins that don't overlap: each trial falls in at most one
+            # of them, so all the bins are counted in one pass:
+            k = np.digitize(distractor, low) - 1
+            in_bin = k >= 0
+            in_bin[in_bin] = ((distractor[in_bin] > low[k[in_bin]]) &
+                              (distractor[in_bin] < high[k[in_bin]]))
+            passes = [(k, keep & in_bin)]
+        else:
+            passes = [(k, keep & (distractor > low[k]) & (distractor < high[k]))
+                      for k in range(len(low))]
+        for k, in_bin in passes:
+            ii[6] = k
+            flat = np.ravel_multi_index(ii[:, in_bin], self.n_trials.shape)
+            n_trials += np.bincount(flat, minlength=n_trials.shape[0])
+            n_ones += np.bincount(flat, weights=ans[in_bin],
+                                  minlength=n_ones.shape[0]).astype(int)
+
+    @property
+    def x(self):
+        """
+        The contrast of each comparison level, for each base contrast
+        (n_base_contrasts, n_levels)
+        """
+        return self.base_contrasts[:, np.newaxis] + self.levels
+
+    @property
+    def y(self):
+        """
+        The proportion of '1' answers (nan where there were no trials)
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.n_ones / self.n_trials.astype(float)
+
+    def get(self, subject, center_ori, surr_ori, cue, base_contrast=None,
+            distractor_bin=None):
+        """
+        The counts in one condition, for the levels with any trials
+
+        Parameters
+        ----------
+        subject : str
+
+        center_ori, surr_ori : float
+
+        cue : str
+            'cued', 'other' or 'neutral'
+
+        base_contrast : float
+            Defaults to the first (usually, the only) base contrast.
+
+        distractor_bin : int
+            Index into distractor_bins. Defaults to all the bins together.
+
+        Returns
+        -------
+        x, n_ones, n_trials : arrays
+
+        """
+        b = 0
+        if base_contrast is not None:
+            b = np.argmin(np.abs(self.base_contrasts - base_contrast))
+        idx = (self.subjects.index(subject),
+               np.searchsorted(self.center_oris, center_ori),
+               np.searchsorted(self.surr_oris, surr_ori),
+               self.cues.index(cue), b)
+        if distractor_bin is None:
+            n_trials = self.n_trials[idx].sum(-1)
+            n_ones = self.n_ones[idx].sum(-1)
+        else:
+            n_trials = self.n_trials[idx][:, distractor_bin]
+            n_ones = self.n_ones[idx][:, distractor_bin]
+        keep = n_trials > 0
+        return self.x[b][keep], n_ones[keep], n_trials[keep]
+
+    def _cells(self):
+        """
+        The counts of every (subject, center_ori, surr_ori, cue,
+        base_contrast, distractor_bin) cell, with the levels last
+        """
+        return (np.rollaxis(self.n_ones, 5, 7),
+                np.rollaxis(self.n_trials, 5, 7))
 
-        min_x = min([min_x, np.min(x)])
-        max_x = max([max_x, np.max(x)])
-        boot_th = []
-        boot_sl = []
-        # Bootstrap estimate the parameters
-        for b in range(boot):
-            # Choose this boot sample
-            idx = np.random.randint(0, len(x), len(x))
-            boot_x = x[idx]
-            boot_ans = this_ans[idx]
-            boot_ask = this_ask[idx]
-            boot_y = []
-            for i in range(len(boot_ans)):
-                boot_y.append(np.mean(boot_ans[boot_ask==boot_ask[i]]))
-
-            # Use the same initial value guess as above:
-            boot_fit = fit_th(boot_x, boot_y, initial, fit_func)
-            boot_th.append(boot_fit[0])
-            boot_sl.append(boot_fit[1])
-            
-        sort_th = np.sort(boot_th)
-        sort_sl = np.sort(boot_sl)
+    def fit(self, fit_func='cumgauss', method=None, batch=False):
+        """
+        Fit a psychometric function in every cell with any trials (see
+        `fit_counts`).
 
-        boot_th_ub.append(sort_th[0.84*boot])
-        boot_th_lb.append(sort_th[0.16*boot])
-        boot_sl_ub.append(sort_sl[0.84*boot])
-        boot_sl_lb.append(sort_sl[0.16*boot])
+        Parameters
+        ----------
+        fit_func, method : str
+            See `fit_th`.
 
-    if fig_name is not None:
-        for i,fit in enumerate(fits):
-            for idx, this_x in enumerate(keep_x[i]):
-                n = np.sum(keep_x[i]==this_x) # How many trials, sets the
-                                               # markersize
-                ax.plot(this_x,keep_y[i][idx],
-                        'o',color = colors[i], markersize = n)
-                
-                x_for_plot = np.linspace(min_x-0.05,
-                                         max_x+0.05,100)
+        batch : bool
+            Fit all the cells together, with `fit_th_batch` (only with the
+            'lm' method, the default for cumgauss). This minimizes the same
+            sum of squares as fitting each cell, so the fits agree to within
+            the tolerance of the fit.
+
+        Returns
+        -------
+        fits : array (n_subjects, n_center_oris, n_surr_oris, n_cues,
+                      n_base_contrasts, n_distractor_bins, n_params)
+            nan in cells without trials.
 
+        """
+        n_ones, n_trials = self._cells()
+        cells = [idx for idx in np.ndindex(*n_trials.shape[:-1])
+                 if n_trials[idx].any()]
+        initial = [_initial_guess(fit_func, self.base_contrasts[idx[4]])
+                   for idx in cells]
+        if batch and _uses_lm(fit_func, method):
+            x = self.x[[idx[4] for idx in cells]]
+            w = np.array([n_trials[idx] for idx in cells], dtype=float)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                y = np.array([n_ones[idx] for idx in cells]) / w
+            y[w == 0] = 0
             if fit_func == 'cumgauss':
-                plotter = cumgauss
-            elif fit_func == 'cumgauss_w_asym':
-                plotter = cumgauss
-            elif fit_func == 'weib':
-                plotter = weibull
-            ax.plot(x_for_plot,plotter(x_for_plot,*fits[i]),
-                    color = colors[i])
-            texter = (
-                'PSE: %1.2f +/- %1.2f \nslope: %1.2f +/- %1.2f'%(fits[i][0],
-                                            (boot_th_ub[i]-boot_th_lb[i])/2,
-                                                      fits[i][1],
-                                            (boot_sl_ub[i]-boot_sl_lb[i])/2))
-            print("For the file: %s \n %s \n"%(data_file, cue_cond) + texter)
+                initial = _probit_initial(x, y, w, initial)
+            cell_fits = fit_th_batch(x, y, w, initial, fit_func)
+        else:
+            cell_fits = [fit_counts(self.x[idx[4]], n_ones[idx],
+                                    n_trials[idx], initial[c], fit_func,
+                                    method)
+                         for c, idx in enumerate(cells)]
+
+        fits = None
+        for idx, this_fit in zip(cells, cell_fits):
+            if fits is None:
+                fits = np.nan * np.ones(n_trials.shape[:-1] +
+                                        (len(this_fit),))
+            fits[idx] = this_fit
+        return fits
+
+    def bootstrap(self, boot=1000, fit_func='cumgauss', method=None,
+                  seed=None, stratified=False):
+        """
+        Bootstrap the fits in every cell, by resampling the counts.
 
-            # Indicate the values of the fit:
-            ax.text(fits[i][0] + 0.1, fits[i][0] + 0.1,texter)
+        Resampling the trials of a cell with replacement is the same as
+        drawing from a multinomial distribution over the (level, answer)
+        pairs, with the observed proportions, so the trials themselves are
+        not needed. With the 'lm' method (the default for cumgauss), all the
+        resamples of all the cells are fit together, with `fit_th_batch`.
 
-        fig.savefig(fig_name)
+        Parameters
+        ----------
+        boot : int
+            The number of bootstrap samples in each cell.
 
-    out = dict(x=[], y=[], trials=[],
-               fit=[],
-               boot_th_lb=boot_th_lb, boot_th_ub=boot_th_ub,
-               boot_sl_lb=boot_sl_lb, boot_sl_ub=boot_sl_ub)
+        fit_func, method : str
+            See `fit_th`.
 
-    # Make the return values:
-    for i, fit in enumerate(fits):
-        out['fit'].append(fit)
-        for idx, this_x in enumerate(np.unique(keep_x[i])):
-            x_idx = np.where(keep_x[i]==this_x)[0]
-            out['x'].append(x[x_idx[0]])
-            out['y'].append(y[x_idx[0]])
-            out['trials'].append(np.sum(keep_x[i]==this_x))
-    return out
+        seed : int
+            Seed for the random number generator. If None (default), the
+            global numpy random state is used.
 
-def get_df(n_subjects,
-	   path_to_files='/Users/arokem/Dropbox/att_ss/Analysis/',
-	   file4R='/Users/arokem/Dropbox/att_ss/file4R.csv',
-	   fit_func='cumgauss',
-	   boots=1,
-	   exclude=None,
-	   verbose=True,
-	   cue_conds=['cued', 'other', 'neutral'],
-           even_or_odd=False,
-           distractor_high=None,
-           distractor_low=None,
-           analyze_distractor=False):
+        stratified : bool
+            Whether to resample within each level, keeping the number of
+            trials at each level fixed. The number of '1' answers at each
+            level is then binomial.
 
-    """
+        Returns
+        -------
+        fits : array (n_subjects, n_center_oris, n_surr_oris, n_cues,
+                      n_base_contrasts, n_distractor_bins, boot, n_params)
+            nan in cells without trials.
 
-    Make pandas data-frames from a whole data-set.
+        """
+        if seed is None:
+            rng = np.random
+        else:
+            rng = np.random.RandomState(seed)
+
+        n_ones, n_trials = self._cells()
+        cells = [idx for idx in np.ndindex(*n_trials.shape[:-1])
+                 if n_trials[idx].any()]
+        n_levels = n_trials.shape[-1]
+        boot_ones = np.zeros((len(cells), boot, n_levels), dtype=int)
+        boot_trials = np.zeros((len(cells), boot, n_levels), dtype=int)
+        for c, idx in enumerate(cells):
+            if stratified:
+                boot_trials[c] = n_trials[idx]
+                p = n_ones[idx] / np.maximum(n_trials[idx], 1).astype(float)
+                boot_ones[c] = rng.binomial(boot_trials[c], p)
+                continue
+            n = n_trials[idx].sum()
+            pvals = np.hstack([n_ones[idx],
+                               n_trials[idx] - n_ones[idx]]) / float(n)
+            draws = rng.multinomial(n, pvals, size=boot)
+            boot_ones[c] = draws[:, :n_levels]
+            boot_trials[c] = draws[:, :n_levels] + draws[:, n_levels:]
+
+        x = self.x[[idx[4] for idx in cells]]
+        initial = [_initial_guess(fit_func, self.base_contrasts[idx[4]])
+                   for idx in cells]
+        if _uses_lm(fit_func, method):
+            x = np.repeat(x, boot, 0)
+            w = boot_trials.reshape(-1, n_levels)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                y = boot_ones.reshape(-1, n_levels) / w
+            y[w == 0] = 0
+            initial = np.repeat(initial, boot, 0)
+            if fit_func == 'cumgauss':
+                initial = _probit_initial(x, y, w, initial)
+            cell_fits = fit_th_batch(x, y, w, initial, fit_func)
+            cell_fits = cell_fits.reshape(len(cells), boot, -1)
+        else:
+            cell_fits = np.array([[fit_counts(x[c], boot_ones[c, b],
+                                              boot_trials[c, b], initial[c],
+                                              fit_func, method)
+                                   for b in range(boot)]
+                                  for c in range(len(cells))])
+
+        fits = np.nan * np.ones(n_trials.shape[:-1] +
+                                (boot, cell_fits.shape[-1]))
+        for c, idx in enumerate(cells):
+            fits[idx] = cell_fits[c]
+        return fits
+
+
+def fit_distractor_bins(distractor_bins, path_to_files=None, dataset=None,
+                        subjects=None, fit_func='cumgauss', method=None,
+                        batch=False, pool_sessions=True):
+    """
+    Fit the psychometric curves of every subject and condition, separately
+    for each range of distractor contrasts, in one pass over the data.
 
-    df contains all of the data (including performance on individual contrast
-    levels and so forth), but is very complicated.
+    This does what calling `get_df` once for each bin (with distractor_low
+    and distractor_high) does, but every session is read only once, its
+    trials are assigned to the bins together (see `SufficientStats`) and all
+    the curves are fit together.
 
-    df2 contains a summary of the data, but is very simple 
-    
-    """
-    n_params_dict = dict(cumgauss=2,
-                         cumgauss_w_asym=4,
-                         weib=4)
-    
-    n_params = n_params_dict[fit_func]
-    dirlist = os.listdir(path_to_files)
+    Note that by default, where a subject has several sessions in the same
+    condition, their trials are pooled into one fit, so the fits differ from
+    those of `get_df`, which fits each session separately (and keeps the
+    last one). Set pool_sessions=False to get the same fits as `get_df`.
 
-    sub_id = ['S%02d'%(i+1) for i in range(n_subjects)]
+    Parameters
+    ----------
+    distractor_bins : list of (low, high) pairs
+        The distractor contrasts of each bin, in the open interval (low,
+        high). For example: [(0, 0.19), (0.19, 0.31), (0.31, 0.54),
+        (0.54, 0.64), (0.64, 1.0)].
 
-    if exclude is not None:
-        # Make sure to exclude from the largest to smallest:
-        exclude = np.sort(exclude)[::-1]
-        for ex in exclude:
-            sub_id = sub_id[:ex-1] + sub_id[ex:]
+    path_to_files, dataset, subjects :
+        Where to read the data from, and which subjects to include (see
+        `SufficientStats`).
 
-    if verbose:
-            print(sub_id)
+    fit_func, method : str
+        See `fit_th`.
 
+    batch : bool
+        Fit all the curves together (see `SufficientStats.fit`). This is
+        faster, but where the data don't pin down the fit (e.g. a step in a
+        sparse bin), it may find a different one of the equally good fits.
 
-    df = {}
-    df2 = {'subject':[],
-           'abs_ori':[],
-           'rel_ori':[],
-           'cue':[]}
+    pool_sessions : bool
+        Whether to pool the sessions of a subject in the same condition into
+        one fit (the default), or to fit only the last of them, as `get_df`
+        does (see `SufficientStats`).
 
-    for para in range(n_params):
-            df2.update({'p%i'%(para+1):[]})
-    
-    surr_k = ' surr_ori'
-    center_k = ' center_ori'
-    for this_sub in sub_id:
-        if verbose:
-                print("Analyzing %s"%this_sub)
-        df[this_sub] = {(0,0):{}, (0,90):{}, (90,0):{}, (90,90):{}}
-        for this_file in dirlist:
-            # Only look at files from this subject:
-            if this_file.startswith(this_sub):
-                if verbose:
-                        print("File: %s"%this_file)
-                p,l,d = get_data(path_to_files + this_file)
-                # The key differs, depending on the 
-                if 'cue_reliability' in p.keys():
-                    cue_reliability = p['cue_reliability']
-                else:
-                    cue_reliability = p[' cue_reliability']
-                if isinstance(cue_reliability, float):
-                    conds = cue_conds[:2]
-                    for cue in conds:
-                        if verbose: 
-                                print("Condition: %s"%cue)
-                        this=analyze_constant(path_to_files+this_file,
-                                              cue_cond=cue,
-                                              log_scale=False,
-                                              fit_func=fit_func,
-                                              boot=boots,
-                                              verbose=verbose,
-                                              even_or_odd=even_or_odd,
-                                              distractor_high=distractor_high,
-                                              distractor_low=distractor_low,
-                                      analyze_distractor=analyze_distractor)
-
-                        for ii in range(len(this['fit'][0])):
-                            if this['fit'][0][ii] > 1.0:
-                                #print this['fit'][0][ii]
-                                this['fit'][0][ii] = 1.0
-                                #print this['fit'][0][ii]
-                                
-                        df[this_sub][p[center_k],p[surr_k]][cue]=this
-                        df2['subject'].append(this_sub)
-                        df2['abs_ori'].append(str(p[center_k]))
-                        df2['rel_ori'].append(str(np.abs(p[center_k] -
-                                                         p[surr_k])))
-                        df2['cue'].append(cue)
-
-                        for idx, para in enumerate(this['fit'][0]):
-                            df2['p%i'%(idx+1)].append(para)
+    Returns
+    -------
+    fits : array (n_bins, n_subjects, n_center_oris, n_surr_oris, n_cues,
+                  n_params)
+        The fits at the first base contrast. As in `get_df`, parameters
+        above 1 are set to 1, except in the neutral condition. nan in cells
+        without trials.
 
-                else:
-                    if verbose:
-                            print("Condition: neutral")
+    stats : SufficientStats
+        The counts, with the values along each of the dimensions.
 
-                    # The neutral condition takes "other" as input:
-                    this = analyze_constant(path_to_files + this_file,
-                                                  cue_cond='other',
-                                                  log_scale=False,
-                                                  fit_func=fit_func,
-                                                  boot=boots,
-                                                  verbose=verbose,
-                                                  even_or_odd=even_or_odd,
-                                                distractor_high=distractor_high,
-                                                distractor_low=distractor_low,
-                                      analyze_distractor=analyze_distractor)
-
-                    df[this_sub][p[center_k],p[surr_k]]['neutral']=this
-                    df2['subject'].append(this_sub)
-                    # These should be treated as categorical in the ANOVA:
-                    df2['abs_ori'].append(str(p[center_k]))
-                    df2['rel_ori'].append(str(np.abs(p[center_k] - p[surr_k])))
-                    df2['cue'].append(cue)
-
-                    for idx, para in enumerate(this['fit'][0]):
-                            df2['p%i'%(idx+1)].append(para)
+    """
+    stats = SufficientStats(path_to_files, dataset=dataset, subjects=subjects,
+                            distractor_bins=distractor_bins,
+                            pool_sessions=pool_sessions)
+    fits = stats.fit(fit_func, method, batch=batch)[:, :, :, :, 0]
+    fits = np.rollaxis(fits, 4)
+    neutral = stats.cues.index('neutral')
+    cued = np.arange(len(stats.cues)) != neutral
+    fits[:, :, :, :, cued] = np.minimum(fits[:, :, :, :, cued], 1.0)
+    return fits, stats
 
-    return pd.DataFrame(df), pd.DataFrame(df2)
 
 def save_spss_files(df, path='/Users/arokem/Dropbox/att_ss'):
     """
@@ -1160,22 +3510,27 @@ def coeff_of_determination(data, model, axis=-1):
              |_    sum of the squared mean-subtracted data _|
 
 
+    Calculated separately for each slice along `axis`, so that stacked data
+    (e.g. folds x conditions x levels) and models (which are broadcast
+    against the data) get an R^2 per fold and condition in one call. Slices
+    in which it can't be calculated (all the data and model are 0, or the
+    data are constant) are nan.
+
     """
-    # There's no point in doing any of this: 
-    if np.all(data==0.0) and np.all(model==0.0):
-        return np.nan
-    
+    data, model = np.broadcast_arrays(np.asarray(data, dtype=float),
+                                      np.asarray(model, dtype=float))
     residuals = data - model
     ss_err = np.sum(residuals ** 2, axis=axis)
 
-    demeaned_data = data - np.mean(data,-1)[...,np.newaxis]
+    demeaned_data = data - np.mean(data, axis=axis, keepdims=True)
     ss_tot = np.sum(demeaned_data **2, axis=axis)
 
-    # Don't divide by 0:
-    if np.all(ss_tot==0.0):
-        return np.nan
-    
-    return 1 - (ss_err/ss_tot)
+    # There's no point in doing any of this, and don't divide by 0:
+    degenerate = ((np.all(data==0.0, axis=axis) &
+                   np.all(model==0.0, axis=axis)) | (ss_tot==0.0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rr = np.where(degenerate, np.nan, 1 - (ss_err/ss_tot))
+    return rr[()]
 
 def split_half(df, cue, center_ori, surr_ori, perm=None):
     """
@@ -1205,279 +3560,361 @@ def split_half(df, cue, center_ori, surr_ori, perm=None):
     return np.array(x), np.array(y), np.array(mu), np.array(sigma)
 
 
-def model_evaluation_split_half(df):
+def _df_condition(df, cue, center_ori, surr_ori):
     """
-    Evaluate models with split half cross-validation
-    """    
-    oris=[0,90]
-    cue_conds = ['cued', 'other', 'neutral']
-
+    The x, y and fit parameters of all the subjects in df (see `get_df`), in
+    one condition, as arrays. As in the model evaluation functions, the data
+    for (center_ori, surr_ori) are taken from df[k][surr_ori, center_ori].
 
-    sh_y = {(0,0):dict.fromkeys(cue_conds),
-             (0,90):dict.fromkeys(cue_conds),
-             (90,0):dict.fromkeys(cue_conds),
-             (90,90):dict.fromkeys(cue_conds)}
+    Returns
+    -------
+    x : array (n_levels,)
+        From the last subject.
+    y : array (n_subjects, n_levels)
+    params : array (n_subjects, n_params)
 
-    sh_mu = {(0,0):dict.fromkeys(cue_conds),
-             (0,90):dict.fromkeys(cue_conds),
-             (90,0):dict.fromkeys(cue_conds),
-             (90,90):dict.fromkeys(cue_conds)}
+    """
+    keys = list(df.keys())
+    y = np.array([df[k][surr_ori, center_ori][cue]['y'] for k in keys])
+    params = np.array([df[k][surr_ori, center_ori][cue]['fit'][0]
+                       for k in keys])
+    x = np.array(df[keys[-1]][surr_ori, center_ori][cue]['x'])
+    return x, y, params
+
+def _stack_df(df, oris=[0,90], cue_conds=['cued', 'other', 'neutral']):
+    """
+    Stack y and the fit parameters of all the conditions in df (see
+    `_df_condition`) into arrays.
 
-    sh_sigma = {(0,0):dict.fromkeys(cue_conds),
-                 (0,90):dict.fromkeys(cue_conds),
-                 (90,0):dict.fromkeys(cue_conds),
-                 (90,90):dict.fromkeys(cue_conds)}
+    Returns
+    -------
+    x : array (n_levels,)
+        From the last subject in the last condition.
+    y : array (n_subjects, n_center_oris, n_surr_oris, n_cues, n_levels)
+    params : array (n_subjects, n_center_oris, n_surr_oris, n_cues, n_params)
 
-    for center_ori in oris:
-        for surr_ori in oris: 
-            for cue in cue_conds:
-                perm = np.random.permutation(df.keys())
-                (x,
-                 sh_y[center_ori, surr_ori][cue],
-                 sh_mu[center_ori, surr_ori][cue],
-                 sh_sigma[center_ori, surr_ori][cue]) = split_half(df,
-                                                                   cue,
-                                                                   center_ori,
-                                                                   surr_ori,
-                                                                   perm)
-
-    RR = []
-
-    # First model: nothing matters: all averages all the time:
+    """
     y = []
-    pred = []
+    params = []
     for center_ori in oris:
-        for surr_ori in oris: 
+        for surr_ori in oris:
             for cue in cue_conds:
-                y.append(np.mean(sh_y[center_ori, surr_ori][cue], 0))
-                
-                mu = np.mean([np.mean(sh_mu[0, 0]['cued'],0),
-                              np.mean(sh_mu[0, 0]['neutral'],0),
-                              np.mean(sh_mu[0, 0]['other'],0),
-                              np.mean(sh_mu[0, 90]['cued'],0),
-                              np.mean(sh_mu[0, 90]['neutral'],0),
-                              np.mean(sh_mu[0, 90]['other'],0),
-                              np.mean(sh_mu[90, 90]['cued'],0),
-                              np.mean(sh_mu[90, 90]['neutral'],0),
-                              np.mean(sh_mu[90, 90]['other'],0),
-                              np.mean(sh_mu[90, 0]['cued'],0),
-                              np.mean(sh_mu[90, 0]['neutral'],0),
-                              np.mean(sh_mu[90, 0]['other'],0)])
-
-                sigma = np.mean([np.mean(sh_sigma[0, 0]['cued'],0),
-                              np.mean(sh_sigma[0, 0]['neutral'],0),
-                              np.mean(sh_sigma[0, 0]['other'],0),
-                              np.mean(sh_sigma[0, 90]['cued'],0),
-                              np.mean(sh_sigma[0, 90]['neutral'],0),
-                              np.mean(sh_sigma[0, 90]['other'],0),
-                              np.mean(sh_sigma[90, 90]['cued'],0),
-                              np.mean(sh_sigma[90, 90]['neutral'],0),
-                              np.mean(sh_sigma[90, 90]['other'],0),
-                              np.mean(sh_sigma[90, 0]['cued'],0),
-                              np.mean(sh_sigma[90, 0]['neutral'],0),
-                              np.mean(sh_sigma[90, 0]['other'],0)])
-                
-                pred.append(cumgauss(x, mu, sigma))
-    RR.append(coeff_of_determination(np.array(y).ravel(),np.array(pred).ravel()))
+                x, this_y, this_params = _df_condition(df, cue, center_ori,
+                                                       surr_ori)
+                y.append(this_y)
+                params.append(this_params)
+    shape = (len(oris), len(oris), len(cue_conds))
+    y = np.rollaxis(np.array(y), 1).reshape((-1,) + shape + (x.shape[0],))
+    params = np.rollaxis(np.array(params), 1).reshape((-1,) + shape +
+                                                      (params[0].shape[-1],))
+    return x, y, params
+
+class ModelSpec(object):
+    """
+    A model of the psychometric function parameters across the conditions of
+    the experiment, for cross-validated model comparison (see
+    `evaluate_models`). Each of mu and sigma is pooled (averaged) across all
+    the conditions that share the levels of the factors it depends on:
+
+    'abs_ori' : the orientation of the center (0/90)
+    'rel_ori' : whether the surround is parallel or orthogonal to the center
+    'cue' : the cue condition (cued/other/neutral)
+
+    Examples
+    --------
+    >>> null = ModelSpec(name='null')
+    >>> full = ModelSpec(mu=['abs_ori', 'rel_ori', 'cue'],
+    ...                  sigma=['abs_ori', 'rel_ori', 'cue'])
+    >>> slope = ModelSpec(mu=['rel_ori'], sigma=['rel_ori', 'cue'])
 
-    # Second model: both mu and sigma depend on both surround condition
-    # (para/ortho) and attention (cued/other/neutral):  
-    y = []
-    pred = []
-    for center_ori in oris:
-        for surr_ori in oris: 
-            for cue in cue_conds:
-                y.append(np.mean(sh_y[center_ori, surr_ori][cue], 0))
-                if center_ori == surr_ori:
-                    sigma = np.mean([np.mean(sh_sigma[0, 0][cue],0),
-                                     np.mean(sh_sigma[90, 90][cue],0)])
-                                    
-                    mu = np.mean([np.mean(sh_mu[0, 0][cue],0),
-                                  np.mean(sh_mu[90, 90][cue],0)])
-                                    
-                else:
-                    sigma = np.mean([np.mean(sh_sigma[0, 90][cue],0),
-                                     np.mean(sh_sigma[90, 0][cue],0)])
+    """
+    factors = ['abs_ori', 'rel_ori', 'cue']
+
+    def __init__(self, mu=[], sigma=[], name=None):
+        for f in list(mu) + list(sigma):
+            if f not in self.factors:
+                raise ValueError("Unknown factor '%s', should be one of %s"%(
+                                 f, self.factors))
+        # Sorted, so that equivalent models share their pooled parameters:
+        self.mu = tuple(sorted(set(mu)))
+        self.sigma = tuple(sorted(set(sigma)))
+        if name is None:
+            name = 'mu(%s), sigma(%s)'%(', '.join(self.mu),
+                                        ', '.join(self.sigma))
+        self.name = name
+
+    def __repr__(self):
+        return 'ModelSpec(%s)'%self.name
+
+def _condition_labels(oris, cue_conds):
+    """
+    The level of each factor of `ModelSpec` in each (center_ori, surr_ori,
+    cue) condition, as integer arrays with the shape of the conditions
+    """
+    center, surr, cue = np.meshgrid(oris, oris, np.arange(len(cue_conds)),
+                                    indexing='ij')
+    return dict(abs_ori=np.searchsorted(np.sort(oris), center),
+                rel_ori=(center != surr).astype(int),
+                cue=cue)
+
+def random_halves(n_splits, n_subjects, shape=(), rng=None):
+    """
+    Many random split-halves of the subjects at once.
 
-                    mu = np.mean([np.mean(sh_mu[0, 90][cue],0),
-                                  np.mean(sh_mu[90, 0][cue],0)])
-     
-                pred.append(cumgauss(x, mu, sigma))
-    RR.append(coeff_of_determination(np.array(y).ravel(),np.array(pred).ravel()))
+    Each split ranks the subjects by a row of uniform random numbers, which
+    is a random permutation of them, and puts the first n_subjects // 2 in
+    the test half.
 
-    
-    # Third model: mu depends on surround condition (para/ortho), sigma
-    # depends on both surround condition (para/ortho) and attention
-    # (cued/other/neutral):  
-    y = []
-    pred = []
-    for center_ori in oris:
-        for surr_ori in oris: 
-            for cue in cue_conds:
-                y.append(np.mean(sh_y[center_ori, surr_ori][cue], 0))
-                if center_ori == surr_ori:
-                    sigma = np.mean([np.mean(sh_sigma[0, 0][cue],0),
-                                     np.mean(sh_sigma[90, 90][cue],0)])
-                                    
-                    mu = np.mean([np.mean(sh_mu[0, 0]['cued'],0),
-                                  np.mean(sh_mu[0, 0]['neutral'],0),
-                                  np.mean(sh_mu[0, 0]['other'],0),
-                                  np.mean(sh_mu[90, 90]['cued'],0),
-                                  np.mean(sh_mu[90, 90]['neutral'],0),
-                                  np.mean(sh_mu[90, 90]['other'],0)])
-                else:
-                    sigma = np.mean([np.mean(sh_sigma[0, 90][cue],0),
-                                     np.mean(sh_sigma[90, 0][cue],0)])
+    Parameters
+    ----------
+    n_splits : int
+    n_subjects : int
+    shape : tuple
+        Draw a separate split for each element of an array of this shape
+        (e.g. for each condition).
+    rng : RandomState, optional
+
+    Returns
+    -------
+    test : bool array (n_splits, n_subjects) + shape
+
+    """
+    if rng is None:
+        rng = np.random
+    u = rng.random_sample((n_splits,) + tuple(shape) + (n_subjects,))
+    rank = np.argsort(np.argsort(u, -1), -1)
+    return np.rollaxis(rank < n_subjects // 2, -1, 1)
+
+def cv_folds(n_subjects, scheme='loo', k=10, seed=None, n_splits=1):
+    """
+    The membership of subjects in the test set of each cross-validation fold.
+
+    Parameters
+    ----------
+    n_subjects : int
+    scheme : str
+        'loo' (leave-one-out), 'split_half' (random splits: half the subjects
+        are tested, the rest trained on, see `random_halves`) or 'kfold'.
+    k : int
+        The number of folds for 'kfold'.
+    seed : int or None
+        Seeds the random permutations for 'split_half' and 'kfold'.
+    n_splits : int
+        The number of random splits for 'split_half'.
+
+    Returns
+    -------
+    test : bool array (n_folds, n_subjects)
+        True for the test subjects of each fold. All the other subjects are
+        the training set.
+
+    """
+    if scheme == 'loo':
+        return np.eye(n_subjects, dtype=bool)
+    rng = np.random.RandomState(seed)
+    if scheme == 'split_half':
+        return random_halves(n_splits, n_subjects, rng=rng)
+    elif scheme != 'kfold':
+        raise ValueError("scheme should be 'loo', 'split_half' or 'kfold'")
+    folds = np.array_split(rng.permutation(n_subjects), k)
+    test = np.zeros((len(folds), n_subjects), dtype=bool)
+    for i, fold in enumerate(folds):
+        test[i, fold] = True
+    return test
+
+def evaluate_models(df, models, scheme='loo', test=None, k=10, seed=None,
+                    n_splits=1, per_condition=False, oris=[0,90],
+                    cue_conds=['cued', 'other', 'neutral']):
+    """
+    Cross-validated comparison of models of the psychometric function
+    parameters across conditions.
+
+    In each fold, the parameters of the training subjects are averaged in
+    each condition and then pooled across conditions according to each
+    model (see `ModelSpec`). The predictions are evaluated (R^2) against the
+    mean proportions of the test subjects. The per-fold condition means and
+    pooled parameters are computed once and shared by all the models.
+
+    Parameters
+    ----------
+    df : the first output of `get_df`
+    models : list of ModelSpec
+    scheme : str
+        The cross-validation scheme (see `cv_folds`), when test is None
+    test : bool array (n_folds, n_subjects), optional
+        The test subjects in each fold. Can also be (n_folds, n_subjects,
+        n_center_oris, n_surr_oris, n_cues), for a different split in each
+        condition.
+    k, seed, n_splits : passed to `cv_folds`
+    per_condition : bool
+        Whether to calculate R^2 separately in each condition, rather than
+        over all the conditions together.
+
+    Returns
+    -------
+    RR : array (n_models, n_folds), or (n_models, n_folds, n_center_oris,
+        n_surr_oris, n_cues) with per_condition
+
+    """
+    x, y, params = _stack_df(df, oris, cue_conds)
+    n_sub = params.shape[0]
+    if test is None:
+        test = cv_folds(n_sub, scheme, k=k, seed=seed, n_splits=n_splits)
+    test = np.asarray(test, dtype=bool)
+    test = test.reshape(test.shape + (1,) * (5 - test.ndim))
+    test = np.broadcast_to(test, test.shape[:2] + y.shape[1:4]).astype(float)
+    train = 1 - test
+
+    # The means of the training and test subjects in each fold and
+    # condition:
+    fold_params = (np.einsum('fscuq,scuqp->fcuqp', train, params) /
+                   np.sum(train, 1)[..., np.newaxis])
+    fold_y = (np.einsum('fscuq,scuql->fcuql', test, y) /
+              np.sum(test, 1)[..., np.newaxis])
+
+    labels = _condition_labels(oris, cue_conds)
+    shape = fold_params.shape[:-1]
+    pooled = {}
+    def pool(param_idx, factors):
+        key = (param_idx, factors)
+        if key not in pooled:
+            if len(factors):
+                group = np.ravel_multi_index([labels[f].ravel()
+                                              for f in factors],
+                                             [labels[f].max() + 1
+                                              for f in factors])
+            else:
+                group = np.zeros(labels['cue'].size, dtype=int)
+            group = np.unique(group, return_inverse=True)[1]
+            member = np.eye(group.max() + 1)[group]
+            this = fold_params[..., param_idx].reshape(shape[0], -1)
+            this = np.dot(this, member) / np.sum(member, 0)
+            pooled[key] = this[:, group].reshape(shape)
+        return pooled[key]
+
+    mu = np.array([pool(0, m.mu) for m in models])
+    sigma = np.array([pool(1, m.sigma) for m in models])
+    pred = cumgauss(x, mu[..., np.newaxis], sigma[..., np.newaxis])
+    if per_condition:
+        return coeff_of_determination(fold_y, pred)
+    return coeff_of_determination(fold_y.reshape(fold_y.shape[0], -1),
+                      pred.reshape(pred.shape[:2] + (-1,)))
+
+def model_evaluation_split_half(df, n_splits=None, seed=None):
+    """
+    Evaluate models with split half cross-validation
 
-                    mu = np.mean([np.mean(sh_mu[0, 90]['cued'],0),
-                                  np.mean(sh_mu[0, 90]['neutral'],0),
-                                  np.mean(sh_mu[0, 90]['other'],0),
-                                  np.mean(sh_mu[90, 0]['cued'],0),
-                                  np.mean(sh_mu[90, 0]['neutral'],0),
-                                  np.mean(sh_mu[90, 0]['other'],0)])
+    The models (see `ModelSpec`) are:
+
+    1. Nothing matters: all averages all the time.
+    2. Both mu and sigma depend on both surround condition (para/ortho) and
+       attention (cued/other/neutral).
+    3. mu depends on surround condition (para/ortho), sigma depends on both
+       surround condition (para/ortho) and attention (cued/other/neutral).
+
+    The subjects are randomly split in half separately in each condition.
+
+    Parameters
+    ----------
+    df : the first output of `get_df`
+    n_splits : int, optional
+        Repeat the evaluation over this many random splits (see
+        `random_halves`), which are all evaluated together.
+    seed : int, optional
+        Seeds the repeated splits. Otherwise the global numpy random state is
+        used.
 
-                              
-                pred.append(cumgauss(x, mu, sigma))
-    RR.append(coeff_of_determination(np.array(y).ravel(),np.array(pred).ravel()))
+    Returns
+    -------
+    RR : list
+        The R^2 of each model. With n_splits, an array (n_models, n_splits)
+        with the R^2 of each model in each split.
 
-    return RR
+    """
+    oris=[0,90]
+    cue_conds = ['cued', 'other', 'neutral']
+    models = [ModelSpec(),
+              ModelSpec(mu=['rel_ori', 'cue'], sigma=['rel_ori', 'cue']),
+              ModelSpec(mu=['rel_ori'], sigma=['rel_ori', 'cue'])]
+
+    n_sub = len(df.keys())
+    shape = (len(oris), len(oris), len(cue_conds))
+    if n_splits is not None:
+        if seed is None:
+            rng = np.random
+        else:
+            rng = np.random.RandomState(seed)
+        test = random_halves(n_splits, n_sub, shape, rng)
+        return evaluate_models(df, models, test=test, oris=oris,
+                               cue_conds=cue_conds)
+
+    test = np.zeros((1, n_sub) + shape, dtype=bool)
+    for c_idx in range(len(oris)):
+        for s_idx in range(len(oris)):
+            for q_idx in range(len(cue_conds)):
+                perm = np.random.permutation(n_sub)
+                test[0, perm[:n_sub // 2], c_idx, s_idx, q_idx] = True
+
+    RR = evaluate_models(df, models, test=test, oris=oris,
+                         cue_conds=cue_conds)
+    return list(RR[:, 0])
 
 def loo_data(df, cue, center_ori, surr_ori):
     """
     Get leave-one-out data for a particular condition
     """
-    mu = []
-    sigma = []
-    loo_y = []
-    keys = df.keys()
-    for loo in keys:
-        this_loo = df[loo]
-        loo_y.append(this_loo[surr_ori, center_ori][cue]['y'])
-        x = this_loo[surr_ori, center_ori][cue]['x']
-        mu.append([])
-        sigma.append([])
-        
-        for k  in keys:
-            if k!=loo:
-                this_sub = df[k]
-                params = this_sub[surr_ori,center_ori][cue]['fit'][0]
-                mu[-1].append(params[0])
-                sigma[-1].append(params[1])
-        
-    return np.array(x), np.array(loo_y), np.array(mu), np.array(sigma)
+    x, loo_y, params = _df_condition(df, cue, center_ori, surr_ori)
+    # The parameters of all the other subjects, for each subject:
+    n_sub = params.shape[0]
+    others = ~np.eye(n_sub, dtype=bool)
+    mu = params[:, 0][np.where(others)[1]].reshape(n_sub, n_sub - 1)
+    sigma = params[:, 1][np.where(others)[1]].reshape(n_sub, n_sub - 1)
+    return x, loo_y, mu, sigma
 
 def model_evaluation_loo(df):
     """
 
     Evaluate a model with LOO cross-validation
 
+    For each left-out subject, three models (see `ModelSpec`) are fit with
+    the mean parameters of all the other subjects and evaluated (R^2) on the
+    left-out subject's data:
+
+    1. Nothing matters: mu and sigma are the means across all conditions.
+    2. mu and sigma are the means in each condition.
+    3. Surround suppression affects both, cueing affects only the slope: mu
+       is the mean across the cue conditions, sigma the mean in each
+       condition.
+
+    Returns
+    -------
+    RR1, RR2, RR3 : dicts
+        The R^2 of each model, with one value per left-out subject, in
+        RR[center_ori, surr_ori][cue].
+
     """
     oris=[0,90]
     cue_conds = ['cued', 'other', 'neutral']
-    loo_y = {(0,0):dict.fromkeys(cue_conds),
-             (0,90):dict.fromkeys(cue_conds),
-             (90,0):dict.fromkeys(cue_conds),
-             (90,90):dict.fromkeys(cue_conds)}
-
-    loo_mu = {(0,0):dict.fromkeys(cue_conds),
-             (0,90):dict.fromkeys(cue_conds),
-             (90,0):dict.fromkeys(cue_conds),
-             (90,90):dict.fromkeys(cue_conds)}
-
-    loo_sigma = {(0,0):dict.fromkeys(cue_conds),
-                 (0,90):dict.fromkeys(cue_conds),
-                 (90,0):dict.fromkeys(cue_conds),
-                 (90,90):dict.fromkeys(cue_conds)}
-
-    RR1 = {(0,0):dict.fromkeys(cue_conds),
-           (0,90):dict.fromkeys(cue_conds),
-           (90,0):dict.fromkeys(cue_conds),
-           (90,90):dict.fromkeys(cue_conds)}
-
-    RR2 = {(0,0):dict.fromkeys(cue_conds),
-           (0,90):dict.fromkeys(cue_conds),
-           (90,0):dict.fromkeys(cue_conds),
-           (90,90):dict.fromkeys(cue_conds)}
-
-    RR3 = {(0,0):dict.fromkeys(cue_conds),
-           (0,90):dict.fromkeys(cue_conds),
-           (90,0):dict.fromkeys(cue_conds),
-           (90,90):dict.fromkeys(cue_conds)}
-
-    for center_ori in oris:
-        for surr_ori in oris: 
-            for cue in cue_conds:
-                (x,
-                 loo_y[center_ori, surr_ori][cue],
-                 loo_mu[center_ori, surr_ori][cue],
-                 loo_sigma[center_ori, surr_ori][cue]) = loo_data(df,
-                                                                  cue,
-                                                                  center_ori,
-                                                                  surr_ori)
-                
-    for center_ori in oris:
-        for surr_ori in oris: 
-            for cue in cue_conds:
-                # First model: nothing matters, everything is just the mean:
-                RR1[center_ori, surr_ori][cue]=[]
-                for loo_idx in range(len(df.keys())):
-                    mu = np.mean([loo_mu[0,0]['neutral'][loo_idx],
-                                  loo_mu[0,90]['neutral'][loo_idx],
-                                  loo_mu[90,90]['neutral'][loo_idx],
-                                  loo_mu[90,0]['neutral'][loo_idx],
-                                  loo_mu[0,0]['cued'][loo_idx],
-                                  loo_mu[0,90]['cued'][loo_idx],
-                                  loo_mu[90,90]['cued'][loo_idx],
-                                  loo_mu[90,0]['cued'][loo_idx],
-                                  loo_mu[0,0]['other'][loo_idx],
-                                  loo_mu[0,90]['other'][loo_idx],
-                                  loo_mu[90,90]['other'][loo_idx],
-                                  loo_mu[90,0]['other'][loo_idx]])
-
-                    sigma = np.mean([loo_sigma[0,0]['neutral'][loo_idx],
-                                  loo_sigma[0,90]['neutral'][loo_idx],
-                                  loo_sigma[90,90]['neutral'][loo_idx],
-                                  loo_sigma[90,0]['neutral'][loo_idx],
-                                  loo_sigma[0,0]['cued'][loo_idx],
-                                  loo_sigma[0,90]['cued'][loo_idx],
-                                  loo_sigma[90,90]['cued'][loo_idx],
-                                  loo_sigma[90,0]['cued'][loo_idx],
-                                  loo_sigma[0,0]['other'][loo_idx],
-                                  loo_sigma[0,90]['other'][loo_idx],
-                                  loo_sigma[90,90]['other'][loo_idx],
-                                  loo_sigma[90,0]['other'][loo_idx]])
-
-                    RR1[center_ori, surr_ori][cue].append(
-            coeff_of_determination(loo_y[center_ori, surr_ori][cue][loo_idx],
-                                   cumgauss(x, mu, sigma)))
-                # Second model: just the specific condition:
-                RR2[center_ori, surr_ori][cue]=[]
-                for loo_idx in range(len(df.keys())):
-                    mu=np.mean(loo_mu[center_ori, surr_ori][cue][loo_idx])
-                    sigma=np.mean(loo_sigma[center_ori, surr_ori][cue][loo_idx])
-                    
-                    RR2[center_ori, surr_ori][cue].append(
-            coeff_of_determination(loo_y[center_ori, surr_ori][cue][loo_idx],
-                                           cumgauss(x, mu, sigma)))
-                # Third model: surround suppression affects both, cueing
-                # affects slope
-                RR3[center_ori, surr_ori][cue]=[]
-                for loo_idx in range(len(df.keys())):
-                    mu=np.mean(np.hstack(
-                        [loo_mu[center_ori, surr_ori]['cued'][loo_idx],
-                         loo_mu[center_ori, surr_ori]['neutral'][loo_idx],
-                         loo_mu[center_ori, surr_ori]['other'][loo_idx]]))
-                    
-                    sigma=np.mean(loo_sigma[center_ori,surr_ori][cue][loo_idx])
-    
-                    RR3[center_ori, surr_ori][cue].append(
-            coeff_of_determination(loo_y[center_ori, surr_ori][cue][loo_idx],
-                                   cumgauss(x, mu, sigma)))
-
-    
+    all_factors = ['abs_ori', 'rel_ori', 'cue']
+    models = [ModelSpec(),
+              ModelSpec(mu=all_factors, sigma=all_factors),
+              ModelSpec(mu=['abs_ori', 'rel_ori'], sigma=all_factors)]
+    RR = evaluate_models(df, models, scheme='loo', per_condition=True,
+                         oris=oris, cue_conds=cue_conds)
+
+    out = []
+    for m in range(RR.shape[0]):
+        this_RR = {}
+        for c_idx, center_ori in enumerate(oris):
+            for s_idx, surr_ori in enumerate(oris):
+                this_RR[center_ori, surr_ori] = dict(
+                    [(cue, list(RR[m, :, c_idx, s_idx, q_idx]))
+                     for q_idx, cue in enumerate(cue_conds)])
+        out.append(this_RR)
+    RR1, RR2, RR3 = out
     return RR1,RR2,RR3
 
-def bootstrap_mean(x, alpha=0.05, b=1000):
+def bootstrap_mean(x, alpha=0.05, b=1000, streaming=False, chunk=1000):
     """
     Calculate bootstrap 1-alpha percentile CI of the mean from a sample x
 
@@ -1491,29 +3928,234 @@ def bootstrap_mean(x, alpha=0.05, b=1000):
     b : int
        The number of bootstrap samples
 
+    streaming : bool
+       If True, the bootstrap means are drawn `chunk` at a time and the
+       bounds are estimated on the fly with `P2Quantile`, so that memory
+       doesn't grow with b. This is approximate (see `P2Quantile`).
+
+    chunk : int
+       The number of bootstrap samples drawn at a time, when streaming.
+
     Returns
     -------
     lb, ub : the lower and upper bounds of the confidence interval
     
     """
-    means = np.empty(b)
-    
-    for ii in xrange(b):
-        idx = np.random.randint(0, len(x), len(x))
-        means[ii] = np.mean(x[idx])
+    if streaming:
+        lb = P2Quantile(alpha/2)
+        ub = P2Quantile(1-(alpha/2))
+        for start in range(0, b, chunk):
+            idx = np.random.randint(0, len(x), (min(chunk, b - start), len(x)))
+            means = np.mean(x[idx], -1)
+            lb.update(means)
+            ub.update(means)
+        return lb.value, ub.value
+
+    lb, ub = bootstrap_means([x], alpha=alpha, b=b)
+    return lb[0], ub[0]
+
+
+def bootstrap_means(samples, alpha=0.05, b=1000, method='percentile',
+                    seed=None):
+    """
+    Bootstrap 1-alpha CIs of the means of many samples at once.
 
-    sort_means = np.sort(means)
-    lb_idx = int(b * alpha/2)
-    ub_idx = int(b * (1-(alpha/2)))
+    All the bootstrap samples are drawn as one (b, n) array of indices, which
+    is used for all the samples, and the means are computed with one
+    reduction. For samples of different sizes, the indices are drawn as
+    uniform numbers in [0, 1) and scaled to the size of each sample.
 
-    return sort_means[lb_idx], sort_means[ub_idx]
-    
-        
-        
+    Parameters
+    ----------
+    samples : 2d array (n_samples, n), or a list of 1d arrays
+        The samples. They can be of different sizes.
 
+    alpha : float
+        The CIs are the 1-alpha intervals.
 
-    
+    b : int
+        The number of bootstrap samples.
 
+    method : str
+        'percentile' (default), the same as `bootstrap_mean`, or 'bca' for
+        bias-corrected and accelerated intervals (Efron, 1987). The
+        acceleration is estimated with the jackknife. Samples for which the
+        corrections can't be estimated (e.g. all values equal) get the
+        percentile interval.
 
+    seed : int
+        Seed for the random number generator. If None (default), the global
+        numpy random state is used.
 
-    
+    Returns
+    -------
+    lb, ub : arrays (n_samples,)
+        The lower and upper bounds of the CIs.
+
+    """
+    if seed is None:
+        rng = np.random
+    else:
+        rng = np.random.RandomState(seed)
+
+    samples = [np.asarray(x, dtype=float) for x in samples]
+    sizes = np.array([x.shape[0] for x in samples])
+    n = np.max(sizes)
+    flat = np.concatenate(samples)
+    offsets = np.cumsum(sizes) - sizes
+    if np.all(sizes == n):
+        idx = rng.randint(0, n, (b, n))[np.newaxis]
+        mask = 1
+    else:
+        idx = (rng.random_sample((b, n))[np.newaxis] *
+               sizes[:, np.newaxis, np.newaxis]).astype(int)
+        # Only the first n_i draws count for a sample of size n_i:
+        mask = np.arange(n) < sizes[:, np.newaxis, np.newaxis]
+        idx = np.where(mask, idx, 0)
+    # (n_samples, b):
+    means = (np.sum(np.take(flat, offsets[:, np.newaxis, np.newaxis] + idx)
+                    * mask, -1) / sizes[:, np.newaxis])
+
+    q = np.array([alpha/2, 1-(alpha/2)])[np.newaxis] * np.ones((len(samples),
+                                                               1))
+    if method == 'bca':
+        theta = np.array([np.mean(x) for x in samples])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z0 = ndtri(np.mean(means < theta[:, np.newaxis], -1))
+            # Jackknife estimate of the acceleration:
+            jack = [(np.sum(x) - x) / (x.shape[0] - 1) for x in samples]
+            d = [np.mean(j) - j for j in jack]
+            acc = np.array([np.sum(dd ** 3) / (6 * np.sum(dd ** 2) ** 1.5)
+                            for dd in d])
+            z = ndtri(q)
+            z0 = z0[:, np.newaxis]
+            bca_q = ndtr(z0 + (z0 + z) / (1 - acc[:, np.newaxis] * (z0 + z)))
+        ok = np.all(np.isfinite(bca_q), -1)
+        q[ok] = bca_q[ok]
+    elif method != 'percentile':
+        raise ValueError("Unknown method: %s"%method)
+
+    k = np.minimum((q * b).astype(int), b - 1)
+    means.sort(-1)
+    bounds = means[np.arange(len(samples))[:, np.newaxis], k]
+    return bounds[:, 0], bounds[:, 1]
+
+
+def order_statistic(values, q):
+    """
+    The element at position int(q * n) of the n sorted values. This is how
+    the bootstrap confidence intervals are read off the bootstrap samples.
+    np.partition finds these without sorting all the values.
+
+    Parameters
+    ----------
+    values : 1d array
+
+    q : float or sequence of floats
+        Between 0 and 1.
+
+    Returns
+    -------
+    The element (or an array with an element for each q)
+
+    """
+    values = np.asarray(values)
+    n = values.shape[0]
+    k = np.minimum((np.asarray(q) * n).astype(int), n - 1)
+    part = np.partition(values, np.unique(k))
+    return part[k]
+
+
+class P2Quantile(object):
+    """
+    Streaming estimate of a quantile, with the P-square algorithm [1].
+
+    Only five markers are kept, whose heights are adjusted as values come in,
+    so the memory used doesn't depend on the number of values. The estimate
+    is approximate: for 1000 or more values, the tail percentiles used for
+    the bootstrap confidence intervals come within about a hundredth of a
+    standard deviation of the exact order statistic (see benchmarks.py).
+
+    [1] Jain, R. and Chlamtac, I. (1985). The P-square algorithm for dynamic
+    calculation of quantiles and histograms without storing observations.
+    Communications of the ACM, 28: 1076-1085.
+
+    """
+    def __init__(self, q):
+        """
+        Parameters
+        ----------
+        q : float
+            The quantile to estimate, between 0 and 1.
+
+        """
+        self.q = q
+        self.n = 0
+        self.heights = []
+        self.pos = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2*q, 1 + 4*q, 3 + 2*q, 5]
+        self.increments = [0, q/2., q, (1 + q)/2., 1]
+
+    def update(self, values):
+        """
+        Add one or more values
+        """
+        for v in np.ravel(values):
+            self._add(float(v))
+
+    def _add(self, v):
+        self.n += 1
+        h = self.heights
+        if self.n <= 5:
+            h.append(v)
+            h.sort()
+            return
+
+        # Find the cell in which v falls, extending the extremes if needed:
+        if v < h[0]:
+            h[0] = v
+            k = 0
+        elif v >= h[4]:
+            h[4] = v
+            k = 3
+        else:
+            k = 0
+            while v >= h[k + 1]:
+                k += 1
+
+        pos = self.pos
+        for i in range(k + 1, 5):
+            pos[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # Move the middle markers towards their desired positions:
+        for i in range(1, 4):
+            d = self.desired[i] - pos[i]
+            if ((d >= 1 and pos[i + 1] - pos[i] > 1) or
+                (d <= -1 and pos[i - 1] - pos[i] < -1)):
+                d = 1 if d > 0 else -1
+                # Piecewise-parabolic prediction:
+                hp = h[i] + d / float(pos[i + 1] - pos[i - 1]) * (
+                    (pos[i] - pos[i - 1] + d) * (h[i + 1] - h[i]) /
+                    float(pos[i + 1] - pos[i]) +
+                    (pos[i + 1] - pos[i] - d) * (h[i] - h[i - 1]) /
+                    float(pos[i] - pos[i - 1]))
+                if not h[i - 1] < hp < h[i + 1]:
+                    # Fall back to linear:
+                    hp = h[i] + d * (h[i + d] - h[i]) / float(pos[i + d] -
+                                                              pos[i])
+                h[i] = hp
+                pos[i] += d
+
+    @property
+    def value(self):
+        """
+        The current estimate of the quantile
+        """
+        if self.n == 0:
+            return np.nan
+        if self.n <= 5:
+            # Exact, for so few values:
+            return order_statistic(self.heights, self.q)
+        return self.heights[2]